@@ -17,6 +17,11 @@ class KnowledgeChunkError(BaseErrorCode):
     Msg: str = '当前知识库版本不支持修改分段，请创建新知识库后进行分段修改'
 
 
+class KnowledgeChunkCursorError(BaseErrorCode):
+    Code: int = 10911
+    Msg: str = '分段分页游标无效，请从第一页重新查询'
+
+
 class KnowledgeSimilarError(BaseErrorCode):
     Code: int = 10920
     Msg: str = '未配置QA知识库相似问模型'
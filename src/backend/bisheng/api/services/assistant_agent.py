@@ -1,5 +1,7 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 from pathlib import Path
@@ -13,6 +15,7 @@ from bisheng_langchain.gpts.auto_tool_selected import ToolInfo, ToolSelector
 from bisheng_langchain.gpts.load_tools import load_tools
 from bisheng_langchain.gpts.prompts import ASSISTANT_PROMPT_OPT
 from bisheng_langchain.gpts.tools.api_tools.openapi import OpenApiTools
+from cachetools import TTLCache
 from langchain_core.callbacks import Callbacks
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.messages import AIMessage, HumanMessage, BaseMessage
@@ -31,13 +34,44 @@ from bisheng.api.utils import build_flow_no_yield
 from bisheng.api.v1.schemas import InputRequest
 from bisheng.database.constants import ToolPresetType
 from bisheng.database.models.assistant import Assistant, AssistantLink, AssistantLinkDao
-from bisheng.database.models.flow import FlowDao, FlowStatus
+from bisheng.database.models.flow import Flow, FlowDao, FlowStatus
 from bisheng.database.models.gpts_tools import GptsTools, GptsToolsDao, GptsToolsType
 from bisheng.database.models.knowledge import Knowledge, KnowledgeDao
+from bisheng.interface.memories.base import memory_creator
 from bisheng.mcp_manage.langchain.tool import McpTool
 from bisheng.mcp_manage.manager import ClientManager
 from bisheng.settings import settings
 from bisheng.utils.embedding import decide_embeddings
+from bisheng.utils.token_count import trim_messages_by_token
+
+# 助手关联的技能构建好的对象，不同会话直接复用，省去技能的构建时间
+# key里包含技能的更新时间和数据摘要，技能修改后不会再命中旧的对象
+_flow_tool_cache = TTLCache(maxsize=128, ttl=3600)
+_flow_tool_lock = threading.Lock()
+
+
+def flow_tool_cache_key(flow: Flow) -> tuple:
+    data_hash = hashlib.md5(json.dumps(flow.data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return flow.id, str(flow.update_time), data_hash
+
+
+def flow_has_memory(graph_data: dict) -> bool:
+    """ 技能中是否有记忆组件，记忆组件包含会话状态，构建好的对象不能在会话之间共享 """
+    memory_types = set(memory_creator.to_list())
+    for node in (graph_data or {}).get('nodes', []):
+        node_data = node.get('data', {})
+        if node_data.get('type') in memory_types:
+            return True
+        if 'BaseMemory' in node_data.get('node', {}).get('base_classes', []):
+            return True
+    return False
+
+
+def invalidate_flow_tool_cache(flow_id: str):
+    """ 技能修改、下线或者删除后清理构建好的对象 """
+    with _flow_tool_lock:
+        for key in [one for one in _flow_tool_cache.keys() if one[0] == flow_id]:
+            _flow_tool_cache.pop(key, None)
 
 
 class AssistantAgent(AssistantUtils):
@@ -373,20 +407,14 @@ class AssistantAgent(AssistantUtils):
                     continue
                 if one_flow_data.status != FlowStatus.ONLINE.value:
                     self.offline_flows.append(tool_name)
+                    invalidate_flow_tool_cache(link.flow_id)
                     logger.warning('act=init_tools not online flow_id: {}', link.flow_id)
                     continue
-                flow_graph_data = one_flow_data.data
                 tool_description = f'{one_flow_data.name}:{one_flow_data.description}'
 
                 try:
-                    artifacts = {}
-                    graph = await build_flow_no_yield(graph_data=flow_graph_data,
-                                                      artifacts=artifacts,
-                                                      process_file=True,
-                                                      flow_id=tmp_flow_id,
-                                                      chat_id=self.assistant.id)
-                    built_object = await graph.abuild()
-                    logger.info('act=init_flow_tool build_end')
+                    built_object = await self.init_flow_object(one_flow_data)
+                    # 工具对象每个会话单独创建，绑定当前会话的callbacks
                     flow_tool = Tool(name=tool_name,
                                      func=built_object,
                                      coroutine=built_object.acall,
@@ -399,6 +427,29 @@ class AssistantAgent(AssistantUtils):
                     raise Exception(f'Flow Build Error: {exc}')
         self.tools = tools
 
+    async def init_flow_object(self, flow: Flow) -> Any:
+        """ 构建技能对象，优先复用缓存中已经构建好的 """
+        key = flow_tool_cache_key(flow)
+        with _flow_tool_lock:
+            built_object = _flow_tool_cache.get(key)
+        if built_object is not None:
+            logger.info('act=init_flow_tool hit_cache flow_id={}', flow.id)
+            return built_object
+
+        artifacts = {}
+        graph = await build_flow_no_yield(graph_data=flow.data,
+                                          artifacts=artifacts,
+                                          process_file=True,
+                                          flow_id=flow.id,
+                                          chat_id=self.assistant.id)
+        built_object = await graph.abuild()
+        logger.info('act=init_flow_tool build_end')
+        # 带有记忆组件的技能对象包含会话状态，不能在会话之间共享
+        if not flow_has_memory(flow.data):
+            with _flow_tool_lock:
+                _flow_tool_cache[key] = built_object
+        return built_object
+
     async def init_agent(self):
         """
         初始化智能体的agent
@@ -493,30 +544,8 @@ class AssistantAgent(AssistantUtils):
             logger.error(f'record assistant history error: {str(e)}')
 
     async def trim_messages(self, messages: List[Any]) -> List[Any]:
-        # 获取encoding
-        enc = self.cl100k_base()
-
-        def get_finally_message(new_messages: List[Any]) -> List[Any]:
-            # 修剪到只有一条记录则不再处理
-            if len(new_messages) == 1:
-                return new_messages
-            total_count = 0
-            for one in new_messages:
-                if isinstance(one, HumanMessage):
-                    total_count += len(enc.encode(one.content))
-                elif isinstance(one, AIMessage):
-                    total_count += len(enc.encode(one.content))
-                    if 'tool_calls' in one.additional_kwargs:
-                        total_count += len(
-                            enc.encode(json.dumps(one.additional_kwargs['tool_calls'], ensure_ascii=False))
-                        )
-                else:
-                    total_count += len(enc.encode(str(one.content)))
-            if total_count > self.assistant.max_token:
-                return get_finally_message(new_messages[1:])
-            return new_messages
-
-        return get_finally_message(messages)
+        # 从最早的消息开始修剪到不超过助手的最大token数，每条消息的token数会被缓存
+        return trim_messages_by_token(messages, self.assistant.max_token, self.cl100k_base())
 
     async def run(self, query: str, chat_history: List = None, callback: Callbacks = None) -> List[BaseMessage]:
         """
@@ -1,3 +1,4 @@
+import functools
 import os
 
 from tiktoken.load import load_tiktoken_bpe
@@ -8,7 +9,9 @@ class AssistantUtils:
     # 忽略助手配置已从系统配置中移除，暂不需要此类的方法
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def cl100k_base() -> TikTokenEncoding:
+        """ 加载编码表比较耗时，进程内只加载一次 """
         ENDOFTEXT = "<|endoftext|>"
         FIM_PREFIX = "<|fim_prefix|>"
         FIM_MIDDLE = "<|fim_middle|>"
@@ -0,0 +1,191 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List
+
+from elasticsearch.helpers import bulk
+from langchain.vectorstores.base import VectorStore
+from loguru import logger
+
+from bisheng.settings import settings
+
+# 默认每批embedding的文本数
+DEFAULT_BATCH_SIZE = 200
+# 默认同时进行embedding的批次数
+DEFAULT_MAX_CONCURRENCY = 4
+# 回滚时每次删除的milvus主键数
+ROLLBACK_BATCH_SIZE = 1000
+
+
+class StageMetrics:
+    """ 流水线单个阶段的统计信息 """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.batches = 0
+        # 阶段内所有批次的累计耗时，并发执行时会大于实际的墙上时间
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, count: int, cost: float):
+        with self._lock:
+            self.count += count
+            self.batches += 1
+            self.cost += cost
+
+    @property
+    def throughput(self) -> float:
+        """ 每秒处理的文本数 """
+        return self.count / self.cost if self.cost else 0.0
+
+    def to_dict(self) -> Dict:
+        return {'count': self.count, 'batches': self.batches, 'cost': round(self.cost, 3),
+                'throughput': round(self.throughput, 2)}
+
+
+class EmbeddingPipeline:
+    """
+    分批embedding并写入milvus和es的流水线
+    embedding请求在线程池中并发执行，每批完成后立即写入milvus，es的写入在单独的线程中和milvus写入重叠执行，
+    同时在途的批次数有上限，避免大文件一次性占用过多内存
+    """
+
+    # 多个文件并行入库时，collection和索引不存在会被同时创建，首次写入需要串行
+    _init_lock = threading.Lock()
+
+    def __init__(self, vector_client: VectorStore, es_client: VectorStore, batch_size: int = None,
+                 max_concurrency: int = None):
+        embedding_conf = settings.get_knowledge().get('embedding', {})
+        self.vector_client = vector_client
+        self.es_client = es_client
+        self.batch_size = batch_size or embedding_conf.get('batch_size') or DEFAULT_BATCH_SIZE
+        self.max_concurrency = max_concurrency or embedding_conf.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY
+
+        # 已经写入的数据，入库失败时回滚
+        self._milvus_pks: List = []
+        self._es_ids: List[str] = []
+        self._written_lock = threading.Lock()
+
+        self.embed_metrics = StageMetrics('embedding')
+        self.milvus_metrics = StageMetrics('milvus')
+        self.es_metrics = StageMetrics('es')
+        self.total_cost = 0.0
+
+    def metrics(self) -> Dict:
+        return {
+            'total_cost': round(self.total_cost, 3),
+            self.embed_metrics.name: self.embed_metrics.to_dict(),
+            self.milvus_metrics.name: self.milvus_metrics.to_dict(),
+            self.es_metrics.name: self.es_metrics.to_dict(),
+        }
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        embeddings = self.vector_client.embedding_func.embed_documents(texts)
+        if len(embeddings) != len(texts):
+            raise ValueError(f'embedding result count {len(embeddings)} not match text count {len(texts)}')
+        self.embed_metrics.add(len(texts), time.perf_counter() - start)
+        return embeddings
+
+    def _add_milvus(self, texts: List[str], metadatas: List[dict], embeddings: List[List[float]]) -> List:
+        start = time.perf_counter()
+        if getattr(self.vector_client, 'col', None) is None:
+            with self._init_lock:
+                pks = self.vector_client.add_texts(texts=texts, metadatas=metadatas, embeddings=embeddings)
+        else:
+            pks = self.vector_client.add_texts(texts=texts, metadatas=metadatas, embeddings=embeddings)
+        with self._written_lock:
+            self._milvus_pks.extend(pks or [])
+        self.milvus_metrics.add(len(texts), time.perf_counter() - start)
+        return pks
+
+    @staticmethod
+    def es_metadatas(metadatas: List[dict], pks: List) -> List[dict]:
+        """ es中的分块记录milvus的主键，作为分块列表翻页时唯一的排序字段 """
+        if not pks or len(pks) != len(metadatas):
+            return metadatas
+        return [dict(metadata, pk=pk) for metadata, pk in zip(metadatas, pks)]
+
+    def _add_es(self, texts: List[str], metadatas: List[dict]):
+        start = time.perf_counter()
+        # 每批写入后不刷新索引，全部写入后统一刷新一次
+        if not self.es_metrics.batches:
+            with self._init_lock:
+                ids = self.es_client.add_texts(texts=texts, metadatas=metadatas, refresh_indices=False)
+        else:
+            ids = self.es_client.add_texts(texts=texts, metadatas=metadatas, refresh_indices=False)
+        with self._written_lock:
+            self._es_ids.extend(ids or [])
+        self.es_metrics.add(len(texts), time.perf_counter() - start)
+
+    def rollback(self):
+        """ 删除本次已经写入milvus和es的数据 """
+        with self._written_lock:
+            pks, self._milvus_pks = self._milvus_pks, []
+            es_ids, self._es_ids = self._es_ids, []
+        logger.warning(f'embedding_pipeline rollback milvus={len(pks)} es={len(es_ids)}')
+        try:
+            for i in range(0, len(pks), ROLLBACK_BATCH_SIZE):
+                self.vector_client.col.delete(f'pk in {pks[i:i + ROLLBACK_BATCH_SIZE]}', timeout=10)
+        except Exception as e:
+            logger.exception(f'embedding_pipeline rollback milvus failed: {e}')
+        try:
+            if es_ids:
+                # es写入后还没有刷新索引，delete_by_query查不到这些数据，需要按id删除
+                bulk(self.es_client.client, [{'_op_type': 'delete', '_index': self.es_client.index_name, '_id': one}
+                                             for one in es_ids], raise_on_error=False)
+        except Exception as e:
+            logger.exception(f'embedding_pipeline rollback es failed: {e}')
+
+    def run(self, texts: List[str], metadatas: List[dict]) -> Dict:
+        """ 执行流水线，返回各阶段的统计信息 """
+        start = time.perf_counter()
+        batches = [(i, min(i + self.batch_size, len(texts))) for i in range(0, len(texts), self.batch_size)]
+        # 最多同时在途的批次数
+        max_pending = self.max_concurrency * 2
+
+        es_futures: List[Future] = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as embed_executor, \
+                    ThreadPoolExecutor(max_workers=1) as es_executor:
+                pending: Dict[Future, tuple] = {}
+                batch_iter = iter(batches)
+                try:
+                    while True:
+                        for begin, end in batch_iter:
+                            pending[embed_executor.submit(self._embed, texts[begin:end])] = (begin, end)
+                            if len(pending) >= max_pending:
+                                break
+                        if not pending:
+                            break
+                        done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            begin, end = pending.pop(future)
+                            embeddings = future.result()
+                            pks = self._add_milvus(texts[begin:end], metadatas[begin:end], embeddings)
+                            es_futures.append(es_executor.submit(self._add_es, texts[begin:end],
+                                                                 self.es_metadatas(metadatas[begin:end], pks)))
+                        # 及时抛出es写入的异常
+                        for future in [one for one in es_futures if one.done()]:
+                            future.result()
+                            es_futures.remove(future)
+                except Exception:
+                    for future in pending.keys():
+                        future.cancel()
+                    for future in es_futures:
+                        future.cancel()
+                    raise
+                for future in es_futures:
+                    future.result()
+        except Exception:
+            # 退出with时已经等待正在执行的写入结束，之前批次写入的数据需要删除，否则重试入库后分块会重复
+            self.rollback()
+            raise
+        if batches:
+            self.es_client.client.indices.refresh(index=self.es_client.index_name)
+
+        self.total_cost = time.perf_counter() - start
+        metrics = self.metrics()
+        logger.info(f'embedding_pipeline texts={len(texts)} batches={len(batches)} metrics={metrics}')
+        return metrics
@@ -10,6 +10,7 @@ from bisheng.api.errcode.base import UnAuthorizedError, NotFoundError
 from bisheng.api.errcode.flow import NotFoundVersionError, CurVersionDelError, VersionNameExistsError, \
     NotFoundFlowError, \
     FlowOnlineEditError, WorkFlowOnlineEditError
+from bisheng.api.services.assistant_agent import invalidate_flow_tool_cache
 from bisheng.api.services.audit_log import AuditLogService
 from bisheng.api.services.base import BaseService
 from bisheng.api.services.user_service import UserPayload
@@ -451,6 +452,9 @@ class FlowService(BaseService):
 
         # 写入logo缓存
         cls.get_logo_share_link(flow_info.logo)
+
+        # 技能修改或者上下线后，助手中缓存的技能对象需要重新构建
+        invalidate_flow_tool_cache(flow_info.id)
         return True
 
     @classmethod
@@ -462,4 +466,5 @@ class FlowService(BaseService):
 
         # 将用户组下关联的技能删除
         GroupResourceDao.delete_group_resource_by_third_id(flow_info.id, ResourceTypeEnum.FLOW)
+        invalidate_flow_tool_cache(flow_info.id)
         return True
@@ -1,3 +1,5 @@
+import base64
+import hashlib
 import io
 import json
 import math
@@ -6,6 +8,7 @@ import time
 from datetime import datetime
 from typing import Any, Dict, List
 
+from bisheng_langchain.vectorstores.milvus import invalidate_collection_cache
 from fastapi import BackgroundTasks, Request
 from loguru import logger
 from pymilvus import Collection
@@ -13,6 +16,7 @@ from pymilvus import Collection
 from bisheng.api.errcode.base import NotFoundError, UnAuthorizedError, ServerError
 from bisheng.api.errcode.knowledge import (
     KnowledgeChunkError,
+    KnowledgeChunkCursorError,
     KnowledgeExistError,
     KnowledgeNoEmbeddingError,
 )
@@ -36,6 +40,7 @@ from bisheng.api.v1.schemas import (
     UpdatePreviewFileChunk, ExcelRule,
 )
 from bisheng.cache.redis import redis_client
+from bisheng.cache.file_cache import minio_file_cache
 from bisheng.cache.utils import file_download
 from bisheng.database.models.group_resource import (
     GroupResource,
@@ -313,6 +318,7 @@ class KnowledgeService(KnowledgeUtils):
             if knowledge.collection_name.startswith("col"):
                 # 单独的collection，直接删除即可
                 vector_client.col.drop()
+                invalidate_collection_cache(knowledge.collection_name)
             else:
                 # partition模式需要使用分区键删除
                 pk = vector_client.col.query(
@@ -322,6 +328,7 @@ class KnowledgeService(KnowledgeUtils):
                 # 判断milvus 是否还有entity
                 if vector_client.col.is_empty:
                     vector_client.col.drop()
+                    invalidate_collection_cache(knowledge.collection_name)
 
         # 处理 es
         index_name = knowledge.index_name or knowledge.collection_name  # 兼容老版本
@@ -618,9 +625,12 @@ class KnowledgeService(KnowledgeUtils):
             if file.object_name.startswith('tmp'):
                 # 把临时文件移动到正式目录
                 new_object_name = KnowledgeUtils.get_knowledge_file_object_name(file.id, file.object_name)
-                minio_client.copy_object(file.object_name, new_object_name,
-                                         bucket_name=minio_client.tmp_bucket,
-                                         target_bucket_name=minio_client.bucket)
+                copy_res = minio_client.copy_object(file.object_name, new_object_name,
+                                                    bucket_name=minio_client.tmp_bucket,
+                                                    target_bucket_name=minio_client.bucket)
+                # 重试解析时复用临时文件的本地缓存
+                minio_file_cache.copy_file(minio_client.tmp_bucket, file.object_name,
+                                           minio_client.bucket, new_object_name, copy_res.etag)
                 file.object_name = new_object_name
 
             if input_file["remark"] and "对应已存在文件" in input_file["remark"]:
@@ -697,7 +707,8 @@ class KnowledgeService(KnowledgeUtils):
             db_file.remark = f"{original_file_name} 对应已存在文件 {old_name}"
             # 上传到minio，不修改数据库，由前端决定是否覆盖，覆盖的话调用重试接口
             with open(filepath, "rb") as file:
-                minio_client.upload_tmp(db_file.object_name, file.read())
+                res = minio_client.upload_tmp(db_file.object_name, file.read())
+            minio_file_cache.add_file(minio_client.tmp_bucket, db_file.object_name, res.etag, filepath)
             db_file.status = KnowledgeFileStatus.FAILED.value
             db_file.split_rule = str_split_rule
             return db_file
@@ -715,6 +726,8 @@ class KnowledgeService(KnowledgeUtils):
         db_file.object_name = KnowledgeUtils.get_knowledge_file_object_name(db_file.id, db_file.file_name)
         res = minio_client.upload_minio(db_file.object_name, filepath)
         logger.info("upload_original_file path={} res={}", db_file.object_name, res)
+        # 入库解析时直接使用本地已经下载的文件
+        minio_file_cache.add_file(minio_client.bucket, db_file.object_name, res.etag, filepath)
         KnowledgeFileDao.update(db_file)
         return db_file
 
@@ -854,7 +867,13 @@ class KnowledgeService(KnowledgeUtils):
             keyword: str = None,
             page: int = None,
             limit: int = None,
-    ) -> (List[FileChunk], int):
+            cursor: str = None,
+    ) -> (List[FileChunk], int, str):
+        """
+        获取知识库的分块内容
+        cursor: 上一页返回的游标，传了游标时使用search_after翻页，忽略page参数，深分页的耗时和第一页一致
+        返回值的第三项为下一页的游标，没有下一页时为None
+        """
         db_knowledge = KnowledgeDao.query_by_id(knowledge_id)
         if not db_knowledge:
             raise NotFoundError.http_exception()
@@ -873,7 +892,6 @@ class KnowledgeService(KnowledgeUtils):
         es_client = decide_vectorstores(index_name, "ElasticKeywordsSearch", embeddings)
 
         search_data = {
-            "from": (page - 1) * limit,
             "size": limit,
             "sort": [
                 {
@@ -890,8 +908,25 @@ class KnowledgeService(KnowledgeUtils):
                         "unmapped_type": "long",
                     }
                 },
+                # milvus的主键，保证排序值唯一，file_id和chunk_index相同的分块翻页时不会重复或者遗漏
+                {
+                    "metadata.pk": {
+                        "order": "asc",
+                        "missing": 0,
+                        "unmapped_type": "long",
+                    }
+                },
             ],
         }
+        # 游标和查询条件绑定，查询条件变化后旧的游标不可用
+        cursor_scope = cls.get_chunk_cursor_scope(knowledge_id, file_ids, keyword)
+        if cursor:
+            search_after = cls.decode_chunk_cursor(cursor, cursor_scope)
+            if len(search_after) != len(search_data["sort"]):
+                raise KnowledgeChunkCursorError.http_exception()
+            search_data["search_after"] = search_after
+        else:
+            search_data["from"] = (page - 1) * limit
         if file_ids:
             search_data["post_filter"] = {"terms": {"metadata.file_id": file_ids}}
         if keyword:
@@ -922,7 +957,34 @@ class KnowledgeService(KnowledgeUtils):
                     parse_type=file_info.parse_type if file_info else None,
                 )
             )
-        return result, res["hits"]["total"]["value"]
+        next_cursor = None
+        if limit and len(res["hits"]["hits"]) == limit:
+            next_cursor = cls.encode_chunk_cursor(res["hits"]["hits"][-1]["sort"], cursor_scope)
+        return result, res["hits"]["total"]["value"], next_cursor
+
+    @classmethod
+    def get_chunk_cursor_scope(cls, knowledge_id: int, file_ids: List[int] = None, keyword: str = None) -> str:
+        scope = json.dumps([knowledge_id, sorted(file_ids or []), keyword or ""], ensure_ascii=False)
+        return hashlib.md5(scope.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def encode_chunk_cursor(cls, sort_values: List[Any], scope: str) -> str:
+        """ 把最后一个分块的排序值编码为不透明的游标 """
+        data = json.dumps({"s": sort_values, "q": scope}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("utf-8").rstrip("=")
+
+    @classmethod
+    def decode_chunk_cursor(cls, cursor: str, scope: str) -> List[Any]:
+        try:
+            data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            data = json.loads(data)
+            sort_values = data["s"]
+        except Exception as e:
+            logger.warning(f"act=decode_chunk_cursor cursor={cursor} error={str(e)}")
+            raise KnowledgeChunkCursorError.http_exception()
+        if data.get("q") != scope or not isinstance(sort_values, list):
+            raise KnowledgeChunkCursorError.http_exception()
+        return sort_values
 
     @classmethod
     def update_knowledge_chunk(
@@ -968,6 +1030,7 @@ class KnowledgeService(KnowledgeUtils):
         )
         metadata = []
         pk = []
+        new_pk = None
         for one in res:
             pk.append(one.pop("pk"))
             one["knowledge_id"] = str(knowledge_id)
@@ -979,6 +1042,7 @@ class KnowledgeService(KnowledgeUtils):
             new_metadata["bbox"] = bbox
             text = KnowledgeUtils.aggregate_chunk_metadata(text, new_metadata)
             res = vector_client.add_texts([text], [new_metadata], timeout=10)
+            new_pk = res[0] if res else None
         # delete data
         logger.info(f"act=delete_vector pk={pk}")
         res = vector_client.col.delete(f"pk in {pk}", timeout=10)
@@ -998,8 +1062,9 @@ class KnowledgeService(KnowledgeUtils):
                     }
                 },
                 "script": {
-                    "source": "ctx._source.text=params.text;ctx._source.metadata.bbox=params.bbox;",
-                    "params": {"text": text, "bbox": bbox},
+                    "source": "ctx._source.text=params.text;ctx._source.metadata.bbox=params.bbox;"
+                              "if (params.pk != null) {ctx._source.metadata.pk=params.pk;}",
+                    "params": {"text": text, "bbox": bbox, "pk": new_pk},
                 },
             },
         )
@@ -1105,8 +1170,8 @@ class KnowledgeService(KnowledgeUtils):
             new_data.write(d)
         resp.close()
         resp.release_conn()
-        new_data.seek(0)
-        return json.loads(new_data.read().decode("utf-8"))
+        # 新的bbox文件是gzip压缩过的
+        return KnowledgeUtils.loads_bbox_data(new_data.getvalue())
 
     @classmethod
     def copy_knowledge(
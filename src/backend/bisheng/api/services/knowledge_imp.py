@@ -1,12 +1,17 @@
+import contextvars
+import gzip
 import json
 import os
 import re
+import threading
 import time
-from typing import Any, Dict, List, Optional, BinaryIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
 
 import requests
 from bisheng_langchain.rag.extract_info import extract_title
 from bisheng_langchain.text_splitter import ElemCharacterTextSplitter
+from bisheng_langchain.vectorstores.milvus import invalidate_collection_cache
 from langchain.embeddings.base import Embeddings
 from langchain.schema.document import Document
 from langchain.text_splitter import CharacterTextSplitter
@@ -24,6 +29,7 @@ from sqlalchemy import func, or_
 from sqlmodel import select
 
 from bisheng.api.errcode.knowledge import KnowledgeSimilarError
+from bisheng.api.services.embedding_pipeline import EmbeddingPipeline
 from bisheng.api.services.etl4lm_loader import Etl4lmLoader
 from bisheng.api.services.handler.impl.xls_split_handle import XlsSplitHandle
 from bisheng.api.services.handler.impl.xlsx_split_handle import XlsxSplitHandle
@@ -40,7 +46,7 @@ from bisheng.api.services.patch_130 import (
 from bisheng.api.utils import md5_hash
 from bisheng.api.v1.schemas import ExcelRule
 from bisheng.cache.redis import redis_client
-from bisheng.cache.utils import file_download
+from bisheng.cache.file_cache import minio_file_cache
 from bisheng.database.base import session_getter
 from bisheng.database.models.knowledge import Knowledge, KnowledgeDao
 from bisheng.database.models.knowledge_file import (
@@ -78,6 +84,8 @@ split_handles = [
 class KnowledgeUtils:
     # 用来区分chunk和自动生产的总结内容  格式如：文件名\n文档总结\n--------\n chunk内容
     chunk_split = "\n----------\n"
+    # gzip压缩数据的文件头
+    gzip_magic = b"\x1f\x8b"
 
     @classmethod
     def get_preview_cache_key(cls, knowledge_id: int, file_path: str) -> str:
@@ -166,6 +174,18 @@ class KnowledgeUtils:
         """获取知识库文件对应的bbox文件在minio的存储路径"""
         return f"partitions/{file_id}.json"
 
+    @classmethod
+    def dumps_bbox_data(cls, partitions: Any) -> bytes:
+        """bbox数据gzip压缩后存储，文本型的json压缩率很高"""
+        return gzip.compress(json.dumps(partitions, ensure_ascii=False).encode("utf-8"), compresslevel=6)
+
+    @classmethod
+    def loads_bbox_data(cls, data: bytes) -> Any:
+        """解析存储的bbox数据，兼容没有压缩的旧数据"""
+        if data[:2] == cls.gzip_magic:
+            data = gzip.decompress(data)
+        return json.loads(data.decode("utf-8"))
+
     @classmethod
     def get_knowledge_preview_file_object_name(
             cls, file_id: int, file_name: str
@@ -196,14 +216,14 @@ def put_images_to_minio(local_image_dir, knowledge_id, doc_id):
     if not os.path.exists(local_image_dir):
         return
 
-    files = [f for f in os.listdir(local_image_dir)]
-    for file_name in files:
-        local_file_name = f"{local_image_dir}/{file_name}"
-        object_name = f"{KnowledgeUtils.get_knowledge_file_image_dir(doc_id, knowledge_id)}/{file_name}"
-        file_obj: BinaryIO = open(local_file_name, "rb")
-        minio_client.upload_minio_file(
-            object_name=object_name, file=file_obj, bucket_name=minio_client.bucket
-        )
+    image_dir = KnowledgeUtils.get_knowledge_file_image_dir(doc_id, knowledge_id)
+    files = [
+        (f"{image_dir}/{file_name}", f"{local_image_dir}/{file_name}")
+        for file_name in os.listdir(local_image_dir)
+    ]
+    start_time = time.time()
+    minio_client.upload_local_files(files, bucket_name=minio_client.bucket)
+    logger.debug(f"put_images_to_minio doc_id={doc_id} count={len(files)} cost={time.time() - start_time:.3f}s")
 
 
 def process_file_task(
@@ -391,7 +411,14 @@ def addEmbedding(
     logger.info("start init ElasticKeywordsSearch")
     es_client = decide_vectorstores(index_name, "ElasticKeywordsSearch", embeddings)
 
-    for index, db_file in enumerate(knowledge_files):
+    file_conf = settings.get_knowledge().get("file_process", {})
+    max_workers = max(1, min(file_conf.get("max_workers") or 4, len(knowledge_files)))
+    total = len(knowledge_files)
+    finished = 0
+    progress_lock = threading.Lock()
+
+    def process_one(index: int, db_file: KnowledgeFile):
+        nonlocal finished
         # 尝试从缓存中获取文件的分块
         preview_cache_key = None
         if preview_cache_keys:
@@ -429,8 +456,11 @@ def addEmbedding(
             db_file.status = KnowledgeFileStatus.FAILED.value
             db_file.remark = str(e)[:500]
         finally:
+            with progress_lock:
+                finished += 1
+                current = finished
             logger.info(
-                f"process_file_end file_id={db_file.id} file_name={db_file.file_name}"
+                f"process_file_end file_id={db_file.id} file_name={db_file.file_name} progress={current}/{total}"
             )
             KnowledgeFileDao.update(db_file)
             if callback:
@@ -440,7 +470,20 @@ def addEmbedding(
                     "file_id": db_file.id,
                     "error_msg": db_file.remark,
                 }
-                requests.post(url=callback, json=inp, timeout=3)
+                try:
+                    requests.post(url=callback, json=inp, timeout=3)
+                except Exception as e:
+                    logger.warning(f"process_file_callback_fail file_id={db_file.id} error={e}")
+
+    # 多个文件的解析、embedding和入库并行执行，每个文件的状态更新和回调互不影响
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 复制上下文，保证日志中的trace_id在线程中保持一致
+        futures = [
+            executor.submit(contextvars.copy_context().run, process_one, index, db_file)
+            for index, db_file in enumerate(knowledge_files)
+        ]
+        for future in as_completed(futures):
+            future.result()
 
 
 def add_file_embedding(
@@ -465,8 +508,8 @@ def add_file_embedding(
         f"start download original file={db_file.id} file_name={db_file.file_name}"
     )
 
-    file_url = minio_client.get_share_link(db_file.object_name)
-    filepath, _ = file_download(file_url)
+    # 直接从minio流式下载，预览、重试解析时已经下载过的文件复用本地缓存
+    filepath, _ = minio_file_cache.get_file(minio_client.bucket, db_file.object_name)
 
     if not vector_client:
         raise ValueError("vector db not found, please check your milvus config")
@@ -518,7 +561,7 @@ def add_file_embedding(
     db_file.parse_type = parse_type
     # 存储ocr识别后的partitions结果
     if partitions:
-        partition_data = json.dumps(partitions, ensure_ascii=False).encode("utf-8")
+        partition_data = KnowledgeUtils.dumps_bbox_data(partitions)
         db_file.bbox_object_name = KnowledgeUtils.get_knowledge_bbox_file_object_name(
             db_file.id
         )
@@ -526,7 +569,7 @@ def add_file_embedding(
             db_file.bbox_object_name,
             partition_data,
             len(partition_data),
-            "application/json",
+            "application/gzip",
         )
 
     logger.info(
@@ -541,15 +584,11 @@ def add_file_embedding(
             }
         )
 
-    logger.info(f"add_vectordb file={db_file.id} file_name={db_file.file_name}")
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
-
-    logger.info(f"add_es file={db_file.id} file_name={db_file.file_name}")
-    # 存入es
-    es_client.add_texts(texts=texts, metadatas=metadatas)
+    logger.info(f"add_vectordb_and_es file={db_file.id} file_name={db_file.file_name}")
+    # 分批embedding，每批完成后写入milvus和es
+    metrics = EmbeddingPipeline(vector_client, es_client).run(texts, metadatas)
 
-    logger.info(f"add_complete file={db_file.id} file_name={db_file.file_name}")
+    logger.info(f"add_complete file={db_file.id} file_name={db_file.file_name} metrics={metrics}")
 
     if preview_cache_key:
         KnowledgeUtils.delete_preview_cache(preview_cache_key)
@@ -584,11 +623,11 @@ def add_text_into_vector(
 ):
     logger.info(f"add_vectordb file={db_file.id} file_name={db_file.file_name}")
     # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
+    pks = vector_client.add_texts(texts=texts, metadatas=metadatas)
 
     logger.info(f"add_es file={db_file.id} file_name={db_file.file_name}")
     # 存入es
-    es_client.add_texts(texts=texts, metadatas=metadatas)
+    es_client.add_texts(texts=texts, metadatas=EmbeddingPipeline.es_metadatas(metadatas, pks))
 
 
 def parse_partitions(partitions: List[Any]) -> Dict:
@@ -707,7 +746,8 @@ def read_chunk_text(
         )
 
         # skip following processes and return splited values.
-        texts, documents = combine_multiple_md_files_to_raw_texts(path=md_files_path)
+        # 合并后的文档只用于提取摘要，extract_title 只会使用前7000个字符
+        texts, documents = combine_multiple_md_files_to_raw_texts(path=md_files_path, max_combined_length=7000)
 
     elif file_extension_name in ["doc", "docx", "html", "mhtml", "ppt", "pptx"]:
 
@@ -892,14 +932,14 @@ def text_knowledge(
             }
             for index, doc in enumerate(documents)
         ]
-        vectore_client.add_texts(
+        pks = vectore_client.add_texts(
             texts=[t.page_content for t in texts], metadatas=metadata
         )
 
         # 存储es
         if es_client:
             es_client.add_texts(
-                texts=[t.page_content for t in texts], metadatas=metadata
+                texts=[t.page_content for t in texts], metadatas=EmbeddingPipeline.es_metadatas(metadata, pks)
             )
         db_file.status = 2
         result["status"] = 2
@@ -927,6 +967,7 @@ def delete_vector(collection_name: str, partition_key: str):
                 pass
             else:
                 res = vectore_client.col.drop(timeout=1)
+                invalidate_collection_cache(collection_name)
                 logger.info('act=delete_milvus col={} res={}', collection_name, res)
     except Exception as e:
         # 处理集合不存在或其他错误的情况
@@ -983,11 +1024,12 @@ def QA_save_knowledge(db_knowledge: Knowledge, QA: QAKnowledge):
             }
             for index, doc in enumerate(docs)
         ]
-        vector_client.add_texts(
+        pks = vector_client.add_texts(
             texts=[t.page_content for t in docs], metadatas=metadata
         )
         logger.info(f"qa_save_knowledge add vector over")
-        es_client.add_texts(texts=[t.page_content for t in docs], metadatas=metadata)
+        es_client.add_texts(texts=[t.page_content for t in docs],
+                            metadatas=EmbeddingPipeline.es_metadatas(metadata, pks))
         logger.info(f"qa_save_knowledge add es over")
 
         QA.status = QAStatus.ENABLED.value
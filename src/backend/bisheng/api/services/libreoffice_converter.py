@@ -1,9 +1,367 @@
+import atexit
 import os
+import queue
+import socket
 import shutil  # For checking if the executable is in PATH
+import signal
 import subprocess
+import tempfile
+import threading
+import time
+import xmlrpc.client
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
 
 from loguru import logger
 
+from bisheng.settings import settings
+
+# 实例池的运行模式，见 LibreOfficeInstance
+MODE_UNOSERVER = 'unoserver'
+MODE_UNO = 'uno'
+MODE_CLI = 'cli'
+
+# 目标格式对应的LibreOffice导出过滤器
+EXPORT_FILTERS = {
+    'docx': 'MS Word 2007 XML',
+    'pdf': 'writer_pdf_Export',
+    'impress_pdf': 'impress_pdf_Export',
+}
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    """ 带超时的xmlrpc连接，unoserver卡死时请求不会一直阻塞 """
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class LibreOfficeInstance:
+    """
+    一个常驻的LibreOffice进程，使用独立的用户配置目录，多个实例可以同时转换文件
+    mode:
+        unoserver: 每个实例启动一个unoserver，通过xmlrpc驱动常驻的soffice转换，应用的python环境不需要uno
+        uno: 应用的python环境中可以导入uno时，直接通过socket驱动常驻的soffice转换
+        cli: 退化为每批文件启动一次soffice，同一批的文件在一个进程中转换
+    """
+
+    def __init__(self, index: int, soffice_path: str, base_dir: str, mode: str = MODE_CLI,
+                 unoserver_path: str = None):
+        self.index = index
+        self.soffice_path = soffice_path
+        self.unoserver_path = unoserver_path
+        self.mode = mode
+        self.profile_dir = os.path.join(base_dir, f'profile_{index}')
+        self.port = None
+        self.rpc_port = None
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.converted = 0
+
+    @property
+    def profile_url(self) -> str:
+        return Path(self.profile_dir).as_uri()
+
+    @property
+    def started(self) -> bool:
+        return self.process is not None
+
+    def start(self, timeout: int = 60):
+        """ 启动常驻进程并等待可以连接 """
+        if self.mode == MODE_UNOSERVER:
+            self._start_unoserver(timeout)
+        else:
+            self._start_uno(timeout)
+
+    def _start_unoserver(self, timeout: int):
+        # 多个worker进程各自有实例池，每次启动使用空闲的端口
+        self.port = get_free_port()
+        self.rpc_port = get_free_port()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        # 单独的进程组，停止时连同unoserver启动的soffice一起结束
+        self.process = subprocess.Popen([
+            self.unoserver_path,
+            '--interface', '127.0.0.1',
+            '--port', str(self.rpc_port),
+            '--uno-interface', '127.0.0.1',
+            '--uno-port', str(self.port),
+            '--executable', self.soffice_path,
+            '--user-installation', self.profile_dir,
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self._rpc(5).info()
+                logger.info(f'libreoffice instance started mode=unoserver index={self.index} '
+                            f'rpc_port={self.rpc_port} uno_port={self.port}')
+                return
+            except Exception as e:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise Exception(f'libreoffice instance start failed index={self.index}: {e}')
+                time.sleep(0.5)
+
+    def _start_uno(self, timeout: int):
+        import uno  # noqa
+
+        self.port = get_free_port()
+        self.process = subprocess.Popen([
+            self.soffice_path,
+            '--headless',
+            '--invisible',
+            '--nologo',
+            '--nodefault',
+            '--norestore',
+            '--nolockcheck',
+            f'-env:UserInstallation={self.profile_url}',
+            f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext',
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver',
+                                                                          local_context)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                context = resolver.resolve(f'uno:socket,host=127.0.0.1,port={self.port};urp;'
+                                           f'StarOffice.ComponentContext')
+                self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+                logger.info(f'libreoffice instance started mode=uno index={self.index} port={self.port}')
+                return
+            except Exception as e:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise Exception(f'libreoffice instance start failed index={self.index}: {e}')
+                time.sleep(0.5)
+
+    def _rpc(self, timeout: float) -> xmlrpc.client.ServerProxy:
+        return xmlrpc.client.ServerProxy(f'http://127.0.0.1:{self.rpc_port}', allow_none=True,
+                                         transport=_TimeoutTransport(timeout))
+
+    def stop(self):
+        self.desktop = None
+        if self.process is not None and self.process.poll() is None:
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+            except ProcessLookupError:
+                pass
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                logger.warning(f'libreoffice instance kill timeout index={self.index}')
+        self.process = None
+
+    def restart(self):
+        logger.warning(f'restart libreoffice instance index={self.index} converted={self.converted}')
+        self.stop()
+        self.start()
+
+    def is_healthy(self) -> bool:
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            if self.mode == MODE_UNOSERVER:
+                self._rpc(5).info()
+            else:
+                if self.desktop is None:
+                    return False
+                self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def _uno_convert(self, input_path: str, output_path: str, filter_name: str):
+        import uno  # noqa
+        from com.sun.star.beans import PropertyValue  # noqa
+
+        def prop(name, value):
+            one = PropertyValue()
+            one.Name = name
+            one.Value = value
+            return one
+
+        document = self.desktop.loadComponentFromURL(Path(input_path).as_uri(), '_blank', 0,
+                                                     (prop('Hidden', True), prop('ReadOnly', True)))
+        if document is None:
+            raise Exception(f'libreoffice can not open {input_path}')
+        try:
+            document.storeToURL(Path(output_path).as_uri(), (prop('FilterName', filter_name),))
+        finally:
+            document.close(True)
+
+    def _unoserver_convert(self, input_path: str, output_path: str, filter_name: str, timeout: int):
+        convert_to = Path(output_path).suffix.lstrip('.')
+        # 参数依次为 inpath, indata, outpath, convert_to, filtername，兼容各个版本的unoserver
+        self._rpc(timeout).convert(input_path, None, output_path, convert_to, filter_name)
+
+    def convert(self, input_path: str, output_path: str, filter_name: str, timeout: int):
+        """ 在常驻进程中转换一个文件，超时认为进程卡死，杀掉后重启 """
+        error = []
+        worker = threading.Thread(target=self._convert_worker,
+                                  args=(input_path, output_path, filter_name, timeout, error),
+                                  daemon=True)
+        worker.start()
+        worker.join(timeout)
+        if worker.is_alive():
+            self.restart()
+            raise subprocess.TimeoutExpired(f'libreoffice convert {input_path}', timeout)
+        if error:
+            raise error[0]
+        self.converted += 1
+
+    def _convert_worker(self, input_path: str, output_path: str, filter_name: str, timeout: int, error: list):
+        try:
+            if self.mode == MODE_UNOSERVER:
+                self._unoserver_convert(input_path, output_path, filter_name, timeout)
+            else:
+                self._uno_convert(input_path, output_path, filter_name)
+        except Exception as e:
+            error.append(e)
+
+    def convert_batch_cli(self, input_paths: List[str], convert_to: str, output_dir: str, timeout: int):
+        """ 启动一次soffice转换一批文件，使用实例独立的配置目录，和其他实例互不影响 """
+        command = [
+            self.soffice_path,
+            f'-env:UserInstallation={self.profile_url}',
+            '--headless',  # Run in headless mode (no GUI)
+            '--convert-to',
+            convert_to,  # Specify the output format
+            '--outdir',
+            output_dir,  # Specify the output directory
+            *input_paths,
+        ]
+        logger.debug(f"Executing command: {' '.join(command)}")
+        process = subprocess.run(command, check=True, capture_output=True, text=True, timeout=timeout)
+        logger.debug(f"LibreOffice STDOUT: {process.stdout}")
+        if process.stderr:
+            # LibreOffice sometimes logger.debugs info to stderr even on success
+            logger.debug(f"LibreOffice STDERR: {process.stderr}")
+        self.converted += len(input_paths)
+
+
+class LibreOfficePool:
+    """
+    LibreOffice实例池，转换请求排队获取空闲的实例
+    获取实例时做健康检查，异常退出或者卡死的实例会被重启
+    """
+
+    def __init__(self, size: int, soffice_path: str, base_dir: str = None, mode: str = None):
+        self.size = size
+        self.soffice_path = soffice_path
+        self.base_dir = base_dir or os.path.join(tempfile.gettempdir(), f'bisheng_libreoffice_{os.getpid()}')
+        self.unoserver_path = shutil.which('unoserver')
+        self.mode = mode or self.detect_mode(self.unoserver_path)
+        if self.mode == MODE_CLI:
+            logger.warning('libreoffice pool fallback to cli mode: neither unoserver nor python uno is available, '
+                           'every conversion batch will start a new soffice process. '
+                           'Install unoserver (pip install unoserver with the python that has uno) to keep '
+                           'libreoffice instances resident')
+        else:
+            logger.info(f'libreoffice pool mode={self.mode} size={size}')
+        self._idle = queue.Queue()
+        self.instances = [LibreOfficeInstance(i, soffice_path, self.base_dir, self.mode, self.unoserver_path)
+                          for i in range(size)]
+        for one in self.instances:
+            self._idle.put(one)
+
+    @staticmethod
+    def detect_mode(unoserver_path: Optional[str]) -> str:
+        """ 优先使用unoserver，应用的python环境中不需要安装uno """
+        if unoserver_path:
+            return MODE_UNOSERVER
+        try:
+            import uno  # noqa
+            return MODE_UNO
+        except ImportError:
+            return MODE_CLI
+
+    @property
+    def resident(self) -> bool:
+        """ 是否使用常驻的LibreOffice进程 """
+        return self.mode != MODE_CLI
+
+    @contextmanager
+    def acquire(self, timeout: Optional[int] = None):
+        try:
+            instance = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('no idle libreoffice instance')
+        try:
+            if self.resident and not instance.is_healthy():
+                if instance.started:
+                    instance.restart()
+                else:
+                    instance.start()
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def convert_files(self, input_paths: List[str], convert_to: str, output_dir: str, timeout: int = 120,
+                      filter_name: str = None) -> Dict[str, Optional[str]]:
+        """
+        用同一个实例批量转换文件，返回 {输入文件: 输出文件}，转换失败的文件输出为None
+        """
+        ret = {}
+        with self.acquire(timeout=timeout) as instance:
+            if self.resident:
+                for input_path in input_paths:
+                    output_path = os.path.join(output_dir, f'{Path(input_path).stem}.{convert_to}')
+                    try:
+                        instance.convert(input_path, output_path, filter_name or EXPORT_FILTERS[convert_to], timeout)
+                    except Exception as e:
+                        logger.warning(f'libreoffice convert failed input={input_path} error={e}')
+                    ret[input_path] = output_path if os.path.exists(output_path) else None
+            else:
+                try:
+                    instance.convert_batch_cli(input_paths, convert_to, output_dir, timeout * len(input_paths))
+                except subprocess.CalledProcessError as e:
+                    # LibreOffice might return a non-zero exit code even for some warnings.
+                    logger.debug(f'Error during LibreOffice conversion, return code: {e.returncode} '
+                                 f'STDOUT: {e.stdout} STDERR: {e.stderr}')
+                for input_path in input_paths:
+                    output_path = os.path.join(output_dir, f'{Path(input_path).stem}.{convert_to}')
+                    ret[input_path] = output_path if os.path.exists(output_path) else None
+        return ret
+
+    def close(self):
+        for one in self.instances:
+            one.stop()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+
+_libreoffice_pool: Optional[LibreOfficePool] = None
+_libreoffice_pool_lock = threading.Lock()
+
+
+def get_libreoffice_pool() -> Optional[LibreOfficePool]:
+    """ 进程内共享的LibreOffice实例池，未安装LibreOffice时返回None """
+    global _libreoffice_pool
+    with _libreoffice_pool_lock:
+        if _libreoffice_pool is None:
+            soffice_path = get_libreoffice_path()
+            if not soffice_path:
+                return None
+            conf = settings.get_knowledge().get('file_process', {})
+            _libreoffice_pool = LibreOfficePool(size=conf.get('libreoffice_workers', 2),
+                                                soffice_path=soffice_path)
+            atexit.register(_libreoffice_pool.close)
+        return _libreoffice_pool
+
 
 def get_libreoffice_path():
     """
@@ -72,9 +430,8 @@ def convert_doc_to_docx(input_doc_path, output_dir=None):
                 logger.debug(f"Error creating output directory '{output_dir}': {e}")
                 return None
 
-    # Check if libreoffice_exec is in PATH if it's not a full path
-    soffice_path = get_libreoffice_path()
-    if not soffice_path:
+    pool = get_libreoffice_pool()
+    if not pool:
         logger.debug(
             "Error: LibreOffice (soffice) command not found. Please install LibreOffice and ensure it's in your PATH, or adjust 'get_libreoffice_path()'."
         )
@@ -85,65 +442,22 @@ def convert_doc_to_docx(input_doc_path, output_dir=None):
     file_name_no_ext = os.path.splitext(base_name)[0]
     output_docx_path = os.path.join(output_dir, f"{file_name_no_ext}.docx")
 
-    command = [
-        soffice_path,
-        "--headless",  # Run in headless mode (no GUI)
-        "--convert-to",
-        "docx",  # Specify the output format
-        "--outdir",
-        output_dir,  # Specify the output directory
-        input_doc_path,  # The input file
-    ]
-
-    logger.debug(f"Executing command: {' '.join(command)}")
-
     try:
-        process = subprocess.run(
-            command, check=True, capture_output=True, text=True, timeout=120
-        )  # 120 seconds timeout
-        logger.debug(f"LibreOffice STDOUT: {process.stdout}")
-        if (
-            process.stderr
-        ):  # LibreOffice sometimes logger.debugs info to stderr even on success
-            logger.debug(f"LibreOffice STDERR: {process.stderr}")
-
-        # Check if the file was actually created
-        # LibreOffice creates the file with the correct name in the output_dir
-        expected_file_in_outdir = os.path.join(output_dir, f"{file_name_no_ext}.docx")
-        if os.path.exists(expected_file_in_outdir):
-            # If output_docx_path is different (it shouldn't be with this logic, but for safety)
-            if expected_file_in_outdir != output_docx_path:
-                shutil.move(expected_file_in_outdir, output_docx_path)
+        # 120 seconds timeout
+        result = pool.convert_files([input_doc_path], "docx", output_dir, timeout=120)
+        if result.get(input_doc_path):
             logger.debug(
                 f"Successfully converted '{input_doc_path}' to '{output_docx_path}'"
             )
             return output_docx_path
         else:
-            # This case should ideally not happen if subprocess.run didn't raise an error
-            # and LibreOffice worked as expected.
             logger.debug(
-                f"Error: Conversion command seemed to succeed, but output file '{expected_file_in_outdir}' not found."
+                f"Error: Conversion finished, but output file '{output_docx_path}' not found."
             )
             logger.debug(
                 "Please check LibreOffice's behavior and output directory permissions."
             )
             return None
-
-    except FileNotFoundError:
-        logger.debug(
-            f"Error: The LibreOffice executable '{soffice_path}' was not found."
-        )
-        logger.debug(
-            "Ensure LibreOffice is installed and the command is in your PATH or provide the full path."
-        )
-        return None
-    except subprocess.CalledProcessError as e:
-        logger.debug(f"Error during LibreOffice conversion for '{input_doc_path}':")
-        logger.debug(f"Command: {' '.join(e.cmd)}")
-        logger.debug(f"Return code: {e.returncode}")
-        logger.debug(f"STDOUT: {e.stdout}")
-        logger.debug(f"STDERR: {e.stderr}")
-        return None
     except subprocess.TimeoutExpired:
         logger.debug(f"Error: LibreOffice conversion for '{input_doc_path}' timed out.")
         return None
@@ -173,8 +487,8 @@ def convert_ppt_to_pdf(input_path, output_dir=None):
         logger.debug(f"Error: File not found at {input_path}")
         return False
 
-    soffice_path = get_libreoffice_path()
-    if not soffice_path:
+    pool = get_libreoffice_pool()
+    if not pool:
         logger.debug(
             "Error: LibreOffice (soffice) command not found. Please install LibreOffice and ensure it's in your PATH, or adjust 'get_libreoffice_path()'."
         )
@@ -192,66 +506,22 @@ def convert_ppt_to_pdf(input_path, output_dir=None):
     pdf_name = os.path.splitext(base_name)[0] + ".pdf"
     expected_pdf_path = os.path.join(output_dir, pdf_name)
 
-    command = [
-        soffice_path,
-        "--headless",
-        "--convert-to",
-        "pdf",
-        "--outdir",
-        output_dir,
-        input_path,
-    ]
-
     try:
-        logger.debug(f"Converting {input_path} to PDF using {soffice_path}...")
-        # LibreOffice can sometimes be slow to start up and convert.
-        # It may also not provide much stdout/stderr unless there's a significant error.
-        process = subprocess.run(
-            command, capture_output=True, text=True, check=True, timeout=180
-        )  # 180 seconds timeout
-
-        if process.stdout:
-            logger.debug(f"soffice stdout: {process.stdout}")  # Often empty on success
-        if process.stderr:
-            logger.debug(
-                f"soffice stderr: {process.stderr}"
-            )  # Check for any warnings/errors
-
-        if os.path.exists(expected_pdf_path):
+        logger.debug(f"Converting {input_path} to PDF using {pool.soffice_path}...")
+        # 180 seconds timeout
+        result = pool.convert_files([os.path.abspath(input_path)], "pdf", os.path.abspath(output_dir),
+                                    timeout=180, filter_name=EXPORT_FILTERS["impress_pdf"])
+        # Check if the file was created anyway, even if soffice returned an error or timed out
+        if any(result.values()) or os.path.exists(expected_pdf_path):
             logger.debug(f"Successfully converted {input_path} to {expected_pdf_path}")
             return expected_pdf_path
         else:
             logger.debug(
                 f"Conversion command ran, but output PDF not found at expected location: {expected_pdf_path}"
             )
-            logger.debug(
-                "Please check LibreOffice's behavior. Stdout/Stderr from above might provide clues."
-            )
             return False
-
-    except (
-        FileNotFoundError
-    ):  # Should be caught by get_libreoffice_path, but as a fallback
-        logger.debug(
-            f"Error: {soffice_path} command not found. Please install LibreOffice and ensure it's in your PATH."
-        )
-        return False
-    except subprocess.CalledProcessError as e:
-        logger.debug(f"Error during soffice conversion for {input_path}: {e}")
-        logger.debug(f"Exit code: {e.returncode}")
-        logger.debug(f"Stdout: {e.stdout}")
-        logger.debug(f"Stderr: {e.stderr}")
-        # LibreOffice might return a non-zero exit code even for some warnings.
-        # Check if the file was created anyway.
-        if os.path.exists(expected_pdf_path):
-            logger.debug(
-                f"Warning: soffice returned an error code, but PDF was created at {expected_pdf_path}"
-            )
-            return expected_pdf_path
-        return False
     except subprocess.TimeoutExpired:
         logger.debug(f"Error: soffice conversion for {input_path} timed out.")
-        # Check if the file was partially created or created despite timeout
         if os.path.exists(expected_pdf_path):
             logger.debug(
                 f"Warning: soffice timed out, but PDF might have been created at {expected_pdf_path}"
@@ -1,11 +1,22 @@
-import math
+import itertools
 import os
-from typing import List
+from typing import Iterable, Iterator, List
 from uuid import uuid4
 
 import openpyxl
 import pandas as pd
 from loguru import logger
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.xml.constants import SHEET_MAIN_NS
+from openpyxl.xml.functions import iterparse
+
+# 工作表xml中的节点名
+SHEET_DATA_TAG = f"{{{SHEET_MAIN_NS}}}sheetData"
+ROW_TAG = f"{{{SHEET_MAIN_NS}}}row"
+MERGE_CELL_TAG = f"{{{SHEET_MAIN_NS}}}mergeCell"
+
+# csv 每次读取的行数
+CSV_READ_CHUNK_SIZE = 10000
 
 
 def xls_to_xlsx(xls_path):
@@ -56,28 +67,90 @@ def remove_characters(s, chars_to_remove=["\n", "\r"]):
     return s.strip()
 
 
+def read_merged_cell_ranges(sheet_obj) -> List[tuple]:
+    """
+    获取工作表中所有合并区域的边界 (min_col, min_row, max_col, max_row)。
+    只读模式下openpyxl不会加载合并区域，需要从工作表的xml中流式解析 mergeCell 节点。
+    """
+    merged_cells = getattr(sheet_obj, "merged_cells", None)
+    if merged_cells is not None:
+        return [merged_range.bounds for merged_range in merged_cells.ranges]
+
+    ranges = []
+    sheet_data = None
+    with sheet_obj._get_source() as src:
+        for event, element in iterparse(src, events=("start", "end")):
+            if event == "start":
+                if element.tag == SHEET_DATA_TAG:
+                    sheet_data = element
+                continue
+            if element.tag == ROW_TAG and sheet_data is not None:
+                # 这里只需要合并区域，行数据解析完就丢弃，避免整个sheet的xml树留在内存中
+                sheet_data.clear()
+            elif element.tag == MERGE_CELL_TAG and element.get("ref"):
+                ranges.append(range_boundaries(element.get("ref")))
+    return ranges
+
+
+def get_sheet_dimensions(sheet_obj) -> tuple[int, int]:
+    """
+    获取工作表的行数和列数。
+    只读模式下使用xml中记录的dimension，部分软件生成的文件没有或者只写了A1，这时需要遍历一遍计算真实的大小。
+    """
+    max_row, max_column = sheet_obj.max_row, sheet_obj.max_column
+    if hasattr(sheet_obj, "reset_dimensions") and (not max_row or not max_column or (max_row, max_column) == (1, 1)):
+        sheet_obj.reset_dimensions()
+        try:
+            sheet_obj.calculate_dimension(force=True)
+        except Exception:
+            # 没有任何单元格
+            return 0, 0
+        max_row, max_column = sheet_obj.max_row, sheet_obj.max_column
+    return max_row or 0, max_column or 0
+
+
+def iter_unmerged_rows(sheet_obj, max_row: int, max_column: int) -> Iterator[list]:
+    """
+    逐行读取 openpyxl 工作表，将合并区域左上角的值填充到该区域的所有单元格中。
+    合并区域按起始行建立索引，只保留覆盖当前行的合并区域，内存占用和工作表的行数无关。
+    """
+    if max_row == 0 or max_column == 0:
+        return
+
+    # {起始行: [(min_col, max_col, max_row), ...]}
+    merged_index = {}
+    for min_col, min_row, max_col, range_max_row in read_merged_cell_ranges(sheet_obj):
+        if min_col > max_column or min_row > max_row:
+            continue
+        merged_index.setdefault(min_row, []).append((min_col, min(max_col, max_column), range_max_row))
+
+    # 覆盖当前行的合并区域 [(min_col, max_col, max_row, 左上角的值), ...]
+    active_ranges = []
+    rows = sheet_obj.iter_rows(min_row=1, min_col=1, max_row=max_row, max_col=max_column, values_only=True)
+    for r_idx, values in enumerate(rows, start=1):
+        row = list(values)
+        if len(row) < max_column:
+            row.extend([None] * (max_column - len(row)))
+        for min_col, max_col, range_max_row in merged_index.pop(r_idx, ()):
+            active_ranges.append((min_col, max_col, range_max_row, row[min_col - 1]))
+        if active_ranges:
+            active_ranges = [one for one in active_ranges if one[2] >= r_idx]
+            for min_col, max_col, _, value in active_ranges:
+                row[min_col - 1:max_col] = [value] * (max_col - min_col + 1)
+        yield row
+
+
 def unmerge_and_read_sheet(sheet_obj):
     """
     读取 openpyxl 工作表对象，通过将合并区域左上角的值填充到该区域的所有单元格中来取消合并单元格，
-    并以列表的列表形式返回数据。
+    并以列表的列表形式返回数据。大文件请使用 iter_unmerged_rows 逐行处理。
     """
-    if sheet_obj.max_row == 0 or sheet_obj.max_column == 0:
-        return []
-    data_grid = [
-        [None for _ in range(sheet_obj.max_column)] for _ in range(sheet_obj.max_row)
-    ]
-    for r_idx, row in enumerate(sheet_obj.iter_rows()):
-        for c_idx, cell in enumerate(row):
-            data_grid[r_idx][c_idx] = cell.value
-
-    merged_cell_ranges = list(sheet_obj.merged_cells.ranges)
-    for merged_range in merged_cell_ranges:
-        min_col, min_row, max_col, max_row = merged_range.bounds
-        top_left_cell_value = sheet_obj.cell(row=min_row, column=min_col).value
-        for r in range(min_row, max_row + 1):
-            for c in range(min_col, max_col + 1):
-                data_grid[r - 1][c - 1] = top_left_cell_value
-    return data_grid
+    max_row, max_column = get_sheet_dimensions(sheet_obj)
+    return list(iter_unmerged_rows(sheet_obj, max_row, max_column))
+
+
+def format_markdown_row(row_values) -> str:
+    return "| " + " | ".join(remove_characters(str(v)) if v is not None else "" for v in row_values) + " |"
 
 
 def generate_markdown_table_string(
@@ -95,149 +168,140 @@ def generate_markdown_table_string(
     # 只有在提供了表头行时，才处理表头和分隔符
     if header_rows_list_of_lists:
         pre_separator_header = header_rows_list_of_lists[:separator_placement_index]
-        for row_values in pre_separator_header:
-            md_lines.append(
-                "| "
-                + " | ".join(
-                    remove_characters(str(v)) if v is not None else ""
-                    for v in row_values
-                )
-                + " |"
-            )
+        md_lines.extend(format_markdown_row(row_values) for row_values in pre_separator_header)
 
         # 在第一行表头下方插入Markdown分隔符
         if num_columns > 0:
             md_lines.append("|" + "---|" * num_columns)
 
         post_separator_header = header_rows_list_of_lists[separator_placement_index:]
-        for row_values in post_separator_header:
-            md_lines.append(
-                "| "
-                + " | ".join(
-                    remove_characters(str(v)) if v is not None else ""
-                    for v in row_values
-                )
-                + " |"
-            )
+        md_lines.extend(format_markdown_row(row_values) for row_values in post_separator_header)
 
     # 总是处理数据行
-    for row_values in data_rows_list_of_lists:
-        md_lines.append(
-            "| "
-            + " | ".join(
-                remove_characters(str(v)) if v is not None else "" for v in row_values
-            )
-            + " |"
-        )
+    md_lines.extend(format_markdown_row(row_values) for row_values in data_rows_list_of_lists)
 
     return "\n".join(md_lines)
 
 
-def process_dataframe_to_markdown_files(
-        df,
-        sheet_index: str,
+def iter_markdown_chunks(
+        rows: Iterable[list],
+        num_columns,
         num_header_rows,
         rows_per_markdown,
-        output_dir,
         append_header=True,
-):
+) -> Iterator[tuple[int, str, int]]:
     """
+    逐行消费表格数据，每 rows_per_markdown 行数据生成一个markdown表格，返回 (分片序号, markdown内容, 数据行数)。
+    只有表头起始行之前的数据行需要暂存，其余数据行读到一个分片就生成一个分片。
     - append_header=True: 按 num_header_rows 分离表头和数据。
     - append_header=False: 全部内容视为数据，表头为空，忽略 num_header_rows。
     """
-    if df.empty:
-        logger.warning(f"  源 '{sheet_index}' 的数据DataFrame为空，跳过Markdown生成。")
-        return
-
-    num_columns = df.shape[1]
-    rows = df.shape[0]
-
-    if rows == 0 or num_columns == 0:
-        return
-
-    header_block_df = pd.DataFrame()
-    start_header_idx, end_header_idx = num_header_rows[0], num_header_rows[1]
-    if start_header_idx >= rows:
-        append_header = False
-
-    # --- 核心逻辑修改：根据 append_header 决定如何切分数据 ---
+    rows = iter(rows)
+    header_rows = []
     if append_header:
-        # 根据用户规则处理表头索引越界问题
-        if start_header_idx >= rows:
-            logger.warning(f"  表头起始行 {start_header_idx} 超出总行数 {rows}。将使用第一行作为表头。")
-            start_header_idx, end_header_idx = 0, 0
-        elif end_header_idx >= rows:
-            logger.warning(f"  表头结束行 {end_header_idx} 超出总行数 {rows}。将截断至最后一行。")
-            end_header_idx = rows - 1
-
+        start_header_idx, end_header_idx = num_header_rows[0], num_header_rows[1]
         # 确保索引合法
         if start_header_idx < 0: start_header_idx = 0
         if end_header_idx < start_header_idx: end_header_idx = start_header_idx
 
-        try:
-            header_slice = slice(start_header_idx, end_header_idx + 1)
-            header_block_df = df.iloc[header_slice]
-            data_block_df = df.drop(df.index[header_slice]).reset_index(drop=True)
-            header_rows_as_lists = header_block_df.values.tolist()
-        except Exception as e:
-            logger.error(
-                f"  在源 '{sheet_index}' 中根据表头索引 [{start_header_idx}, {end_header_idx}] 切分数据时出错: {e}。跳过。")
-            return
-    else:
-        # 当 append_header 为 False 时，所有内容都视为数据，表头列表为空
-        header_rows_as_lists = []
-        data_block_df = df.reset_index(drop=True)
-
-    # --- 后续分页逻辑 ---
-    if data_block_df.empty:
-        if append_header and not header_block_df.empty:
-            markdown_content = generate_markdown_table_string(
-                header_rows_as_lists, [], num_columns
-            )
-            # BUG FIX: Use zfill for proper padding. This is file '000' for the sheet.
-            file_name = f"{str(sheet_index).zfill(2)}000.md"
-            file_path = os.path.join(output_dir, file_name)
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(markdown_content)
-                logger.debug(f"  已保存仅含表头的文件：'{file_path}'")
-            except Exception as e:
-                logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
-        return
-
-    num_data_rows_total = len(data_block_df)
-    num_files_to_create = math.ceil(num_data_rows_total / rows_per_markdown) if rows_per_markdown > 0 else (
-        1 if num_data_rows_total > 0 else 0)
-
-    for i in range(num_files_to_create):
-        start_idx = i * rows_per_markdown
-        end_idx = min(start_idx + rows_per_markdown, num_data_rows_total)
-        current_data_chunk_as_lists = data_block_df.iloc[start_idx:end_idx].values.tolist()
-
-        final_header_for_chunk = header_rows_as_lists
+        leading_rows = list(itertools.islice(rows, start_header_idx))
+        header_rows = list(itertools.islice(rows, end_header_idx - start_header_idx + 1))
+        if not header_rows:
+            # 表头起始行超出总行数，全部内容视为数据
+            append_header = False
+            rows = iter(leading_rows)
+        else:
+            if len(header_rows) < end_header_idx - start_header_idx + 1:
+                logger.warning(f"  表头结束行 {end_header_idx} 超出总行数 {start_header_idx + len(header_rows)}。"
+                               f"将截断至最后一行。")
+            rows = itertools.chain(leading_rows, rows)
+
+    chunk_index = 0
+    while True:
+        if rows_per_markdown > 0:
+            current_data_chunk_as_lists = list(itertools.islice(rows, rows_per_markdown))
+        else:
+            current_data_chunk_as_lists = list(rows)
+        if not current_data_chunk_as_lists:
+            break
+
+        final_header_for_chunk = header_rows
         final_data_for_chunk = current_data_chunk_as_lists
-
-        # 如果不附加真实表头，并且当前数据块不为空，则将数据的第一行用作“伪表头”以生成分隔符
-        if not append_header and current_data_chunk_as_lists:
+        # 如果不附加真实表头，则将数据的第一行用作“伪表头”以生成分隔符
+        if not append_header:
             final_header_for_chunk = [current_data_chunk_as_lists[0]]
             final_data_for_chunk = current_data_chunk_as_lists[1:]
 
-        markdown_content = generate_markdown_table_string(
+        yield chunk_index, generate_markdown_table_string(
             final_header_for_chunk, final_data_for_chunk, num_columns
-        )
+        ), len(current_data_chunk_as_lists)
+        chunk_index += 1
+        if rows_per_markdown <= 0:
+            break
 
-        # BUG FIX: Use zfill for proper 2-digit sheet and 3-digit file padding.
-        file_name = f"{str(sheet_index).zfill(2)}{str(i).zfill(3)}.md"
-        file_path = os.path.join(output_dir, file_name)
+    if chunk_index == 0 and append_header and header_rows:
+        # 只有表头没有数据
+        yield 0, generate_markdown_table_string(header_rows, [], num_columns), 0
 
-        try:
+
+def write_markdown_files(
+        rows: Iterable[list],
+        num_columns,
+        sheet_index: str,
+        num_header_rows,
+        rows_per_markdown,
+        output_dir,
+        append_header=True,
+) -> List[str]:
+    """
+    把 iter_markdown_chunks 生成的分片逐个写入 output_dir，返回写入的文件列表。
+    文件名为 3位sheet序号 + 6位分片序号，保证按文件名排序即为原始顺序。
+    """
+    file_paths = []
+    try:
+        for chunk_index, markdown_content, data_rows in iter_markdown_chunks(
+                rows, num_columns, num_header_rows, rows_per_markdown, append_header
+        ):
+            file_name = f"{str(sheet_index).zfill(3)}{str(chunk_index).zfill(6)}.md"
+            file_path = os.path.join(output_dir, file_name)
             with open(file_path, "w", encoding="utf-8") as f:
                 f.write(markdown_content)
-            logger.debug(
-                f"  已保存：'{file_path}' (含 {len(current_data_chunk_as_lists)} 行原始数据)"
-            )
-        except Exception as e:
-            logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
+            file_paths.append(file_path)
+            logger.debug(f"  已保存：'{file_path}' (含 {data_rows} 行原始数据)")
+    except Exception:
+        # 读取到一半出错时不保留不完整的分片
+        remove_markdown_files(file_paths)
+        raise
+    return file_paths
+
+
+def remove_markdown_files(file_paths: List[str]):
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def process_dataframe_to_markdown_files(
+        df,
+        sheet_index: str,
+        num_header_rows,
+        rows_per_markdown,
+        output_dir,
+        append_header=True,
+):
+    """
+    - append_header=True: 按 num_header_rows 分离表头和数据。
+    - append_header=False: 全部内容视为数据，表头为空，忽略 num_header_rows。
+    """
+    if df.empty or df.shape[1] == 0:
+        logger.warning(f"  源 '{sheet_index}' 的数据DataFrame为空，跳过Markdown生成。")
+        return
+
+    try:
+        write_markdown_files(df.values.tolist(), df.shape[1], sheet_index, num_header_rows,
+                             rows_per_markdown, output_dir, append_header)
+    except Exception as e:
+        logger.error(f"  源 '{sheet_index}' 生成Markdown文件时出错: {e}。跳过。")
 
 
 def is_list_of_lists_empty(data_list):
@@ -252,44 +316,63 @@ def is_list_of_lists_empty(data_list):
     return not any(any(cell is not None and str(cell).strip() != '' for cell in row) for row in data_list)
 
 
+class RowsValueTracker:
+    """ 透传行数据，同时记录是否出现过非空单元格，用来在流式处理后判断工作表是否为空 """
+
+    def __init__(self, rows: Iterable[list]):
+        self.rows = rows
+        self.has_value = False
+
+    def __iter__(self):
+        for row in self.rows:
+            if not self.has_value and not is_list_of_lists_empty([row]):
+                self.has_value = True
+            yield row
+
+
 def excel_file_to_markdown(
         excel_path, num_header_rows, rows_per_markdown, output_dir, append_header=True
 ):
     logger.debug(f"\n开始处理Excel文件：'{excel_path}'")
     try:
-        workbook = openpyxl.load_workbook(excel_path, data_only=True, read_only=False)
+        # 只读模式逐行解析，不会把整个工作表的单元格对象加载到内存中
+        workbook = openpyxl.load_workbook(excel_path, data_only=True, read_only=True)
     except Exception as e:
         logger.debug(f"错误：无法加载Excel文件 '{excel_path}'。原因: {e}")
         return
 
-    sheet_index = 0
-    for sheet_name in workbook.sheetnames:
-        logger.debug(f"\n  正在处理Excel工作表：'{sheet_name}'...")
-        sheet_obj = workbook[sheet_name]
-        unmerged_data_list_of_lists = unmerge_and_read_sheet(sheet_obj)
-
-        # 使用新的判断函数
-        if is_list_of_lists_empty(unmerged_data_list_of_lists):
-            logger.debug(f"  工作表 '{sheet_name}' 为空或无有效数据，跳过。")
-            continue
-
-        df = pd.DataFrame(unmerged_data_list_of_lists)
-        df.fillna("", inplace=True)
-        if df.empty:
-            logger.debug(f"  工作表 '{sheet_name}' 处理后为空DataFrame，跳过。")
-            continue
-
-        process_dataframe_to_markdown_files(
-            df,
-            str(sheet_index),
-            num_header_rows,
-            rows_per_markdown,
-            output_dir,
-            append_header=append_header,
-        )
-        sheet_index += 1
-
-    if workbook:
+    try:
+        sheet_index = 0
+        for sheet_name in workbook.sheetnames:
+            logger.debug(f"\n  正在处理Excel工作表：'{sheet_name}'...")
+            sheet_obj = workbook[sheet_name]
+            max_row, max_column = get_sheet_dimensions(sheet_obj)
+            if max_row == 0 or max_column == 0:
+                logger.debug(f"  工作表 '{sheet_name}' 为空或无有效数据，跳过。")
+                continue
+
+            rows = RowsValueTracker(iter_unmerged_rows(sheet_obj, max_row, max_column))
+            try:
+                file_paths = write_markdown_files(
+                    rows,
+                    max_column,
+                    str(sheet_index),
+                    num_header_rows,
+                    rows_per_markdown,
+                    output_dir,
+                    append_header=append_header,
+                )
+            except Exception as e:
+                logger.error(f"  工作表 '{sheet_name}' 生成Markdown文件时出错: {e}。跳过。")
+                continue
+
+            if not rows.has_value:
+                # 全部是空单元格，删除已经生成的分片
+                remove_markdown_files(file_paths)
+                logger.debug(f"  工作表 '{sheet_name}' 为空或无有效数据，跳过。")
+                continue
+            sheet_index += 1
+    finally:
         workbook.close()
     logger.debug(f"\nExcel文件 '{excel_path}' 处理完成。")
 
@@ -305,16 +388,17 @@ def csv_file_to_markdown(
 ):
     logger.debug(f"\n开始处理CSV文件：'{csv_path}'")
     try:
-        df = pd.read_csv(
+        # 分块读取，只把当前块的数据保留在内存中
+        reader = pd.read_csv(
             csv_path,
             header=None,
             dtype=str,
             encoding=csv_encoding,
             sep=csv_delimiter,
             keep_default_na=False,
+            chunksize=CSV_READ_CHUNK_SIZE,
         )
-        df.fillna("", inplace=True)
-
+        first_df = next(reader, None)
     except pd.errors.EmptyDataError:
         logger.debug(f"错误：CSV文件 '{csv_path}' 为空。")
         return
@@ -325,18 +409,31 @@ def csv_file_to_markdown(
         logger.debug(f"错误：无法读取CSV文件 '{csv_path}'。原因: {e}")
         return
 
-    if df.empty:
+    if first_df is None or first_df.empty:
+        reader.close()
         logger.debug(f"CSV文件 '{csv_path}' 为空或处理后为空，跳过。")
         return
 
-    process_dataframe_to_markdown_files(
-        df,
-        "0",
-        num_header_rows,
-        rows_per_markdown,
-        output_dir,
-        append_header,
-    )
+    def iter_csv_rows():
+        for df in itertools.chain([first_df], reader):
+            df.fillna("", inplace=True)
+            yield from df.values.tolist()
+
+    try:
+        write_markdown_files(
+            iter_csv_rows(),
+            first_df.shape[1],
+            "0",
+            num_header_rows,
+            rows_per_markdown,
+            output_dir,
+            append_header,
+        )
+    except Exception as e:
+        logger.debug(f"错误：无法读取CSV文件 '{csv_path}'。原因: {e}")
+        return
+    finally:
+        reader.close()
     logger.debug(f"\nCSV文件 '{csv_path}' 处理完成。")
 
 
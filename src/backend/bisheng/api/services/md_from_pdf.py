@@ -1,12 +1,164 @@
+import multiprocessing
 import os
 import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Optional
 from uuid import uuid4
 
 import fitz
 from loguru import logger
 
+from bisheng.settings import settings
+
 pymu_lock = threading.Lock()
 
+# 页数不少于这个值的pdf才分片到进程池中解析，页数少时进程间传输的开销大于并行的收益
+PARALLEL_MIN_PAGES = 32
+# 每个分片包含的页数
+PAGES_PER_SHARD = 16
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_workers = 0
+_pdf_pool_lock = threading.Lock()
+
+# 进程池中每个进程打开的pdf，同一个文件的多个分片复用同一个文档句柄
+_worker_doc = None
+_worker_doc_key = None
+
+
+def get_pdf_pool() -> (Optional[ProcessPoolExecutor], int):
+    """ 进程内共享的pdf解析进程池，未配置进程数时返回None """
+    global _pdf_pool, _pdf_pool_workers
+    max_workers = settings.get_knowledge().get('file_process', {}).get('pdf_max_workers', 4)
+    if not max_workers:
+        return None, 0
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # celery使用线程池运行任务，fork时其他线程可能持有锁，使用spawn创建子进程
+            _pdf_pool = ProcessPoolExecutor(max_workers=max_workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+            _pdf_pool_workers = max_workers
+        return _pdf_pool, _pdf_pool_workers
+
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+def convert_page_to_md(doc, page_num: int, img_dir: str) -> str:
+    """ 将pdf的一页转为markdown片段，文本、表格和图片按在页面上的垂直位置排序 """
+    page = doc.load_page(page_num)
+
+    page_elements = []
+
+    tables = page.find_tables()
+    table_bboxes = []
+    for tab in tables.tables:
+        table_bboxes.append(fitz.Rect(tab.bbox))
+        df = tab.to_pandas()
+        if not df.empty:
+            page_elements.append(
+                {
+                    "type": "table",
+                    "bbox": table_bboxes[-1],
+                    "content": df.to_markdown(index=False),
+                }
+            )
+
+    image_counter = 1
+    image_info_list = page.get_image_info(xrefs=True)
+    for img_info in image_info_list or []:
+        xref = img_info["xref"]
+        if xref == 0:
+            continue
+
+        base_image = doc.extract_image(xref)
+        if not base_image:
+            continue
+
+        image_bytes = base_image["image"]
+        image_ext = base_image["ext"]
+
+        img_filename = f"image_{page_num + 1}_{image_counter}.{image_ext}"
+        img_path = os.path.join(img_dir, img_filename)
+
+        with open(img_path, "wb") as img_file:
+            img_file.write(image_bytes)
+
+        md_image = f"![{img_filename}]({img_dir}/{img_filename})"
+
+        image_bbox = fitz.Rect(img_info["bbox"])
+        page_elements.append(
+            {"type": "image", "bbox": image_bbox, "content": md_image}
+        )
+        image_counter += 1
+
+    text_blocks = page.get_text("blocks")
+    for b in text_blocks:
+        block_rect = fitz.Rect(b[:4])
+        block_text = b[4].strip()
+
+        is_in_table = False
+        for table_bbox in table_bboxes:
+            if block_rect.intersects(table_bbox):
+                is_in_table = True
+                break
+
+        if block_text and not is_in_table:
+            page_elements.append(
+                {"type": "text", "bbox": block_rect, "content": block_text}
+            )
+
+    page_elements.sort(key=lambda el: el["bbox"].y0)
+    return "".join(elem["content"] + "\n\n" for elem in page_elements)
+
+
+def convert_page_range_to_md(pdf_path: str, img_dir: str, start: int, end: int) -> str:
+    """ 进程池中执行，解析 [start, end) 页 """
+    global _worker_doc, _worker_doc_key
+    stat = os.stat(pdf_path)
+    doc_key = (pdf_path, stat.st_mtime, stat.st_size)
+    if _worker_doc_key != doc_key:
+        if _worker_doc is not None:
+            _worker_doc.close()
+        _worker_doc = fitz.open(pdf_path)
+        _worker_doc_key = doc_key
+    return "".join(convert_page_to_md(_worker_doc, page_num, img_dir) for page_num in range(start, end))
+
+
+def _write_pages_in_pool(pool: ProcessPoolExecutor, max_workers: int, pdf_path: str, img_dir: str,
+                         page_count: int, md_file: IO[str]):
+    """
+    按页分片提交到进程池，分片的结果按页码顺序写入文件
+    已提交和等待写入的分片数不超过进程数的2倍，内存中只保留少量分片的内容
+    """
+    shards = [(start, min(start + PAGES_PER_SHARD, page_count)) for start in range(0, page_count, PAGES_PER_SHARD)]
+    max_pending = max_workers * 2
+    pending = {}
+    finished = {}
+    next_submit = 0
+    next_write = 0
+    try:
+        while next_write < len(shards):
+            while next_submit < len(shards) and len(pending) + len(finished) < max_pending:
+                future = pool.submit(convert_page_range_to_md, pdf_path, img_dir, *shards[next_submit])
+                pending[future] = next_submit
+                next_submit += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished[pending.pop(future)] = future.result()
+            while next_write in finished:
+                md_file.write(finished.pop(next_write))
+                next_write += 1
+    finally:
+        for future in pending:
+            future.cancel()
+
 
 def convert_pdf_to_md(output_dir, pdf_path, doc_id):
     """
@@ -15,6 +167,7 @@ def convert_pdf_to_md(output_dir, pdf_path, doc_id):
     这个函数会提取 PDF 中的文本、表格和图片，并根据它们在页面上的
     垂直位置进行排序，然后整合到一个 Markdown 文件中。
     图片会作为独立文件保存在指定的输出目录中。
+    页数较多的 PDF 按页分片到进程池中并行解析，解析结果按页码顺序流式写入文件。
 
     Args:
         pdf_path (str): 输入的 PDF 文件路径。
@@ -38,86 +191,24 @@ def convert_pdf_to_md(output_dir, pdf_path, doc_id):
     except Exception as e:
         raise Exception('The file is damaged.')
     try:
-        md_content = ""
-        image_counter = 1
-
-        for page_num in range(len(doc)):
-            with pymu_lock:
-                page = doc.load_page(page_num)
-
-                page_elements = []
-
-                tables = page.find_tables()
-                if tables.tables:
-                    for tab in tables.tables:
-                        if not tab.to_pandas().empty:
-                            md_table = tab.to_pandas().to_markdown(index=False)
-                            table_bbox = fitz.Rect(tab.bbox)
-                            page_elements.append(
-                                {
-                                    "type": "table",
-                                    "bbox": table_bbox,
-                                    "content": md_table,
-                                }
-                            )
-
-                image_info_list = page.get_image_info(xrefs=True)
-                if image_info_list:
-                    for img_info in image_info_list:
-                        xref = img_info["xref"]
-                        if xref == 0:
-                            continue
-
-                        base_image = doc.extract_image(xref)
-                        if not base_image:
-                            continue
-
-                        image_bytes = base_image["image"]
-                        image_ext = base_image["ext"]
-
-                        img_filename = f"image_{page_num + 1}_{image_counter}.{image_ext}"
-                        img_path = os.path.join(img_dir, img_filename)
-
-                        with open(img_path, "wb") as img_file:
-                            img_file.write(image_bytes)
-
-                        md_image = f"![{img_filename}]({img_dir}/{img_filename})"
-
-                        image_bbox = fitz.Rect(img_info["bbox"])
-                        page_elements.append(
-                            {"type": "image", "bbox": image_bbox, "content": md_image}
-                        )
-                        image_counter += 1
-
-                table_bboxes = (
-                    [fitz.Rect(tab.bbox) for tab in tables.tables]
-                    if tables.tables
-                    else []
-                )
-
-                text_blocks = page.get_text("blocks")
-                for b in text_blocks:
-                    block_rect = fitz.Rect(b[:4])
-                    block_text = b[4].strip()
-
-                    is_in_table = False
-                    for table_bbox in table_bboxes:
-                        if block_rect.intersects(table_bbox):
-                            is_in_table = True
-                            break
-
-                    if block_text and not is_in_table:
-                        page_elements.append(
-                            {"type": "text", "bbox": block_rect, "content": block_text}
-                        )
-
-            page_elements.sort(key=lambda el: el["bbox"].y0)
-
-            for elem in page_elements:
-                md_content += elem["content"] + "\n\n"
-
+        page_count = len(doc)
+        pool, max_workers = (None, 0) if page_count < PARALLEL_MIN_PAGES else get_pdf_pool()
         with open(md_filepath, "w", encoding="utf-8") as md_file:
-            md_file.write(md_content)
+            if pool is not None:
+                with pymu_lock:
+                    doc.close()
+                    doc = None
+                logger.info(f"convert_pdf_to_md_parallel pages={page_count} workers={max_workers}")
+                try:
+                    _write_pages_in_pool(pool, max_workers, os.path.abspath(pdf_path), img_dir, page_count, md_file)
+                except BrokenProcessPool:
+                    # 子进程异常退出后进程池不可再用，下次解析时重新创建
+                    _reset_pdf_pool()
+                    raise
+            else:
+                for page_num in range(page_count):
+                    with pymu_lock:
+                        md_file.write(convert_page_to_md(doc, page_num, img_dir))
 
     except Exception as e:
         logger.exception(f"Error processing pdf: {e}")
@@ -1,4 +1,5 @@
 import os
+from typing import Iterator, Optional
 
 from langchain_core.documents import Document
 
@@ -12,30 +13,42 @@ from bisheng.cache.utils import CACHE_DIR
 from bisheng.utils.minio_client import minio_client
 
 
+def iter_md_files(path) -> Iterator[str]:
+    """ 按文件名顺序逐个返回目录下md文件的内容 """
+    for file_name in sorted(os.listdir(path)):
+        with open(f"{path}/{file_name}", "r", encoding="utf-8") as f:
+            yield f.read()
+
+
 def combine_multiple_md_files_to_raw_texts(
         path,
+        max_combined_length: Optional[int] = None,
 ) -> tuple[list[Document], list[Document]]:
     """
     combine multiple md file to raw texts including meta-data list.
     Args:
         path: the directory containing the md files.
+        max_combined_length: the max length of the combined text, None means no limit.
     Returns:
         0: split raw texts, each text is a Document object.
         1: a single Document object containing all the texts combined.
     """
-
-    files = sorted([f for f in os.listdir(path)])
     raw_texts = []
+    combined_texts = []
+    combined_length = 0
 
-    # 一个文件只对应一个完整的 Document 对象, texts 才是切分后的chunk内容
-    documents = [Document(page_content="", metadata={})]
+    for content in iter_md_files(path):
+        raw_texts.append(Document(page_content=content, metadata={}))
+        # 合并后的内容只用来提取文档摘要，达到长度限制后不再拼接，避免大表格在内存中再存一份完整内容
+        if max_combined_length is None or combined_length < max_combined_length:
+            combined_texts.append(content)
+            combined_length += len(content)
 
-    for file_name in files:
-        full_file_name = f"{path}/{file_name}"
-        with open(full_file_name, "r", encoding="utf-8") as f:
-            content = f.read()
-            raw_texts.append(Document(page_content=content, metadata={}))
-            documents[0].page_content += content
+    # 一个文件只对应一个完整的 Document 对象, texts 才是切分后的chunk内容
+    combined_text = "".join(combined_texts)
+    if max_combined_length is not None:
+        combined_text = combined_text[:max_combined_length]
+    documents = [Document(page_content=combined_text, metadata={})]
     return raw_texts, documents
 
 
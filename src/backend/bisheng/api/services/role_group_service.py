@@ -8,7 +8,7 @@ from fastapi import Request, HTTPException
 from bisheng.cache.redis import redis_client
 from bisheng.api.services.assistant import AssistantService
 from bisheng.api.services.audit_log import AuditLogService
-from bisheng.api.services.user_service import UserPayload
+from bisheng.api.services.user_service import UserPayload, notify_knowledge_auth_update
 from bisheng.api.errcode.user import UserGroupNotDeleteError
 from bisheng.api.utils import get_request_ip
 from bisheng.api.v1.schemas import resp_200
@@ -127,6 +127,7 @@ class RoleGroupService():
         GroupResourceDao.delete_group_resource_by_group_id(group_info.id)
         # 删除用户组下的角色列表
         RoleDao.delete_role_by_group_id(group_info.id)
+        notify_knowledge_auth_update()
         # 删除用户组的管理员
         UserGroupDao.delete_group_all_admin(group_info.id)
         # 将删除事件发到redis队列中
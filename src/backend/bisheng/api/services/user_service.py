@@ -1,5 +1,6 @@
 import functools
 import json
+import time
 from base64 import b64decode
 from typing import List, Dict
 
@@ -21,7 +22,7 @@ from bisheng.database.models.user import User, UserDao
 from bisheng.database.models.user_group import UserGroupDao
 from bisheng.database.models.user_role import UserRoleDao
 from bisheng.settings import settings
-from bisheng.utils.constants import RSA_KEY, USER_CURRENT_SESSION
+from bisheng.utils.constants import KNOWLEDGE_AUTH_VERSION, RSA_KEY, USER_CURRENT_SESSION
 from fastapi import Depends, HTTPException, Request
 from fastapi_jwt_auth import AuthJWT
 
@@ -161,6 +162,11 @@ class UserService:
         return user
 
 
+def notify_knowledge_auth_update():
+    """ 用户角色或者角色权限变化后调用，让各个进程中缓存的知识库检索器失效 """
+    redis_client.set(KNOWLEDGE_AUTH_VERSION, time.time(), expiration=None)
+
+
 def sso_login():
     pass
 
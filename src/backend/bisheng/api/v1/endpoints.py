@@ -11,7 +11,6 @@ from bisheng.api.services.user_service import UserPayload, get_admin_user, get_l
 from bisheng.api.utils import get_request_ip
 from bisheng.api.v1.schemas import (ProcessResponse, UploadFileResponse,
                                     resp_200)
-from bisheng.cache.redis import redis_client
 from bisheng.cache.utils import save_uploaded_file, upload_file_to_minio
 from bisheng.chat.utils import judge_source, process_source_document
 from bisheng.database.models.config import Config, ConfigDao, ConfigKeyEnum
@@ -91,7 +90,7 @@ def save_config(data: dict, admin_user: UserPayload = Depends(get_admin_user)):
         db_config = ConfigDao.get_config(ConfigKeyEnum.INIT_DB)
         db_config.value = data.get('data')
         ConfigDao.insert_config(db_config)
-        redis_client.delete('config:initdb_config')
+        settings.initdb_config_cache.notify_update()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'格式不正确, {str(e)}')
 
@@ -24,7 +24,8 @@ from bisheng.api.utils import get_request_ip
 from bisheng.api.services.audit_log import AuditLogService
 from bisheng.api.services.captcha import verify_captcha
 from bisheng.api.services.user_service import (UserPayload, gen_user_jwt, gen_user_role, get_login_user,
-                                               get_assistant_list_by_access, get_admin_user, UserService)
+                                               get_assistant_list_by_access, get_admin_user, UserService,
+                                               notify_knowledge_auth_update)
 from bisheng.api.v1.schemas import UnifiedResponseModel, resp_200, CreateUserReq
 from bisheng.database.models.mark_task import MarkTaskDao
 
@@ -501,6 +502,7 @@ async def delete_role(*,
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail='删除角色失败')
+    notify_knowledge_auth_update()
     AuditLogService.delete_role(login_user, get_request_ip(request), db_role)
     return resp_200()
 
@@ -555,6 +557,7 @@ async def user_addrole(*,
     if need_delete_role:
         # 删除对应的角色列表
         UserRoleDao.delete_user_roles(user_role.user_id, need_delete_role)
+    notify_knowledge_auth_update()
     update_user_role_hook(request, login_user, user_role.user_id, old_roles, user_role.role_id)
     return resp_200()
 
@@ -630,6 +633,7 @@ async def access_refresh(*, request: Request, data: RoleRefresh, login_user: Use
             role_access = RoleAccess(role_id=role_id, third_id=str(third_id), type=access_type)
             session.add(role_access)
         session.commit()
+    notify_knowledge_auth_update()
     update_role_hook(request, login_user, db_role)
     return resp_200()
 
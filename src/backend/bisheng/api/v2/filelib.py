@@ -157,6 +157,20 @@ def get_filelist(request: Request,
     return resp_200(data={'data': data, 'total': total, 'writeable': flag})
 
 
+@router.get('/chunk', status_code=200)
+def get_knowledge_chunk(request: Request,
+                        knowledge_id: int,
+                        file_ids: List[int] = Query(default=[]),
+                        keyword: str = None,
+                        limit: int = 10,
+                        cursor: str = None):
+    """ 按游标遍历知识库分块内容，第一页不传cursor，之后传上一页返回的next_cursor """
+    login_user = get_default_operator()
+    res, total, next_cursor = KnowledgeService.get_knowledge_chunks(request, login_user, knowledge_id, file_ids,
+                                                                    keyword, 1, limit, cursor)
+    return resp_200(data={'data': res, 'total': total, 'next_cursor': next_cursor})
+
+
 @router.post('/chunks')
 async def post_chunks(request: Request,
                       knowledge_id: int = Form(...),
@@ -0,0 +1,179 @@
+import hashlib
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Dict, List, Optional
+
+from cachetools import LRUCache
+from loguru import logger
+
+from bisheng.cache.redis import redis_client
+from bisheng.settings import settings
+
+# 默认redis中向量的过期时间，7天
+DEFAULT_EXPIRE_TIME = 7 * 24 * 3600
+# 默认进程内缓存的向量总大小（MB）
+DEFAULT_LOCAL_CACHE_MB = 64
+# 默认redis中最多缓存的向量个数，1024维的向量约占400MB
+DEFAULT_REDIS_MAX_KEYS = 100000
+# 记录redis中向量最近访问时间的有序集合，超过上限时按最近最少使用淘汰
+REDIS_INDEX_KEY = 'embedding_cache:index'
+
+
+class EmbeddingCache:
+    """
+    按 (embedding模型, 文本内容的sha256) 缓存向量，相同内容的文本重复入库或者复制知识库时不需要再调用embedding服务
+    进程内LRU缓存作为一级缓存，redis作为多个worker共享的二级缓存
+    redis中的向量除了过期时间外，还通过有序集合记录最近访问时间，总数超过redis_max_keys时淘汰最久没有访问的向量
+    向量以float32的二进制格式存储，和milvus中存储的精度一致，进程内缓存按字节数限制大小，读取时才转换成list
+    """
+
+    def __init__(self):
+        self._local: Optional[LRUCache] = None
+        self._lock = threading.Lock()
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_local_max_size() -> int:
+        """ 进程内缓存大小上限，单位字节 """
+        conf = settings.get_knowledge().get('embedding', {})
+        return int(conf.get('local_cache_mb', DEFAULT_LOCAL_CACHE_MB)) * 1024 * 1024
+
+    @staticmethod
+    def get_redis_max_keys() -> int:
+        """ redis中缓存的向量个数上限 """
+        conf = settings.get_knowledge().get('embedding', {})
+        return int(conf.get('redis_max_keys') or DEFAULT_REDIS_MAX_KEYS)
+
+    def _get_local(self) -> LRUCache:
+        """ 第一次使用时再读取配置创建，避免导入模块时访问配置 """
+        if self._local is None:
+            self._local = LRUCache(maxsize=self.get_local_max_size(), getsizeof=len)
+        return self._local
+
+    @staticmethod
+    def cache_key(namespace: str, text: str) -> str:
+        text = unicodedata.normalize('NFC', text).strip()
+        return f'embedding:{namespace}:{hashlib.sha256(text.encode("utf-8")).hexdigest()}'
+
+    @staticmethod
+    def _dumps(vector: List[float]) -> bytes:
+        return array('f', vector).tobytes()
+
+    @staticmethod
+    def _loads(value: bytes) -> List[float]:
+        vector = array('f')
+        vector.frombytes(value)
+        return vector.tolist()
+
+    @staticmethod
+    def _set_local(local: LRUCache, key: str, value: bytes):
+        try:
+            local[key] = value
+        except ValueError:
+            # 单个向量超过了缓存大小上限
+            pass
+
+    def get_many(self, namespace: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """ 批量获取文本的向量，未命中的位置为None """
+        keys = [self.cache_key(namespace, one) for one in texts]
+        result: List[Optional[List[float]]] = [None] * len(keys)
+        redis_index = []
+        with self._lock:
+            local = self._get_local()
+            for index, key in enumerate(keys):
+                value = local.get(key)
+                if value is not None:
+                    result[index] = self._loads(value)
+                else:
+                    redis_index.append(index)
+            self.local_hits += len(keys) - len(redis_index)
+
+        if redis_index:
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                for index in redis_index:
+                    pipe.get(keys[index])
+                values = pipe.execute()
+            except Exception as e:
+                logger.warning(f'get embedding cache from redis failed: {e}')
+                values = [None] * len(redis_index)
+            self._touch_redis([keys[index] for index, value in zip(redis_index, values) if value])
+            redis_hits = 0
+            with self._lock:
+                local = self._get_local()
+                for index, value in zip(redis_index, values):
+                    if not value:
+                        continue
+                    result[index] = self._loads(value)
+                    self._set_local(local, keys[index], value)
+                    redis_hits += 1
+                self.redis_hits += redis_hits
+                self.misses += len(redis_index) - redis_hits
+        return result
+
+    def set_many(self, namespace: str, texts: List[str], vectors: List[List[float]],
+                 expire_time: int = DEFAULT_EXPIRE_TIME):
+        keys = [self.cache_key(namespace, one) for one in texts]
+        values = [self._dumps(vector) for vector in vectors]
+        with self._lock:
+            local = self._get_local()
+            for key, value in zip(keys, values):
+                self._set_local(local, key, value)
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key, value in zip(keys, values):
+                pipe.set(key, value, ex=expire_time)
+            now = time.time()
+            pipe.zadd(REDIS_INDEX_KEY, {key: now for key in keys})
+            # 已经过期的向量不再占用上限
+            pipe.zremrangebyscore(REDIS_INDEX_KEY, '-inf', now - expire_time)
+            pipe.zcard(REDIS_INDEX_KEY)
+            count = pipe.execute()[-1]
+            self._evict_redis(count)
+        except Exception as e:
+            logger.warning(f'set embedding cache to redis failed: {e}')
+
+    @staticmethod
+    def _touch_redis(keys: List[str]):
+        """ 更新命中的向量的访问时间 """
+        if not keys:
+            return
+        try:
+            now = time.time()
+            redis_client.pipeline(transaction=False).zadd(REDIS_INDEX_KEY, {key: now for key in keys}).execute()
+        except Exception as e:
+            logger.warning(f'touch embedding cache in redis failed: {e}')
+
+    def _evict_redis(self, count: int):
+        """ 超过上限时删除最久没有访问的向量，多个进程同时淘汰时zpopmin保证不会重复删除 """
+        over = count - self.get_redis_max_keys()
+        if over <= 0:
+            return
+        popped = redis_client.connection.zpopmin(REDIS_INDEX_KEY, over)
+        keys = [key.decode() if isinstance(key, bytes) else key for key, _ in popped]
+        if keys:
+            pipe = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.delete(key)
+            pipe.execute()
+            logger.debug(f'evict embedding cache from redis count={len(keys)}')
+
+    def stats(self) -> Dict:
+        """ 缓存的命中统计 """
+        total = self.local_hits + self.redis_hits + self.misses
+        return {
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.local_hits + self.redis_hits) / total, 4) if total else 0.0,
+            'local_size': len(self._local) if self._local is not None else 0,
+            'local_bytes': self._local.currsize if self._local is not None else 0,
+        }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+from loguru import logger
+
+from bisheng.cache.utils import CACHE_DIR
+from bisheng.settings import settings
+from bisheng.utils.minio_client import minio_client
+
+# 默认本地缓存的文件总大小（MB）
+DEFAULT_MAX_SIZE = 2048
+# 默认不淘汰最近一小时内使用过的文件（秒）
+DEFAULT_GRACE_TIME = 3600
+# 从minio读取文件时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class MinioFileCache:
+    """
+    minio文件的本地缓存，预览、入库、重试解析同一个文件时只需要下载一次
+    - 文件内容直接从minio流式写入磁盘，不在内存中保留整个文件
+    - 文件按内容的sha256存储，文件名和原来的下载文件一致：{sha256}_{文件名}，相同内容的不同对象共用一份文件
+    - 索引以 (bucket, object_name, etag) 为key，对象被覆盖后etag变化，会重新下载
+    - 索引和文件都在磁盘上，同一台机器上的多个worker进程共享，超过大小限制时按最近使用时间淘汰，
+      最近使用过的文件可能正在被解析，不会被淘汰
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self.index_dir = self.cache_dir / 'index'
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_max_size() -> int:
+        """ 缓存大小上限，单位字节 """
+        conf = settings.get_knowledge().get('file_cache', {})
+        return int(conf.get('max_size', DEFAULT_MAX_SIZE)) * 1024 * 1024
+
+    @staticmethod
+    def get_grace_time() -> int:
+        """ 最近使用过的文件在这段时间内不会被淘汰，单位秒 """
+        conf = settings.get_knowledge().get('file_cache', {})
+        return int(conf.get('grace_time', DEFAULT_GRACE_TIME))
+
+    @staticmethod
+    def index_key(bucket_name: str, object_name: str, etag: str) -> str:
+        return hashlib.md5(f'{bucket_name}/{object_name}:{etag}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def local_file_name(sha256: str, file_name: str) -> str:
+        # 和 save_download_file 的命名规则保持一致，解析上传文件时会从文件名中取md5
+        if len(file_name) > 60:
+            file_name = file_name[-60:]
+        return f'{sha256}_{file_name}'
+
+    def _ensure_dir(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+    def _get_index(self, key: str) -> Optional[Path]:
+        index_file = self.index_dir / key
+        try:
+            local_name = index_file.read_text(encoding='utf-8').strip()
+        except FileNotFoundError:
+            return None
+        file_path = self.cache_dir / local_name
+        if not file_path.is_file():
+            # 文件已经被淘汰
+            index_file.unlink(missing_ok=True)
+            return None
+        # 更新最近使用时间
+        os.utime(file_path)
+        return file_path
+
+    def _set_index(self, key: str, file_path: Path):
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(file_path.name)
+        os.replace(tmp_path, self.index_dir / key)
+
+    def _download(self, bucket_name: str, object_name: str, etag: str, file_name: str) -> Path:
+        """ 流式下载到临时文件，下载完成后按内容的sha256重命名 """
+        sha256_hash = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.downloading')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in minio_client.iter_object(bucket_name, object_name, DOWNLOAD_CHUNK_SIZE,
+                                                      request_headers={'If-Match': etag}):
+                    sha256_hash.update(chunk)
+                    f.write(chunk)
+            # mkstemp创建的文件只有当前用户可读，和普通下载的文件保持一致
+            os.chmod(tmp_path, 0o644)
+            file_path = self.cache_dir / self.local_file_name(sha256_hash.hexdigest(), file_name)
+            os.replace(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return file_path
+
+    def get_file(self, bucket_name: str, object_name: str) -> Tuple[str, str]:
+        """
+        获取minio对象对应的本地文件，没有缓存时从minio下载
+        return: 本地文件路径, 文件名
+        """
+        object_name = object_name.lstrip('/')
+        file_name = os.path.basename(object_name)
+        self._ensure_dir()
+
+        etag = minio_client.stat_object(bucket_name, object_name).etag
+        key = self.index_key(bucket_name, object_name, etag)
+        file_path = self._get_index(key)
+        if file_path is not None:
+            logger.debug(f'minio_file_cache hit bucket={bucket_name} object={object_name}')
+            return str(file_path), file_name
+
+        start_time = time.time()
+        file_path = self._download(bucket_name, object_name, etag, file_name)
+        self._set_index(key, file_path)
+        logger.debug(f'minio_file_cache download bucket={bucket_name} object={object_name} '
+                     f'size={file_path.stat().st_size} cost={time.time() - start_time:.3f}s')
+        self.evict(keep=file_path)
+        return str(file_path), file_name
+
+    def add_file(self, bucket_name: str, object_name: str, etag: str, file_path: str):
+        """ 本地缓存的文件上传到minio后，把新对象也指向这份文件，后续解析时不用再下载 """
+        file_path = Path(file_path)
+        if file_path.parent != self.cache_dir or not file_path.is_file():
+            return
+        try:
+            self._ensure_dir()
+            self._set_index(self.index_key(bucket_name, object_name.lstrip('/'), etag), file_path)
+        except Exception as e:
+            logger.warning(f'minio_file_cache add_file failed: {e}')
+
+    def copy_file(self, source_bucket: str, source_object: str, bucket_name: str, object_name: str, etag: str):
+        """ minio中复制对象后，新对象复用源对象的本地缓存 """
+        try:
+            source_object = source_object.lstrip('/')
+            source_etag = minio_client.stat_object(source_bucket, source_object).etag
+            file_path = self._get_index(self.index_key(source_bucket, source_object, source_etag))
+            if file_path is not None:
+                self._set_index(self.index_key(bucket_name, object_name.lstrip('/'), etag), file_path)
+        except Exception as e:
+            logger.warning(f'minio_file_cache copy_file failed: {e}')
+
+    def evict(self, keep: Path = None):
+        """ 超过大小上限时，按最近使用时间删除最早的文件，并清理指向已删除文件的索引 """
+        max_size = self.get_max_size()
+        grace_deadline = time.time() - self.get_grace_time()
+        with self._lock:
+            files = []
+            total_size = 0
+            for one in os.scandir(self.cache_dir):
+                if not one.is_file():
+                    continue
+                stat = one.stat()
+                if one.name.endswith('.downloading'):
+                    # 下载中断残留的临时文件
+                    if stat.st_mtime < grace_deadline:
+                        self._remove(one.path)
+                    continue
+                files.append((stat.st_mtime, stat.st_size, one.path))
+                total_size += stat.st_size
+            if total_size <= max_size:
+                return
+            files.sort()
+            evicted = 0
+            for mtime, size, path in files:
+                if total_size <= max_size or mtime >= grace_deadline:
+                    # 剩下的文件都是最近使用过的，可能正在被解析
+                    break
+                if keep is not None and path == str(keep):
+                    continue
+                if self._remove(path):
+                    total_size -= size
+                    evicted += 1
+            if total_size > max_size:
+                logger.debug(f'minio_file_cache over max_size after evict, size={total_size} max_size={max_size}')
+            if evicted:
+                self._prune_index(grace_deadline)
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _prune_index(self, grace_deadline: float):
+        """ 删除指向不存在文件的索引，其他进程淘汰的文件对应的索引也一起清理 """
+        for one in os.scandir(self.index_dir):
+            if not one.is_file():
+                continue
+            if one.name.endswith('.tmp'):
+                # 正在写入的索引，只清理写入中断残留的
+                if one.stat().st_mtime < grace_deadline:
+                    self._remove(one.path)
+                continue
+            try:
+                with open(one.path, encoding='utf-8') as f:
+                    local_name = f.read().strip()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f'minio_file_cache read index failed: {one.path} {e}')
+                continue
+            if not local_name or not (self.cache_dir / local_name).is_file():
+                self._remove(one.path)
+
+
+minio_file_cache = MinioFileCache(os.path.join(CACHE_DIR, 'minio_files'))
@@ -2,36 +2,53 @@ import pickle
 from typing import Dict, Optional
 
 import redis
+import redis.asyncio as aioredis
 from bisheng.settings import settings
 from loguru import logger
 from redis import ConnectionPool, RedisCluster
+from redis.asyncio.cluster import ClusterNode as AsyncClusterNode
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
 from redis.backoff import ExponentialBackoff
 from redis.cluster import ClusterNode
 from redis.retry import Retry
 from redis.sentinel import Sentinel
 
 
+def _parse_redis_conf(url) -> (str, dict):
+    """ 解析redis配置，返回连接模式和对应的连接参数 """
+    if not isinstance(url, Dict):
+        return 'single', {}
+    redis_conf = dict(url)
+    mode = redis_conf.pop('mode', 'sentinel')
+    return mode, redis_conf
+
+
 class RedisClient:
+    """ 同步的redis客户端, 连接池内的连接会被复用，不再在每次调用后关闭 """
 
     def __init__(self, url, max_connections=10):
-        # # 哨兵模式
-        if isinstance(settings.redis_url, Dict):
-            redis_conf = dict(settings.redis_url)
-            mode = redis_conf.pop('mode', 'sentinel')
-            if mode == 'cluster':
-                # 集群模式
-                cluster_url = ''
-                if 'startup_nodes' in redis_conf:
-                    first_node = redis_conf['startup_nodes'][0]
-                    cluster_url = f'redis://{first_node["host"]}:{first_node["port"]}'
-                    redis_conf['startup_nodes'] = [
-                        ClusterNode(node.get('host'), node.get('port'))
-                        for node in redis_conf['startup_nodes']
-                    ]
-                self.connection = RedisCluster.from_url(cluster_url, **redis_conf,
-                                                        retry=Retry(ExponentialBackoff(), 6),
-                                                        cluster_error_retry_attempts=1)
-                return
+        mode, redis_conf = _parse_redis_conf(url)
+        if mode == 'cluster':
+            # 集群模式
+            cluster_url = ''
+            if 'startup_nodes' in redis_conf:
+                first_node = redis_conf['startup_nodes'][0]
+                cluster_url = f'redis://{first_node["host"]}:{first_node["port"]}'
+                redis_conf['startup_nodes'] = [
+                    ClusterNode(node.get('host'), node.get('port'))
+                    for node in redis_conf['startup_nodes']
+                ]
+            self.connection = RedisCluster.from_url(cluster_url, **redis_conf,
+                                                    retry=Retry(ExponentialBackoff(), 6),
+                                                    cluster_error_retry_attempts=1)
+        elif mode == 'single':
+            # 单机模式
+            self.pool = ConnectionPool.from_url(url, max_connections=max_connections)
+            self.connection = redis.StrictRedis(connection_pool=self.pool)
+        else:
+            # 哨兵模式
             hosts = [eval(x) for x in redis_conf.pop('sentinel_hosts')]
             password = redis_conf.pop('sentinel_password')
             master = redis_conf.pop('sentinel_master')
@@ -39,51 +56,46 @@ class RedisClient:
             # 获取主节点的连接
             self.connection = sentinel.master_for(master, socket_timeout=0.1, **redis_conf)
 
-        else:
-            # 单机模式
-            self.pool = ConnectionPool.from_url(url, max_connections=max_connections)
-            self.connection = redis.StrictRedis(connection_pool=self.pool)
+    def pipeline(self, transaction: bool = True):
+        """ 获取pipeline对象，批量发送命令，一次网络往返
+        集群模式不支持事务，只做命令的批量发送
+        """
+        if isinstance(self.connection, RedisCluster):
+            return self.connection.pipeline()
+        return self.connection.pipeline(transaction=transaction)
 
     def set(self, key, value, expiration=3600):
         try:
             if pickled := pickle.dumps(value):
                 self.cluster_nodes(key)
-                if expiration:
-                    result = self.connection.setex(key, expiration, pickled)
-                else:
-                    result = self.connection.set(key, pickled)
+                # SET key value EX expiration, 一条命令完成设置和过期
+                result = self.connection.set(key, pickled, ex=expiration or None)
                 if not result:
                     raise ValueError('RedisCache could not set the value.')
             else:
                 logger.error('pickle error, value={}', value)
         except TypeError as exc:
             raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
-        finally:
-            self.close()
 
     def setNx(self, key, value, expiration=3600):
         try:
             if pickled := pickle.dumps(value):
                 self.cluster_nodes(key)
-                result = self.connection.setnx(key, pickled)
-                self.connection.expire(key, expiration)
+                result = self.connection.set(key, pickled, ex=expiration or None, nx=True)
                 if not result:
                     return False
                 return True
         except TypeError as exc:
             raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
-        finally:
-            self.close()
 
     def hsetkey(self, name, key, value, expiration=3600):
-        try:
-            self.cluster_nodes(key)
-            r = self.connection.hset(name, key, value)
-            if expiration:
-                self.connection.expire(name, expiration)
-            return r
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        if not expiration:
+            return self.connection.hset(name, key, value)
+        pipe = self.pipeline()
+        pipe.hset(name, key, value)
+        pipe.expire(name, expiration)
+        return pipe.execute()[0]
 
     def hset(self, name,
              key: Optional[str] = None,
@@ -91,100 +103,71 @@ class RedisClient:
              mapping: Optional[dict] = None,
              items: Optional[list] = None,
              expiration: int = 3600):
-        try:
-            self.cluster_nodes(name)
-            r = self.connection.hset(name, key, value, mapping, items)
-            if expiration:
-                self.connection.expire(name, expiration)
-            return r
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        if not expiration:
+            return self.connection.hset(name, key, value, mapping, items)
+        pipe = self.pipeline()
+        pipe.hset(name, key, value, mapping, items)
+        pipe.expire(name, expiration)
+        return pipe.execute()[0]
 
     def hget(self, name, key):
-        try:
-            self.cluster_nodes(name)
-            return self.connection.hget(name, key)
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        return self.connection.hget(name, key)
 
     def hgetall(self, name):
-        try:
-            self.cluster_nodes(name)
-            return self.connection.hgetall(name)
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        return self.connection.hgetall(name)
 
     def hdel(self, name, *keys):
-        try:
-            self.cluster_nodes(name)
-            return self.connection.hdel(name, *keys)
-        finally:
-            self.close()
+        self.cluster_nodes(name)
+        return self.connection.hdel(name, *keys)
 
     def get(self, key):
-        try:
-            self.cluster_nodes(key)
-            value = self.connection.get(key)
-            return pickle.loads(value) if value else None
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        value = self.connection.get(key)
+        return pickle.loads(value) if value else None
 
     def incr(self, key, expiration=3600) -> int:
-        try:
-            self.cluster_nodes(key)
-            value = self.connection.incr(key)
-            if expiration:
-                self.connection.expire(key, expiration)
-            return value
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        if not expiration:
+            return self.connection.incr(key)
+        pipe = self.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, expiration)
+        return pipe.execute()[0]
 
     def expire_key(self, key, expiration: int):
-        try:
-            self.cluster_nodes(key)
-            self.connection.expire(key, expiration)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        self.connection.expire(key, expiration)
 
     def delete(self, key):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.delete(key)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return self.connection.delete(key)
 
     def rpush(self, key, value, expiration=3600):
-        try:
-            self.cluster_nodes(key)
-            ret = self.connection.rpush(key, value)
-            if expiration:
-                self.expire_key(key, expiration)
-            return ret
-        finally:
-            self.close()
-
-    def lpop(self, key, count: int=None):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.lpop(key, count)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        if not expiration:
+            return self.connection.rpush(key, value)
+        pipe = self.pipeline()
+        pipe.rpush(key, value)
+        pipe.expire(key, expiration)
+        return pipe.execute()[0]
+
+    def lpop(self, key, count: int = None):
+        self.cluster_nodes(key)
+        return self.connection.lpop(key, count)
 
     def publish(self, key, value):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.publish(key, value)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return self.connection.publish(key, value)
 
     def exists(self, key):
-        try:
-            self.cluster_nodes(key)
-            return self.connection.exists(key)
-        finally:
-            self.close()
+        self.cluster_nodes(key)
+        return self.connection.exists(key)
 
     def close(self):
+        """ 关闭连接池, 只在进程退出时调用 """
         self.connection.close()
 
     def __contains__(self, key):
@@ -214,5 +197,127 @@ class RedisClient:
             self.connection.set_default_node(target)
 
 
+class AsyncRedisClient:
+    """ 基于redis.asyncio的异步客户端，接口和序列化方式与RedisClient保持一致，供异步接口使用 """
+
+    def __init__(self, url, max_connections=10):
+        mode, redis_conf = _parse_redis_conf(url)
+        if mode == 'cluster':
+            # 集群模式
+            cluster_url = ''
+            if 'startup_nodes' in redis_conf:
+                first_node = redis_conf['startup_nodes'][0]
+                cluster_url = f'redis://{first_node["host"]}:{first_node["port"]}'
+                redis_conf['startup_nodes'] = [
+                    AsyncClusterNode(node.get('host'), node.get('port'))
+                    for node in redis_conf['startup_nodes']
+                ]
+            self.connection = AsyncRedisCluster.from_url(cluster_url, **redis_conf,
+                                                         retry=AsyncRetry(ExponentialBackoff(), 6),
+                                                         cluster_error_retry_attempts=1)
+        elif mode == 'single':
+            # 单机模式
+            self.pool = aioredis.ConnectionPool.from_url(url, max_connections=max_connections)
+            self.connection = aioredis.StrictRedis(connection_pool=self.pool)
+        else:
+            # 哨兵模式, 不设置主节点的socket_timeout, 避免订阅消息时的阻塞读取超时
+            hosts = [eval(x) for x in redis_conf.pop('sentinel_hosts')]
+            password = redis_conf.pop('sentinel_password')
+            master = redis_conf.pop('sentinel_master')
+            sentinel = AsyncSentinel(sentinels=hosts, socket_timeout=0.1, sentinel_kwargs={'password': password})
+            self.connection = sentinel.master_for(master, **redis_conf)
+
+    def pipeline(self, transaction: bool = True):
+        if isinstance(self.connection, AsyncRedisCluster):
+            return self.connection.pipeline()
+        return self.connection.pipeline(transaction=transaction)
+
+    def pubsub(self) -> aioredis.client.PubSub | None:
+        """ 获取pubsub对象, 集群模式下不支持返回None，由调用方降级为轮询 """
+        if isinstance(self.connection, AsyncRedisCluster):
+            return None
+        return self.connection.pubsub(ignore_subscribe_messages=True)
+
+    async def set(self, key, value, expiration=3600):
+        try:
+            if pickled := pickle.dumps(value):
+                result = await self.connection.set(key, pickled, ex=expiration or None)
+                if not result:
+                    raise ValueError('RedisCache could not set the value.')
+            else:
+                logger.error('pickle error, value={}', value)
+        except TypeError as exc:
+            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+
+    async def setNx(self, key, value, expiration=3600):
+        try:
+            if pickled := pickle.dumps(value):
+                result = await self.connection.set(key, pickled, ex=expiration or None, nx=True)
+                return bool(result)
+        except TypeError as exc:
+            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+
+    async def get(self, key):
+        value = await self.connection.get(key)
+        return pickle.loads(value) if value else None
+
+    async def hset(self, name,
+                   key: Optional[str] = None,
+                   value: Optional[str] = None,
+                   mapping: Optional[dict] = None,
+                   items: Optional[list] = None,
+                   expiration: int = 3600):
+        if not expiration:
+            return await self.connection.hset(name, key, value, mapping, items)
+        pipe = self.pipeline()
+        pipe.hset(name, key, value, mapping, items)
+        pipe.expire(name, expiration)
+        return (await pipe.execute())[0]
+
+    async def hget(self, name, key):
+        return await self.connection.hget(name, key)
+
+    async def hgetall(self, name):
+        return await self.connection.hgetall(name)
+
+    async def hdel(self, name, *keys):
+        return await self.connection.hdel(name, *keys)
+
+    async def incr(self, key, expiration=3600) -> int:
+        if not expiration:
+            return await self.connection.incr(key)
+        pipe = self.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, expiration)
+        return (await pipe.execute())[0]
+
+    async def expire_key(self, key, expiration: int):
+        await self.connection.expire(key, expiration)
+
+    async def delete(self, key):
+        return await self.connection.delete(key)
+
+    async def rpush(self, key, value, expiration=3600):
+        if not expiration:
+            return await self.connection.rpush(key, value)
+        pipe = self.pipeline()
+        pipe.rpush(key, value)
+        pipe.expire(key, expiration)
+        return (await pipe.execute())[0]
+
+    async def lpop(self, key, count: int = None):
+        return await self.connection.lpop(key, count)
+
+    async def publish(self, key, value):
+        return await self.connection.publish(key, value)
+
+    async def exists(self, key):
+        return await self.connection.exists(key)
+
+    async def close(self):
+        await self.connection.close()
+
+
 # 示例用法
 redis_client = RedisClient(settings.redis_url)
+async_redis_client = AsyncRedisClient(settings.redis_url)
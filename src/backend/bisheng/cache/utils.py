@@ -15,6 +15,7 @@ import cchardet
 import requests
 from appdirs import user_cache_dir
 from fastapi import UploadFile
+from loguru import logger
 
 from bisheng.utils.minio_client import tmp_bucket, minio_client
 
@@ -266,6 +267,15 @@ def save_download_file(file_byte, folder_name, filename):
 def file_download(file_path: str):
     """download file and return path"""
     if not os.path.isfile(file_path) and _is_valid_url(file_path):
+        # 本系统minio的文件直接从minio流式下载，并复用本地缓存
+        minio_object = minio_client.parse_share_link(file_path)
+        if minio_object:
+            from bisheng.cache.file_cache import minio_file_cache
+            try:
+                return minio_file_cache.get_file(*minio_object)
+            except Exception as e:
+                logger.warning(f'download file from minio failed, fallback to http: {file_path} {e}')
+
         r = requests.get(file_path, verify=False)
 
         if r.status_code != 200:
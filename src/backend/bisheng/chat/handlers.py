@@ -1,4 +1,5 @@
 import ast
+import copy
 import json
 import time
 from queue import Queue
@@ -182,7 +183,7 @@ class Handler:
             llm_chain = LLMChain(llm=langchain_obj.llm,
                                  prompt=PromptTemplate.from_template(prompt))
         else:
-            keyword_conf = settings.get_default_llm() or {}
+            keyword_conf = copy.deepcopy(settings.get_default_llm() or {})
             if keyword_conf:
                 node_type = keyword_conf.pop('type', 'HostQwenChat')  # 兼容旧配置
                 class_object = import_by_type(_type='llms', name=node_type)
@@ -1,10 +1,14 @@
+import hashlib
+import json
 from typing import List, Optional, Dict
 
 import numpy as np
+from bisheng.cache.embedding_cache import embedding_cache, DEFAULT_EXPIRE_TIME
 from bisheng.database.models.llm_server import (LLMDao, LLMModel, LLMModelType, LLMServer,
                                                 LLMServerType)
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check
+from bisheng.settings import settings
 from langchain.embeddings.base import Embeddings
 from loguru import logger
 from pydantic import ConfigDict, Field, BaseModel
@@ -54,6 +58,9 @@ class BishengEmbedding(BaseModel, Embeddings):
     max_retries: int = Field(default=6, description='embedding模型调用失败重试次数')
     request_timeout: int = Field(default=200, description='embedding模型调用超时时间')
     model_kwargs: dict = Field(default={}, description='embedding模型调用参数')
+    cache_enabled: bool = Field(default=True, description='是否缓存相同文本的向量')
+    cache_expire_time: int = Field(default=DEFAULT_EXPIRE_TIME, description='缓存的向量过期时间（秒）')
+    cache_version: str = Field(default='', description='模型配置的摘要，配置修改后不再命中旧的缓存')
 
     embeddings: Optional[Embeddings] = Field(default=None)
     llm_node_type: Dict = {
@@ -105,9 +112,15 @@ class BishengEmbedding(BaseModel, Embeddings):
         self.model_info: LLMModel = model_info
         self.server_info: LLMServer = server_info
         self.model = model_info.model_name
+        embedding_conf = settings.get_knowledge().get('embedding', {})
+        self.cache_enabled = embedding_conf.get('cache_enabled', True)
+        self.cache_expire_time = embedding_conf.get('cache_expire_time') or DEFAULT_EXPIRE_TIME
 
         class_object = self._get_embedding_class(server_info.type)
         params = self._get_embedding_params(server_info, model_info)
+        # 模型地址、维度等配置修改后生成的向量可能不同，缓存的命名空间里带上配置的摘要
+        self.cache_version = hashlib.md5(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+                                         .encode('utf-8')).hexdigest()[:16]
         try:
             if server_info.type == LLMServerType.OLLAMA.value:
                 params['query_instruction'] = 'passage: '
@@ -150,8 +163,40 @@ class BishengEmbedding(BaseModel, Embeddings):
             params['openai_api_key'] = params.pop('openai_api_key', None) or 'EMPTY'
         return params
 
-    @wrapper_bisheng_model_limit_check
+    def _cache_namespace(self, embed_type: str) -> str:
+        return f'{self.model_id}:{self.model}:{self.cache_version}:{embed_type}'
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """embedding, 已经缓存过的文本不再调用embedding服务"""
+        # 空文本部分模型会直接过滤掉，无法和结果一一对应，不走缓存
+        if not self.cache_enabled or not texts or not all(texts):
+            return self._embed_documents(texts)
+        namespace = self._cache_namespace('doc')
+        ret = embedding_cache.get_many(namespace, texts)
+        # 去重后只对未命中的文本调用embedding服务
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, ret) if vector is None))
+        if missing:
+            vectors = self._embed_documents(missing)
+            embedding_cache.set_many(namespace, missing, vectors, self.cache_expire_time)
+            missing_vectors = dict(zip(missing, vectors))
+            ret = [missing_vectors[text] if vector is None else vector for text, vector in zip(texts, ret)]
+        logger.debug(f'embedding_cache model_id={self.model_id} texts={len(texts)} missing={len(missing)} '
+                     f'stats={embedding_cache.stats()}')
+        return ret
+
+    def embed_query(self, text: str) -> List[float]:
+        """embedding, 已经缓存过的文本不再调用embedding服务"""
+        if not self.cache_enabled or not text:
+            return self._embed_query(text)
+        namespace = self._cache_namespace('query')
+        ret = embedding_cache.get_many(namespace, [text])[0]
+        if ret is None:
+            ret = self._embed_query(text)
+            embedding_cache.set_many(namespace, [text], [ret], self.cache_expire_time)
+        return ret
+
+    @wrapper_bisheng_model_limit_check
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
         """embedding"""
         try:
             if self.server_info.limit_flag:
@@ -170,7 +215,7 @@ class BishengEmbedding(BaseModel, Embeddings):
             raise Exception(f'embedding error: {e}')
 
     @wrapper_bisheng_model_limit_check
-    def embed_query(self, text: str) -> List[float]:
+    def _embed_query(self, text: str) -> List[float]:
         """embedding"""
         try:
             ret = self.embeddings.embed_query(text)
@@ -1,10 +1,15 @@
+import functools
+import heapq
 from ast import literal_eval
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import jieba
-from bisheng_langchain.vectorstores.elastic_keywords_search import DEFAULT_PROMPT
-from bisheng_langchain.vectorstores.milvus import DEFAULT_MILVUS_CONNECTION
+from bisheng_langchain.vectorstores.elastic_keywords_search import DEFAULT_PROMPT, get_es_client
+from bisheng_langchain.vectorstores.milvus import (DEFAULT_MILVUS_CONNECTION, get_cached_collection,
+                                                 invalidate_collection_cache, is_collection_stale_error,
+                                                 set_cached_collection)
 from langchain.chains.llm import LLMChain
 from langchain.docstore.document import Document
 from langchain.embeddings.base import Embeddings
@@ -18,6 +23,15 @@ from loguru import logger
 if TYPE_CHECKING:
     from elasticsearch import Elasticsearch  # noqa: F401
 
+# 多个collection并发检索时的最大线程数
+MAX_SEARCH_WORKERS = 8
+
+
+@functools.lru_cache(maxsize=1024)
+def extract_keywords(query: str) -> Tuple[str, ...]:
+    """ jieba提取关键词，相同的问题会多次检索，缓存提取结果 """
+    return tuple(jieba.analyse.extract_tags(query, topK=10, withWeight=False))
+
 
 class MilvusWithPermissionCheck(MilvusLangchain):
     """
@@ -138,19 +152,33 @@ class MilvusWithPermissionCheck(MilvusLangchain):
         self.alias = self._create_connection_alias(connection_args)
         self.col: Optional[List[Collection]] = []
         self.col_partition_key: Optional[List[str]] = []
+        # 和self.col一一对应的embedding模型
+        self.col_embeddings: List[Embeddings] = []
         self.collection_embeddings = collection_embeddings
         # not used
         self.drop_old = drop_old
 
+        # 和self.col一一对应，缓存中已经加载过的collection的索引信息，未命中缓存为None
+        self.col_cached_index: List[Optional[dict]] = []
+
         # Grab the existing collection if it exists
         try:
             for index, one_collection_name in enumerate(self.collection_name):
-                if utility.has_collection(one_collection_name, using=self.alias):
+                cached = get_cached_collection(self.alias, one_collection_name)
+                if cached is not None:
+                    self.col.append(cached['col'])
+                    self.col_cached_index.append(cached['index'])
+                elif utility.has_collection(one_collection_name, using=self.alias):
                     self.col.append(Collection(
                         one_collection_name,
                         using=self.alias,
                     ))
-                    self.col_partition_key.append(kwargs.get('partition_keys')[index])
+                    self.col_cached_index.append(None)
+                else:
+                    continue
+                self.col_partition_key.append(kwargs.get('partition_keys')[index])
+                self.col_embeddings.append(collection_embeddings[index]
+                                           if collection_embeddings else embedding_function)
         except Exception as e:
             logger.error(f'milvus operating error={str(e)}')
             self.close_connection(self.alias)
@@ -164,6 +192,7 @@ class MilvusWithPermissionCheck(MilvusLangchain):
 
     def close_connection(self, using):
         from pymilvus import connections
+        invalidate_collection_cache(alias=using)
         connections.remove_connection(using)
 
     def _init(
@@ -211,6 +240,8 @@ class MilvusWithPermissionCheck(MilvusLangchain):
         if not self.col:
             return
 
+        if self.col_cached_index[col_index] is not None:
+            return self.col_cached_index[col_index]
         if isinstance(self.col[col_index], Collection):
             for x in self.col[col_index].indexes:
                 if x.field_name == self._vector_field:
@@ -220,10 +251,30 @@ class MilvusWithPermissionCheck(MilvusLangchain):
     def _load(self) -> None:
         """Load the collection if available."""
         from pymilvus import Collection
-        # 加载所有的collection
+        # 加载所有的collection, 缓存中的collection已经加载过
         for i, col in enumerate(self.col):
-            if isinstance(col, Collection) and self._get_index(col_index=i) is not None:
+            if self.col_cached_index[i] is not None:
+                continue
+            index = self._get_index(col_index=i)
+            if isinstance(col, Collection) and index is not None:
                 col.load()
+                set_cached_collection(self.alias, col.name, col, index)
+
+    def _reload_collection(self, col_index: int) -> bool:
+        """ 缓存的collection被其他进程删除或者重建后，清理缓存重新获取一次，collection已经不存在时返回False """
+        from pymilvus import Collection, utility
+        collection_name = self.col[col_index].name
+        invalidate_collection_cache(collection_name, self.alias)
+        if not utility.has_collection(collection_name, using=self.alias):
+            return False
+        col = Collection(collection_name, using=self.alias)
+        self.col[col_index] = col
+        self.col_cached_index[col_index] = None
+        index = self._get_index(col_index=col_index)
+        if index is not None:
+            col.load()
+            set_cached_collection(self.alias, collection_name, col, index)
+        return True
 
     @classmethod
     def from_texts(
@@ -413,39 +464,65 @@ class MilvusWithPermissionCheck(MilvusLangchain):
 
         finally_k = kwargs.pop('k', k)
 
-        ret = []
+        # 相同embedding模型的collection共用一个查询向量
+        model_indexes: Dict[Any, List[int]] = {}
+        for index, one_embedding in enumerate(self.col_embeddings):
+            model_key = getattr(one_embedding, 'model_id', None) or id(one_embedding)
+            model_indexes.setdefault(model_key, []).append(index)
 
-        for index, one_col in enumerate(self.col):
+        def search_one(index: int, query_embedding: List[float]) -> List[Tuple[Document, float]]:
             search_expr = expr
-            embedding = self.collection_embeddings[index].embed_query(query)
             if self.col_partition_key[index]:
                 # add parttion
                 if expr:
                     search_expr = f"{expr} and {self._partition_field}==\"{self.col_partition_key[index]}\""
                 else:
                     search_expr = f"{self._partition_field}==\"{self.col_partition_key[index]}\""
+
+            def do_search():
+                return self.col[index].search(
+                    data=[query_embedding],
+                    anns_field=self._vector_field,
+                    param=param,
+                    limit=k,
+                    expr=search_expr,
+                    output_fields=output_fields,
+                    timeout=timeout,
+                    **kwargs,
+                )
+
             # Perform the search.
-            res = one_col.search(
-                data=[embedding],
-                anns_field=self._vector_field,
-                param=param,
-                limit=k,
-                expr=search_expr,
-                output_fields=output_fields,
-                timeout=timeout,
-                **kwargs,
-            )
+            try:
+                res = do_search()
+            except Exception as e:
+                if not is_collection_stale_error(e):
+                    raise
+                logger.warning(f'milvus collection {self.col[index].name} is stale, reload it: {e}')
+                if not self._reload_collection(index):
+                    return []
+                res = do_search()
             # Organize results.
+            col_ret = []
             for result in res[0]:
                 meta = {x: result.entity.get(x) for x in output_fields}
                 doc = Document(page_content=meta.pop(self._text_field), metadata=meta)
-                pair = (doc, result.score)
-                ret.append(pair)
-            logger.debug(f'MilvusWithPermissionCheck Search {one_col.name} query: {query} results: {res[0]}')
-        ret.sort(key=lambda x: x[1])
+                col_ret.append((doc, result.score))
+            logger.debug(f'MilvusWithPermissionCheck Search {self.col[index].name} query: {query} results: {res[0]}')
+            return col_ret
+
+        def search_model(indexes: List[int]) -> List:
+            query_embedding = self.col_embeddings[indexes[0]].embed_query(query)
+            return [executor.submit(search_one, index, query_embedding) for index in indexes]
+
+        # 不同模型的embedding和所有collection的检索并发执行，耗时取决于最慢的collection
+        with ThreadPoolExecutor(max_workers=min(MAX_SEARCH_WORKERS, len(self.col))) as executor:
+            model_futures = [executor.submit(search_model, indexes) for indexes in model_indexes.values()]
+            search_futures = [one for future in model_futures for one in future.result()]
+            ret = [pair for future in search_futures for pair in future.result()]
+
         logger.debug(f'MilvusWithPermissionCheck Search all results: {len(ret)}')
         # milvus是分数越小越好，所以直接取前几位就行
-        ret = ret[:finally_k]
+        ret = heapq.nsmallest(finally_k, ret, key=lambda x: x[1])
         logger.debug(f'MilvusWithPermissionCheck Search finally results: {len(ret)}')
         return ret
 
@@ -485,10 +562,9 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
         _ssl_verify = ssl_verify or {}
         self.elasticsearch_url = elasticsearch_url
         self.ssl_verify = _ssl_verify
-        try:
-            self.client = elasticsearch.Elasticsearch(elasticsearch_url, **_ssl_verify)
-        except ValueError as e:
-            raise ValueError(f'Your elasticsearch client string is mis-formatted. Got error: {e} ')
+        # es的大版本号，第一次检索时获取
+        self._version_num = None
+        self.client = get_es_client(elasticsearch_url, _ssl_verify)
 
     def similarity_search(self,
                           query: str,
@@ -535,9 +611,9 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
                 if not isinstance(keywords, list):
                     raise ValueError('Keywords extracted by llm is not list.')
             except Exception:
-                keywords = jieba.analyse.extract_tags(query, topK=10, withWeight=False)
+                keywords = list(extract_keywords(query))
         else:
-            keywords = jieba.analyse.extract_tags(query, topK=10, withWeight=False)
+            keywords = list(extract_keywords(query))
         keywords = keywords or [query]
         logger.debug(f'finally search keywords: {keywords}')
         match_query = {'bool': {must_or_should: []}}
@@ -545,18 +621,25 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
             match_query['bool'][must_or_should].append({query_strategy: {'text': key}})
 
         ret = []
-        for one_index_name in self.index_name:
-            response = self.client_search(self.client, one_index_name, match_query, size=k)
+        if not self.index_name:
+            return ret
+        # 所有索引的检索在一次请求中完成
+        responses = self.client_msearch(self.client, self.index_name, match_query, size=k)
+        for one_index_name, response in zip(self.index_name, responses):
+            if 'error' in response:
+                logger.warning(f'ElasticsearchWithPermissionCheck Search {one_index_name} error: {response["error"]}')
+                continue
             hits = [hit for hit in response['hits']['hits']]
+            # 不同索引的BM25分数不可比较，按索引内的最高分归一化到(0, 1]后再合并
+            max_score = max((hit['_score'] for hit in hits), default=0) or 1
             for hit in hits:
                 ret.append((Document(page_content=hit['_source']['text'],
-                                     metadata=hit['_source']['metadata']), hit['_score']))
+                                     metadata=hit['_source']['metadata']), hit['_score'] / max_score))
             logger.debug(
                 f'ElasticsearchWithPermissionCheck Search {one_index_name} results: {hits}')
         logger.debug(f'ElasticsearchWithPermissionCheck Search all results: {len(ret)}')
         finally_k = kwargs.pop('finally_k', k)
-        ret.sort(key=lambda x: x[1], reverse=True)
-        ret = ret[:finally_k]
+        ret = heapq.nlargest(finally_k, ret, key=lambda x: x[1])
         logger.debug(f'ElasticsearchWithPermissionCheck Search finally results: {len(ret)}')
         return ret
 
@@ -620,9 +703,25 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
 
         return vectorsearch
 
+    def get_version_num(self, client: Any) -> int:
+        if self._version_num is None:
+            self._version_num = int(client.info()['version']['number'].split('.')[0])
+        return self._version_num
+
+    def client_msearch(self, client: Any, index_names: List[str], script_query: Dict, size: int) -> List[Dict]:
+        """ 多个索引的检索合并为一次msearch请求，返回和index_names一一对应的结果 """
+        searches = []
+        for one_index_name in index_names:
+            searches.append({'index': one_index_name})
+            searches.append({'query': script_query, 'size': size})
+        if self.get_version_num(client) >= 8:
+            response = client.msearch(searches=searches)
+        else:
+            response = client.msearch(body=searches)
+        return response['responses']
+
     def client_search(self, client: Any, index_name: str, script_query: Dict, size: int) -> Any:
-        version_num = client.info()['version']['number'][0]
-        version_num = int(version_num)
+        version_num = self.get_version_num(client)
         if version_num >= 8:
             response = client.search(index=index_name, query=script_query, size=size)
         else:
@@ -1,3 +1,5 @@
+import copy
+
 from bisheng.database.models.knowledge import KnowledgeDao
 from bisheng.database.models.llm_server import LLMServer, LLMServerType, LLMModelType, LLMModel, LLMDao
 from bisheng.settings import settings
@@ -68,7 +70,7 @@ def parse_rt_embedding_conf(name, model_name, embedding_conf):
 
 # 将系统配置里的embedding配置项，转为模型管理里的服务提供方, 升级034执行此脚本
 def convert_sys_embeddings_to_mysql():
-    knowledge_conf = settings.get_knowledge()
+    knowledge_conf = copy.deepcopy(settings.get_knowledge())
     embeddings = knowledge_conf.get('embeddings', {})
     if not embeddings:
         print('no found embeddings')
@@ -1,6 +1,8 @@
 import json
 import os
 import re
+import threading
+import time
 from typing import Dict, List, Optional, Union
 
 import yaml
@@ -93,6 +95,8 @@ class ObjectStore(BaseModel):
 class WorkflowConf(BaseModel):
     max_steps: int = Field(default=50, description="节点运行最大步数")
     timeout: int = Field(default=720, description="节点超时时间（min）")
+    max_concurrency: int = Field(default=8, description="同一批次可以并行执行的节点数")
+    history_max_token: Optional[int] = Field(default=32000, description="LLM和助手节点使用的聊天历史最大token数")
 
 
 class CeleryConf(BaseModel):
@@ -263,21 +267,25 @@ class Settings(BaseModel):
         return all_config.get(key, {})
 
     def get_all_config(self):
+        """ 返回进程内共享的配置，调用方不能修改，需要修改时自行deepcopy """
+        return initdb_config_cache.get()
+
+    def load_all_config(self):
+        """ 从redis或者数据库加载系统配置，返回原始的yaml字符串 """
         from bisheng.database.base import session_getter
         from bisheng.cache.redis import redis_client
         from bisheng.database.models.config import Config
 
-        redis_key = 'config:initdb_config'
-        cache = redis_client.get(redis_key)
+        cache = redis_client.get(INITDB_CONFIG_KEY)
         if cache:
-            return yaml.safe_load(cache)
+            return cache
         else:
             with session_getter() as session:
                 initdb_config = session.exec(
                     select(Config).where(Config.key == 'initdb_config')).first()
                 if initdb_config:
-                    redis_client.set(redis_key, initdb_config.value, 100)
-                    return yaml.safe_load(initdb_config.value)
+                    redis_client.set(INITDB_CONFIG_KEY, initdb_config.value, 100)
+                    return initdb_config.value
                 else:
                     raise Exception('initdb_config not found, please check your system config')
 
@@ -318,6 +326,102 @@ class Settings(BaseModel):
                 setattr(self, key, value)
 
 
+INITDB_CONFIG_KEY = 'config:initdb_config'
+# 系统配置的版本号，每次保存配置时更新
+INITDB_CONFIG_VERSION_KEY = 'config:initdb_config:version'
+# 系统配置变更的通知频道
+INITDB_CONFIG_NOTIFY_KEY = 'config:initdb_config:notify'
+
+
+class InitDBConfigCache:
+    """ 进程内的系统配置缓存
+    缓存解析后的配置和对应的版本号，保存配置时通过redis的pubsub通知各个进程清空缓存。
+    订阅正常时只依赖通知，订阅断开期间每隔check_interval对比一次redis中的版本号，保证配置最终一致
+    """
+
+    def __init__(self, check_interval: int = 60):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._config: dict | None = None
+        self._version = None
+        self._check_time = 0
+        # 订阅线程是否正常订阅了配置变更的通知
+        self._subscribed = False
+        # 订阅线程所属的进程id，fork出的子进程需要重新启动订阅线程
+        self._listener_pid = None
+
+    @staticmethod
+    def get_version():
+        from bisheng.cache.redis import redis_client
+        return redis_client.get(INITDB_CONFIG_VERSION_KEY)
+
+    def _is_fresh(self) -> bool:
+        return self._subscribed or time.time() - self._check_time < self.check_interval
+
+    def get(self) -> dict:
+        self._ensure_listener()
+        config = self._config
+        if config is not None and self._is_fresh():
+            return config
+        with self._lock:
+            if self._config is not None and self._is_fresh():
+                return self._config
+            version = self.get_version()
+            if self._config is None or version != self._version:
+                self._config = yaml.safe_load(settings.load_all_config())
+                self._version = version
+            self._check_time = time.time()
+            return self._config
+
+    def clear(self):
+        with self._lock:
+            self._config = None
+            self._version = None
+
+    def notify_update(self):
+        """ 配置保存后调用，更新版本号并通知所有进程 """
+        from bisheng.cache.redis import redis_client
+        redis_client.delete(INITDB_CONFIG_KEY)
+        redis_client.set(INITDB_CONFIG_VERSION_KEY, time.time(), expiration=None)
+        redis_client.publish(INITDB_CONFIG_NOTIFY_KEY, 1)
+        self.clear()
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            # fork之前的缓存无法收到通知，需要重新加载
+            self._config = None
+            self._subscribed = False
+            threading.Thread(target=self._listen, name='initdb-config-listener', daemon=True).start()
+
+    def _listen(self):
+        from bisheng.cache.redis import redis_client
+        while True:
+            try:
+                pubsub = redis_client.connection.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INITDB_CONFIG_NOTIFY_KEY)
+                # 订阅之前可能错过了通知，重新加载一次后只依赖通知
+                self.clear()
+                self._subscribed = True
+                while True:
+                    if pubsub.get_message(timeout=5):
+                        logger.debug('initdb config changed, clear config cache')
+                        self.clear()
+            except Exception as e:
+                logger.warning(f'initdb config listener error: {e}')
+                # 订阅断开期间可能错过了通知，恢复订阅之前按check_interval对比版本号
+                self._subscribed = False
+                self.clear()
+                time.sleep(5)
+
+
+initdb_config_cache = InitDBConfigCache()
+
+
 def env_var_constructor(loader, node):
     value = loader.construct_scalar(node)  # PyYAML loader的固定方法，用于根据当前节点构造一个变量值
     var_name = value.strip('${} ')  # 去除变量值（例如${PATH}）前后的特殊字符及空格
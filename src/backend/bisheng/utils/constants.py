@@ -52,6 +52,8 @@ RSA_KEY = 'rsa_'
 USER_PASSWORD_ERROR = 'user_password_error:{}'
 # 存储当前用户登录的cookie, key为用户id
 USER_CURRENT_SESSION = 'user_current_session:{}'
+# 知识库权限的版本号，角色和权限变化时更新，缓存的知识库检索器随之失效
+KNOWLEDGE_AUTH_VERSION = 'knowledge_auth_version'
 
 LOADERS_INFO: List[Dict[str, Any]] = [
     {
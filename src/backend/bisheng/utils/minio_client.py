@@ -1,6 +1,10 @@
 import io
 import json
-from typing import BinaryIO
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
 
 import minio
 from bisheng.settings import settings
@@ -14,6 +18,21 @@ _MinioConf = settings.get_minio_conf()
 bucket = _MinioConf.public_bucket
 tmp_bucket = _MinioConf.tmp_bucket
 
+# 并发上传文件的线程数，不超过minio客户端连接池的大小(10)，避免连接被丢弃重建
+UPLOAD_MAX_WORKERS = 8
+_upload_executor: Optional[ThreadPoolExecutor] = None
+_upload_executor_lock = threading.Lock()
+
+
+def get_upload_executor() -> ThreadPoolExecutor:
+    """ 进程内共享的上传线程池，同时处理多个文件时总的上传并发数也是有上限的 """
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS,
+                                                  thread_name_prefix='minio_upload')
+        return _upload_executor
+
 
 class MinioClient:
     minio_share: minio.Minio
@@ -104,6 +123,27 @@ class MinioClient:
                                              file_path=file_path,
                                              content_type=content_type)
 
+    def upload_local_file(self, object_name: str, file_path: str, bucket_name=bucket):
+        """ 从磁盘流式读取文件内容上传，超过分片大小的文件自动分片上传 """
+        content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        return self.minio_client.fput_object(bucket_name=bucket_name,
+                                             object_name=object_name,
+                                             file_path=file_path,
+                                             content_type=content_type)
+
+    def upload_local_files(self, files: List[Tuple[str, str]], bucket_name=bucket):
+        """
+        批量并发上传本地文件，等待全部上传完成
+        files: [(object_name, file_path), ...]
+        """
+        if not files:
+            return
+        executor = get_upload_executor()
+        futures = [executor.submit(self.upload_local_file, object_name, file_path, bucket_name)
+                   for object_name, file_path in files]
+        for future in futures:
+            future.result()
+
     def upload_minio_file_io(self, object_name: str, file: BinaryIO, bucket_name=bucket, **kwargs):
         # 初始化minio
         logger.debug('upload_file obj={} bucket={}', object_name, bucket)
@@ -129,7 +169,7 @@ class MinioClient:
         return f'{share_host}/{bucket}/{object_name}'
 
     def upload_tmp(self, object_name, data):
-        self.minio_client.put_object(bucket_name=tmp_bucket,
+        return self.minio_client.put_object(bucket_name=tmp_bucket,
                                      object_name=object_name,
                                      data=io.BytesIO(data),
                                      length=len(data))
@@ -201,6 +241,33 @@ class MinioClient:
                 response.close()
                 response.release_conn()
 
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        return self.minio_client.stat_object(bucket_name, object_name, **kwargs)
+
+    def iter_object(self, bucket_name, object_name, chunk_size: int = 1024 * 1024, **kwargs) -> Iterator[bytes]:
+        """ 分块读取对象的内容，不把整个文件读到内存中 """
+        response = None
+        try:
+            response = self.minio_client.get_object(bucket_name, object_name, **kwargs)
+            yield from response.stream(chunk_size)
+        finally:
+            if response:
+                response.close()
+                response.release_conn()
+
+    def parse_share_link(self, file_url: str) -> Optional[Tuple[str, str]]:
+        """
+        解析 get_share_link 生成的地址
+        return: (bucket, object_name)，不是本系统minio的地址时返回None
+        """
+        share_host = self.get_minio_share_host()
+        if not file_url.startswith(f'{share_host}/'):
+            return None
+        bucket_name, _, object_name = unquote(urlparse(file_url).path).lstrip('/').partition('/')
+        if bucket_name not in (self.bucket, self.tmp_bucket) or not object_name:
+            return None
+        return bucket_name, object_name
+
     def copy_object(
             self,
             source_object_name,
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import threading
+from typing import Any, List, Optional
+
+from cachetools import LRUCache
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+# 消息内容对应的token数，聊天历史每轮都从头构造，按内容缓存后，每条消息只需要编码一次
+_token_count_cache = LRUCache(maxsize=20000)
+_token_count_lock = threading.Lock()
+
+
+def _get_encoding():
+    from bisheng.api.services.assistant_base import AssistantUtils
+    return AssistantUtils.cl100k_base()
+
+
+def _message_parts(message: Any) -> List[str]:
+    """ 参与token计算的消息内容，和助手原有的计算方式保持一致，内容和工具调用分别编码 """
+    if isinstance(message, (HumanMessage, AIMessage)):
+        parts = [message.content if isinstance(message.content, str) else str(message.content)]
+        if isinstance(message, AIMessage) and 'tool_calls' in message.additional_kwargs:
+            parts.append(json.dumps(message.additional_kwargs['tool_calls'], ensure_ascii=False))
+        return parts
+    return [str(message.content)]
+
+
+def count_message_tokens(message: BaseMessage, enc=None) -> int:
+    """ 计算单条消息的token数，相同内容的消息只编码一次 """
+    parts = _message_parts(message)
+    digest = hashlib.md5(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+    key = (message.type, digest)
+    with _token_count_lock:
+        count = _token_count_cache.get(key)
+    if count is not None:
+        return count
+    enc = enc or _get_encoding()
+    count = sum(len(enc.encode(one, disallowed_special=())) for one in parts)
+    with _token_count_lock:
+        _token_count_cache[key] = count
+    return count
+
+
+def trim_messages_by_token(messages: List[BaseMessage], max_token: Optional[int], enc=None) -> List[BaseMessage]:
+    """
+    从最早的消息开始丢弃，直到剩余消息的token总数不超过max_token，至少保留最后一条消息
+    从后往前累加每条消息的token数，找到满足条件的最长后缀，只需遍历一遍
+    """
+    if max_token is None or len(messages) <= 1:
+        return messages
+    total = 0
+    start = len(messages)
+    while start > 0:
+        count = count_message_tokens(messages[start - 1], enc)
+        if total + count > max_token:
+            break
+        total += count
+        start -= 1
+    return messages[min(start, len(messages) - 1):]
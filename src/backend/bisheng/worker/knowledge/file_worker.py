@@ -207,7 +207,10 @@ def copy_vector(
         target_knowledge.collection_name, "Milvus", embedding
     )
     if milvus_db:
-        insert_milvus(source_data, fields, milvus_db)
+        pks = insert_milvus(source_data, fields, milvus_db)
+        # es中的分块记录milvus的主键，作为分块列表翻页时唯一的排序字段
+        for data, pk in zip(source_data, pks):
+            data["pk"] = pk
 
     es_db = decide_vectorstores(
         target_knowledge.index_name, "ElasticKeywordsSearch", embedding
@@ -236,6 +239,7 @@ def insert_milvus(li: List, fields: list, target: Milvus):
             )
             raise e
     logger.info("copy_done pk_size={}", len(res_list))
+    return res_list
 
 
 def insert_es(li: List, target: ElasticKeywordsSearch):
@@ -1,9 +1,11 @@
 import asyncio
 import json
 import os
+import pickle
 import time
 import uuid
-from typing import AsyncIterator
+import zlib
+from typing import AsyncIterator, Dict, List, Set
 
 from cachetools import TTLCache
 from langchain_core.documents import Document
@@ -13,7 +15,7 @@ from bisheng.api.errcode.flow import WorkFlowNodeRunMaxTimesError, WorkFlowWaitU
     WorkFlowNodeUpdateError, WorkFlowVersionUpdateError, WorkFlowTaskBusyError
 from bisheng.api.v1.schema.workflow import WorkflowEventType
 from bisheng.api.v1.schemas import ChatResponse
-from bisheng.cache.redis import redis_client
+from bisheng.cache.redis import redis_client, async_redis_client
 from bisheng.chat.utils import sync_judge_source, sync_process_source_document
 from bisheng.database.models.flow import FlowDao, FlowType
 from bisheng.database.models.message import ChatMessageDao, ChatMessage
@@ -24,6 +26,147 @@ from bisheng.workflow.callback.event import NodeStartData, NodeEndData, UserInpu
     OutputMsgData, StreamMsgData, StreamMsgOverData, OutputMsgChooseData, OutputMsgInputData
 from bisheng.workflow.common.workflow import WorkflowStatus
 
+# 每次从事件列表中批量获取的事件数
+EVENT_BATCH_SIZE = 100
+# 等待事件通知的最长时间，超时后会重新检查workflow的状态
+EVENT_WAIT_TIMEOUT = 1
+
+# 订阅连接失败后重新订阅的间隔（秒）
+SUBSCRIBE_RETRY_INTERVAL = 5
+# 订阅连接每次读取通知的最长等待时间（秒）
+LISTEN_TIMEOUT = 1
+
+
+class WorkflowEventSubscriber:
+    """
+    进程内共享的workflow事件订阅，所有流式连接共用一个pubsub连接，按channel唤醒等待中的消费方
+    避免每个流式连接各占用一个redis连接，导致并发的流式连接数受连接池大小的限制
+    只订阅当前进程内有等待方的channel，第一个等待方加入时订阅，最后一个等待方离开时取消订阅
+    """
+
+    def __init__(self):
+        # {channel: 等待该channel通知的事件}
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+        self._pubsub = None
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock: asyncio.Lock | None = None
+        self._retry_time = 0
+
+    def _listening(self, loop: asyncio.AbstractEventLoop) -> bool:
+        return self._task is not None and not self._task.done() and self._loop is loop
+
+    def _get_lock(self, loop: asyncio.AbstractEventLoop) -> asyncio.Lock:
+        if self._lock is None or self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _start(self, loop: asyncio.AbstractEventLoop, channels: List[str]) -> bool:
+        """ 建立订阅连接并订阅channels，需要持有锁，集群模式或者订阅失败时返回False """
+        if time.time() < self._retry_time:
+            return False
+        pubsub = async_redis_client.pubsub()
+        if pubsub is None:
+            return False
+        try:
+            await pubsub.subscribe(*channels)
+        except Exception as e:
+            logger.warning(f'subscribe workflow event failed, fallback to polling: {e}')
+            self._retry_time = time.time() + SUBSCRIBE_RETRY_INTERVAL
+            try:
+                await pubsub.reset()
+            except Exception:
+                pass
+            return False
+        self._pubsub = pubsub
+        self._task = loop.create_task(self._listen(pubsub))
+        return True
+
+    async def ensure_listener(self) -> bool:
+        """ 订阅连接断开后重新连接，并重新订阅所有还有等待方的channel """
+        loop = asyncio.get_running_loop()
+        if self._listening(loop):
+            return True
+        if not self._waiters:
+            return False
+        async with self._get_lock(loop):
+            if self._listening(loop):
+                return True
+            return await self._start(loop, list(self._waiters.keys()))
+
+    async def subscribe(self, channel: str) -> asyncio.Event | None:
+        """ 等待channel的通知，返回通知到达时被设置的事件，不支持订阅时返回None """
+        loop = asyncio.get_running_loop()
+        async with self._get_lock(loop):
+            if not self._listening(loop):
+                channels = [channel] + [one for one in self._waiters.keys() if one != channel]
+                if not await self._start(loop, channels):
+                    return None
+            elif channel not in self._waiters:
+                try:
+                    await self._pubsub.subscribe(channel)
+                except Exception as e:
+                    logger.warning(f'subscribe workflow event failed, fallback to polling: {e}')
+                    return None
+            event = asyncio.Event()
+            self._waiters.setdefault(channel, set()).add(event)
+            return event
+
+    async def unsubscribe(self, channel: str, event: asyncio.Event):
+        waiters = self._waiters.get(channel)
+        if not waiters:
+            return
+        waiters.discard(event)
+        if waiters:
+            return
+        self._waiters.pop(channel, None)
+        loop = asyncio.get_running_loop()
+        async with self._get_lock(loop):
+            # 等待锁的期间可能又有新的等待方订阅了此channel
+            if channel in self._waiters or not self._listening(loop):
+                return
+            try:
+                await self._pubsub.unsubscribe(channel)
+            except Exception as e:
+                logger.warning(f'unsubscribe workflow event failed: {e}')
+
+    def _notify(self, channel: str):
+        for event in self._waiters.get(channel, ()):
+            event.set()
+
+    async def _listen(self, pubsub):
+        try:
+            while True:
+                if not pubsub.subscribed:
+                    # 没有订阅任何channel时不会收到消息，等待新的订阅
+                    await asyncio.sleep(LISTEN_TIMEOUT)
+                    continue
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=LISTEN_TIMEOUT)
+                if not message or message.get('type') != 'message':
+                    continue
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode('utf-8')
+                self._notify(channel)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f'workflow event subscriber disconnected: {e}')
+            self._retry_time = time.time() + SUBSCRIBE_RETRY_INTERVAL
+        finally:
+            if self._pubsub is pubsub:
+                self._pubsub = None
+            # 唤醒所有等待方重新检查事件，之后靠超时轮询，直到重新订阅成功
+            for channel in list(self._waiters.keys()):
+                self._notify(channel)
+            try:
+                await pubsub.reset()
+            except Exception:
+                pass
+
+
+workflow_event_subscriber = WorkflowEventSubscriber()
 
 
 class RedisCallback(BaseCallback):
@@ -47,6 +190,10 @@ class RedisCallback(BaseCallback):
         self.workflow_event_key = f'workflow:{unique_id}:event'
         self.workflow_input_key = f'workflow:{unique_id}:input'
         self.workflow_stop_key = f'workflow:{unique_id}:stop'
+        # 等待用户输入时的运行快照，任意worker都可以通过快照继续运行
+        self.workflow_checkpoint_key = f'workflow:{unique_id}:checkpoint'
+        # 有新的事件或者状态变化时发布通知, 事件内容仍然存在event列表中，保证断线重连后可以继续消费
+        self.workflow_notify_key = f'workflow:{unique_id}:notify'
         self.workflow_expire_time = settings.get_workflow_conf().timeout * 60 + 60
 
     def set_workflow_data(self, data: dict):
@@ -60,10 +207,26 @@ class RedisCallback(BaseCallback):
                               {'status': status, 'reason': reason, 'time': time.time()},
                               expiration=None)
         self.workflow_cache.clear()
+        self.notify_workflow_event()
         if status in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
             # 消息事件和状态key可能还需要消费
             self.redis_client.delete(self.workflow_data_key)
             self.redis_client.delete(self.workflow_input_key)
+            self.redis_client.delete(self.workflow_checkpoint_key)
+
+    def save_workflow_checkpoint(self, workflow):
+        """ 保存workflow的运行快照，压缩后存储到redis """
+        checkpoint = zlib.compress(pickle.dumps(workflow.dump_checkpoint()))
+        self.redis_client.set(self.workflow_checkpoint_key, checkpoint, expiration=self.workflow_expire_time)
+
+    def get_workflow_checkpoint(self) -> dict | None:
+        checkpoint = self.redis_client.get(self.workflow_checkpoint_key)
+        if not checkpoint:
+            return None
+        return pickle.loads(zlib.decompress(checkpoint))
+
+    def exists_workflow_checkpoint(self) -> bool:
+        return bool(self.redis_client.exists(self.workflow_checkpoint_key))
 
     def get_workflow_status(self, user_cache: bool = True) -> dict | None:
         # if user_cache and self.workflow_cache.get(self.workflow_status_key):
@@ -77,20 +240,60 @@ class RedisCallback(BaseCallback):
         self.redis_client.delete(self.workflow_stop_key)
         self.redis_client.delete(self.workflow_data_key)
 
+    def notify_workflow_event(self):
+        """ 通知消费方有新的事件或者状态变化 """
+        self.redis_client.publish(self.workflow_notify_key, 1)
+
     def insert_workflow_response(self, event: dict):
-        self.redis_client.rpush(self.workflow_event_key, json.dumps(event), expiration=self.workflow_expire_time)
+        # 写入事件、设置过期和发布通知在一次网络往返中完成
+        pipe = self.redis_client.pipeline()
+        pipe.rpush(self.workflow_event_key, json.dumps(event))
+        pipe.expire(self.workflow_event_key, self.workflow_expire_time)
+        pipe.publish(self.workflow_notify_key, 1)
+        pipe.execute()
 
     def get_workflow_response(self) -> ChatResponse | None:
-        response = self.redis_client.lpop(self.workflow_event_key)
-        if response:
-            response = ChatResponse(**json.loads(response))
+        responses = self.get_workflow_responses(count=1)
+        return responses[0] if responses else None
+
+    def get_workflow_responses(self, count: int = EVENT_BATCH_SIZE) -> list[ChatResponse]:
+        """ 批量获取workflow的事件 """
+        responses = self.redis_client.lpop(self.workflow_event_key, count)
+        if not responses:
+            return []
+        result = []
+        for one in responses:
+            response = ChatResponse(**json.loads(one))
             if ((response.category == WorkflowEventType.NodeRun.value and response.type == 'end'
                  and response.message and response.message.get('node_id', '').startswith('end_')) or
                     (response.category in [WorkflowEventType.UserInput.value, WorkflowEventType.OutputWithChoose.value
                         , WorkflowEventType.OutputWithInput.value])):
                 # 如果是结束节点或者输入事件，清空状态缓存
                 self.workflow_cache.clear()
-        return response
+            result.append(response)
+        return result
+
+    async def subscribe_workflow_event(self) -> asyncio.Event | None:
+        """ 订阅workflow的事件通知，不支持订阅时返回None """
+        return await workflow_event_subscriber.subscribe(self.workflow_notify_key)
+
+    async def unsubscribe_workflow_event(self, event: asyncio.Event | None):
+        if event is not None:
+            await workflow_event_subscriber.unsubscribe(self.workflow_notify_key, event)
+
+    @staticmethod
+    async def wait_workflow_event(event: asyncio.Event | None, timeout: float = EVENT_WAIT_TIMEOUT):
+        """ 等待新的事件通知，收到通知或者超时后返回 """
+        if event is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            # 订阅连接断开后在这里尝试恢复，恢复前靠超时重新检查事件
+            await workflow_event_subscriber.ensure_listener()
+        # 唤醒后会处理所有积压的事件，之后到达的通知会重新设置事件
+        event.clear()
 
     def build_chat_response(self, category, category_type, message, extra=None, files=None):
         return ChatResponse(
@@ -128,6 +331,15 @@ class RedisCallback(BaseCallback):
 
     async def get_response_until_break(self) -> AsyncIterator[ChatResponse]:
         """ 不断获取workflow的response，直到遇到运行结束或者待输入 """
+        # 先订阅再检查状态和事件，保证订阅之后产生的通知不会丢失
+        event = await self.subscribe_workflow_event()
+        try:
+            async for chat_response in self._get_response_until_break(event):
+                yield chat_response
+        finally:
+            await self.unsubscribe_workflow_event(event)
+
+    async def _get_response_until_break(self, event: asyncio.Event | None) -> AsyncIterator[ChatResponse]:
         while True:
             # get workflow status
             status_info = self.get_workflow_status()
@@ -137,10 +349,11 @@ class RedisCallback(BaseCallback):
                 break
             elif status_info['status'] in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
                 while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
+                    chat_responses = self.get_workflow_responses()
+                    if not chat_responses:
                         break
-                    yield chat_response
+                    for chat_response in chat_responses:
+                        yield chat_response
                 if status_info['status'] == WorkflowStatus.FAILED.value:
                     error_resp = self.parse_workflow_failed(status_info)
                     if error_resp:
@@ -148,10 +361,11 @@ class RedisCallback(BaseCallback):
                 break
             elif status_info['status'] == WorkflowStatus.INPUT.value:
                 while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
+                    chat_responses = self.get_workflow_responses()
+                    if not chat_responses:
                         break
-                    yield chat_response
+                    for chat_response in chat_responses:
+                        yield chat_response
                 break
             elif status_info['status'] in [WorkflowStatus.WAITING.value,
                                            WorkflowStatus.INPUT_OVER.value] and time.time() - status_info['time'] > 10:
@@ -168,11 +382,13 @@ class RedisCallback(BaseCallback):
                 self.set_workflow_stop()
                 break
             else:
-                chat_response = self.get_workflow_response()
-                if not chat_response:
-                    await asyncio.sleep(1)
+                chat_responses = self.get_workflow_responses()
+                if not chat_responses:
+                    # 没有事件时等待worker的通知，而不是固定的sleep轮询
+                    await self.wait_workflow_event(event)
                     continue
-                yield chat_response
+                for chat_response in chat_responses:
+                    yield chat_response
 
     def set_user_input(self, data: dict, message_id: int = None, message_content: str = None):
         if self.chat_id and message_id:
@@ -0,0 +1,160 @@
+from typing import Dict, List, Set, Tuple
+
+# 虚拟的根节点，连接所有的互斥节点，用来判断不同互斥节点出发的分支
+_VIRTUAL_ROOT = '__virtual_root__'
+
+
+def dfs_order(start: str, successors: Dict[str, List[str]]) -> Tuple[List[str], Set[Tuple[str, str]]]:
+    """ 从start开始深度优先遍历
+    return: 0: 可达节点的逆后序(reverse postorder)，1: 回边集合 (source, target)，回边的target是source在遍历树上的祖先
+    """
+    postorder = []
+    back_edges = set()
+    visited = {start}
+    on_path = {start}
+    work = [(start, iter(successors.get(start, [])))]
+    while work:
+        node, children = work[-1]
+        pushed = False
+        for child in children:
+            if child in on_path:
+                back_edges.add((node, child))
+            elif child not in visited:
+                visited.add(child)
+                on_path.add(child)
+                work.append((child, iter(successors.get(child, []))))
+                pushed = True
+                break
+        if pushed:
+            continue
+        work.pop()
+        on_path.remove(node)
+        postorder.append(node)
+    postorder.reverse()
+    return postorder, back_edges
+
+
+def immediate_dominators(root: str, successors: Dict[str, List[str]]) -> Dict[str, str]:
+    """ Cooper-Harvey-Kennedy 迭代算法计算支配树，返回 node: 直接支配节点，根节点的直接支配节点为自身 """
+    order, _ = dfs_order(root, successors)
+    order_index = {node: i for i, node in enumerate(order)}
+    predecessors = {node: [] for node in order}
+    for node in order:
+        for child in successors.get(node, []):
+            predecessors[child].append(node)
+
+    idom = {root: root}
+
+    def intersect(one: str, two: str) -> str:
+        while one != two:
+            while order_index[one] > order_index[two]:
+                one = idom[one]
+            while order_index[two] > order_index[one]:
+                two = idom[two]
+        return one
+
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            new_idom = None
+            for pred in predecessors[node]:
+                if pred not in idom:
+                    continue
+                new_idom = pred if new_idom is None else intersect(pred, new_idom)
+            if idom.get(node) != new_idom:
+                idom[node] = new_idom
+                changed = True
+    return idom
+
+
+def _dominates(idom: Dict[str, str], dominator: str, node: str) -> bool:
+    while True:
+        if node == dominator:
+            return True
+        parent = idom[node]
+        if parent == node:
+            return False
+        node = parent
+
+
+class GraphAnalysis:
+    """
+    工作流图的结构分析，复杂度与节点数和边数成线性关系(支配树按互斥节点各计算一次)
+    1. 深度优先遍历得到回边，判断多扇入节点的前驱中是否有下游节点
+    2. 基于支配树判断多扇入节点是否为互斥分支的汇合点
+    互斥汇合点只关心从互斥节点出发的两条不相交路径，以互斥节点为根的支配树即可判断，不需要后支配树
+    """
+
+    def __init__(self, start_node: str, successors: Dict[str, List[str]], condition_nodes: List[str]):
+        self.start_node = start_node
+        # node_id: [target node ids]，重复的边保留，表示条件节点有多个分支连接到同一个节点
+        self.successors = successors
+        self.condition_nodes = condition_nodes
+        self.predecessors: Dict[str, List[str]] = {}
+        for source, targets in successors.items():
+            for target in targets:
+                self.predecessors.setdefault(target, []).append(source)
+
+        self.order, self.back_edges = dfs_order(start_node, successors)
+
+        # 每个互斥节点为根的支配树
+        self._condition_idom = {one: immediate_dominators(one, successors) for one in condition_nodes}
+        # 虚拟根节点连接所有互斥节点时的支配树，key为排除的互斥节点
+        self._root_idom = {}
+
+    def is_back_edge(self, source: str, target: str) -> bool:
+        """ 是否是回到上游节点的边，节点连向自身的边不算 """
+        return source != target and (source, target) in self.back_edges
+
+    def _get_root_idom(self, exclude: str | None) -> Dict[str, str]:
+        if exclude not in self._root_idom:
+            successors = dict(self.successors)
+            successors[_VIRTUAL_ROOT] = [one for one in self.condition_nodes if one != exclude]
+            self._root_idom[exclude] = immediate_dominators(_VIRTUAL_ROOT, successors)
+        return self._root_idom[exclude]
+
+    def _has_disjoint_paths(self, root: str, idom: Dict[str, str], node_id: str) -> bool:
+        """ 是否存在两条从root到node_id的路径，路径中除了首尾节点以外没有相同的节点 (Menger定理) """
+        if node_id not in idom:
+            return False
+        predecessors = [one for one in self.predecessors.get(node_id, []) if one in idom and one != node_id]
+        direct_count = predecessors.count(root)
+        if direct_count == 0:
+            # 不相邻时，两条不相交的路径等价于没有单个节点能切断root到node_id的所有路径
+            return idom[node_id] == root
+        if direct_count > 1:
+            return True
+        # 直连的边是一条路径，只要还有另外一条不经过node_id本身的路径即可
+        for one in predecessors:
+            if one != root and not _dominates(idom, node_id, one):
+                return True
+        return False
+
+    def _reach_avoiding(self, root: str, target: str, avoid: str) -> bool:
+        """ 从root出发，不经过avoid节点能否到达target """
+        idom = self._condition_idom[root]
+        if target not in idom or avoid not in idom:
+            return target in idom
+        return not _dominates(idom, avoid, target)
+
+    def is_exclusive_merge(self, node_id: str) -> bool:
+        """ 判断是否存在从condition节点或者output节点（选择型交互）到此节点的两条不重复的路径
+        路径可以从同一个互斥节点出发，也可以从不同的互斥节点出发，不重复是指除了各自的起点和此节点以外没有相同的节点
+        """
+        conditions = [one for one in self.condition_nodes if one != node_id]
+        # 同一个互斥节点出发的两条路径
+        for one in conditions:
+            if self._has_disjoint_paths(one, self._condition_idom[one], node_id):
+                return True
+        if len(conditions) < 2:
+            return False
+        # 互斥节点直连此节点，并且可以从其他互斥节点不经过此节点到达它, 两条路径只共享了直连的这条边
+        direct_conditions = set(self.predecessors.get(node_id, [])) & set(conditions)
+        for one in direct_conditions:
+            for other in conditions:
+                if other != one and self._reach_avoiding(other, one, node_id):
+                    return True
+        # 不同互斥节点出发的两条完全不相交的路径
+        exclude = node_id if node_id in self.condition_nodes else None
+        return self._has_disjoint_paths(_VIRTUAL_ROOT, self._get_root_idom(exclude), node_id)
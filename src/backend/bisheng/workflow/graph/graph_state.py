@@ -1,8 +1,11 @@
+import threading
 from typing import Any, Dict, Optional, List
 
 from langchain.memory import ConversationBufferWindowMemory
 from langchain_core.messages import AIMessage, HumanMessage, get_buffer_string, BaseMessage
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+from bisheng.utils.token_count import trim_messages_by_token
 
 
 class GraphState(BaseModel):
@@ -14,51 +17,72 @@ class GraphState(BaseModel):
     # 全局变量池
     variables_pool: Dict[str, Dict[str, Any]] = Field(default_factory=dict, description='全局变量池: {node_id: {key: value}}')
 
-    def get_history_memory(self, count: int) -> str:
+    # 并行执行的节点会同时写入全局状态
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    def get_history_memory(self, count: int, max_token: Optional[int] = None) -> str:
         """ 获取聊天历史记录
-        因为不是1对1，所以重写 buffer_as_str"""
+        因为不是1对1，所以重写 buffer_as_str
+        max_token: 聊天记录的最大token数，超出时丢弃最早的消息"""
         if not count:
             count = self.history_memory.k
         if count == 0:
             return ''
         messages = self.history_memory.chat_memory.messages[-count:]
+        messages = trim_messages_by_token(messages, max_token)
         return get_buffer_string(
             messages,
             human_prefix=self.history_memory.human_prefix,
             ai_prefix=self.history_memory.ai_prefix,
         )
 
-    def get_history_list(self, count: int) -> List[BaseMessage]:
-        return self.history_memory.buffer_as_messages[-count:]
+    def get_history_list(self, count: int, max_token: Optional[int] = None) -> List[BaseMessage]:
+        return trim_messages_by_token(self.history_memory.buffer_as_messages[-count:], max_token)
+
+    def dump_checkpoint(self) -> Dict[str, Any]:
+        """ 全局状态的快照，用于暂停后在其他进程中恢复运行 """
+        with self._lock:
+            return {
+                'history_memory': self.history_memory,
+                'variables_pool': {node_id: dict(node_variables) for node_id, node_variables in
+                                   self.variables_pool.items()},
+            }
 
+    def load_checkpoint(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self.history_memory = data['history_memory']
+            self.variables_pool = data['variables_pool']
 
     def save_context(self, content: str, msg_sender: str) -> None:
         """  保存聊天记录
         workflow 特殊情况，过程会有多轮交互，所以不是一条对一条，重制消息结构"""
-        if msg_sender == 'human':
-            self.history_memory.chat_memory.add_messages([HumanMessage(content=content)])
-        elif msg_sender == 'AI':
-            self.history_memory.chat_memory.add_messages([AIMessage(content=content)])
+        with self._lock:
+            if msg_sender == 'human':
+                self.history_memory.chat_memory.add_messages([HumanMessage(content=content)])
+            elif msg_sender == 'AI':
+                self.history_memory.chat_memory.add_messages([AIMessage(content=content)])
 
     def set_variable(self, node_id: str, key: str, value: Any):
         """ 将节点产生的数据放到全局变量里 """
-        if node_id not in self.variables_pool:
-            self.variables_pool[node_id] = {}
-        self.variables_pool[node_id][key] = value
+        with self._lock:
+            self.variables_pool.setdefault(node_id, {})[key] = value
 
-    def get_variable(self, node_id: str, key: str, count: Optional[int] = None) -> Any:
+    def get_variable(self, node_id: str, key: str, count: Optional[int] = None,
+                     max_token: Optional[int] = None) -> Any:
         """ 从全局变量中获取数据 """
         if node_id not in self.variables_pool:
             return None
 
         if key == 'chat_history':
-            return self.get_history_memory(count=count)
+            return self.get_history_memory(count=count, max_token=max_token)
         return self.variables_pool[node_id].get(key)
 
-    def get_variable_by_str(self, contact_key: str, history_count: Optional[int] = None) -> Any:
+    def get_variable_by_str(self, contact_key: str, history_count: Optional[int] = None,
+                            history_max_token: Optional[int] = None) -> Any:
         """
         从全局变量中获取数据
         contact_key: node_id.key#index  #index不一定需要
+        history_max_token: 获取聊天历史时的最大token数
         """
         tmp_list = contact_key.split('.', 1)
         node_id = tmp_list[0]
@@ -66,7 +90,7 @@ class GraphState(BaseModel):
         variable_val_index = None
         if var_key.find('#') != -1:
             var_key, variable_val_index = var_key.split('#')
-        variable_val = self.get_variable(node_id, var_key, history_count)
+        variable_val = self.get_variable(node_id, var_key, history_count, history_max_token)
 
         # 数组变量的处理
         if variable_val_index:
@@ -86,19 +110,22 @@ class GraphState(BaseModel):
         tmp_list = contact_key.split('.', 1)
         node_id = tmp_list[0]
         var_key = tmp_list[1]
-        if var_key.find('#') != -1:
-            var_key, variable_val_index = var_key.split('#')
-            old_value = self.get_variable(node_id, var_key)
-            if not old_value:
-                old_value = {}
-            old_value[variable_val_index] = value
-            value = old_value
-        self.set_variable(node_id, var_key, value)
+        with self._lock:
+            if var_key.find('#') != -1:
+                var_key, variable_val_index = var_key.split('#')
+                old_value = self.get_variable(node_id, var_key)
+                if not old_value:
+                    old_value = {}
+                old_value[variable_val_index] = value
+                value = old_value
+            self.set_variable(node_id, var_key, value)
 
     def get_all_variables(self) -> Dict[str, Any]:
         """ 获取所有的变量，key为node_id.key的格式 """
         ret = {}
-        for node_id, node_variables in self.variables_pool.items():
+        with self._lock:
+            variables_pool = {node_id: dict(node_variables) for node_id, node_variables in self.variables_pool.items()}
+        for node_id, node_variables in variables_pool.items():
             for key, value in node_variables.items():
                 ret[f'{node_id}.{key}'] = self.get_variable(node_id, key)
                 # 特殊处理下 preset_question key
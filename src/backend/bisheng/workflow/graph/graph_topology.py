@@ -0,0 +1,232 @@
+import hashlib
+import json
+import operator
+import threading
+import weakref
+from typing import Annotated, Dict, List
+
+from cachetools import LRUCache
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.constants import END, START
+from langgraph.graph import StateGraph
+from loguru import logger
+from typing_extensions import TypedDict
+
+from bisheng.workflow.common.node import NodeType
+from bisheng.workflow.edges.edges import EdgeManage
+from bisheng.workflow.graph.graph_analysis import GraphAnalysis
+
+
+def delete_thread_checkpoint(checkpointer: MemorySaver, thread_id: str):
+    """ 删除一次运行在内存中保存的checkpoint，langgraph-checkpoint 2.0.26 之前的版本没有 delete_thread """
+    if hasattr(checkpointer, 'delete_thread'):
+        checkpointer.delete_thread(thread_id)
+        return
+    checkpointer.storage.pop(thread_id, None)
+    for key in [one for one in list(checkpointer.writes) if one[0] == thread_id]:
+        checkpointer.writes.pop(key, None)
+    blobs = getattr(checkpointer, 'blobs', None)
+    if blobs:
+        for key in [one for one in list(blobs) if one[0] == thread_id]:
+            blobs.pop(key, None)
+
+
+class TempState(TypedDict):
+    # not use, only for langgraph state graph
+    flag: Annotated[bool, operator.and_]
+
+
+class GraphTopology:
+    """
+    工作流编译后的拓扑结构，包含扇入节点的等待关系和编译后的langgraph图。
+    同一版本的工作流在多次运行之间共享，每次运行只需要创建新的节点实例和状态。
+    langgraph中注册的是按节点id分发的函数，通过运行配置中的thread_id找到本次运行的节点实例
+    """
+
+    def __init__(self, edges: EdgeManage, nodes_map: Dict, start_node: str, end_nodes: List[str],
+                 interrupt_nodes: List[str], async_mode: bool):
+        self.edges = edges
+        self.async_mode = async_mode
+
+        self.start_node = start_node
+        self.end_nodes = end_nodes
+        self.interrupt_nodes = interrupt_nodes
+
+        # node_id: node_type
+        self.nodes_type = {node_id: node_instance.type for node_id, node_instance in nodes_map.items()}
+        # record how many nodes fan in this node
+        self.nodes_fan_in = {}  # node_id: [node_ids]
+        # 互斥节点列表，包含condition节点和output节点（选择型交互）
+        self.condition_nodes = []
+        # 图结构分析的结果
+        self.analysis: GraphAnalysis | None = None
+
+        # 正在使用此拓扑运行的引擎 thread_id: GraphEngine
+        self._engines = weakref.WeakValueDictionary()
+
+        self.checkpointer = MemorySaver()
+        self.graph_builder = StateGraph(TempState)
+        self.graph = None
+
+        self.build(nodes_map)
+
+    def build(self, nodes_map: Dict):
+        for node_id, node_instance in nodes_map.items():
+            if node_instance.type == NodeType.FAKE_OUTPUT.value:
+                self.graph_builder.add_node(node_id, self._node_runner(node_id))
+                continue
+            if node_instance.is_condition_node():
+                self.condition_nodes.append(node_id)
+            self.nodes_fan_in[node_id] = self.edges.get_source_node(node_id)
+            # add node into langgraph
+            self.graph_builder.add_node(node_id, self._node_runner(node_id))
+
+        self.graph_builder.add_edge(START, self.start_node)
+        for end_node in self.end_nodes:
+            self.graph_builder.add_edge(end_node, END)
+
+        # 分析图结构，用于判断多扇入节点是否需要等待
+        self.analysis = GraphAnalysis(self.start_node, self.edges.get_successors(), self.condition_nodes)
+
+        # 将其他节点链接起来
+        for node_id in nodes_map.keys():
+            self.add_node_edge(node_id, nodes_map)
+
+        # 处理包含多个扇入节点的节点
+        self.build_more_fan_in_node()
+
+        # compile langgraph
+        self.graph = self.graph_builder.compile(checkpointer=self.checkpointer,
+                                                interrupt_before=self.interrupt_nodes)
+
+    def _node_runner(self, node_id: str):
+        """ 注册到langgraph的节点函数，执行时分发到本次运行的节点实例 """
+        if self.async_mode:
+            async def arun(state: dict, config: RunnableConfig):
+                return await self.get_node(config, node_id).arun(state)
+
+            return arun
+
+        def run(state: dict, config: RunnableConfig):
+            return self.get_node(config, node_id).run(state)
+
+        return run
+
+    def _node_router(self, node_id: str):
+        """ 注册到langgraph的条件边函数，执行时分发到本次运行的节点实例 """
+
+        def route_node(state: dict, config: RunnableConfig):
+            return self.get_node(config, node_id).route_node(state)
+
+        return route_node
+
+    def get_node(self, config: RunnableConfig, node_id: str):
+        engine = self._engines[config['configurable']['thread_id']]
+        return engine.nodes_map[node_id]
+
+    def register(self, thread_id: str, engine):
+        """ 注册一次运行，引擎被回收时清理对应的checkpoint """
+        self._engines[thread_id] = engine
+        weakref.finalize(engine, delete_thread_checkpoint, self.checkpointer, thread_id)
+
+    def add_node_edge(self, node_id: str, nodes_map: Dict):
+        """  把节点的边链接起来  """
+        node_instance = nodes_map[node_id]
+        if node_instance.type == NodeType.END.value or node_instance.type == NodeType.FAKE_OUTPUT.value:
+            return
+        # get target nodes
+        target_node_ids = self.edges.get_target_node(node_instance.id)
+        source_node_ids = self.edges.get_source_node(node_instance.id)
+        # 没有任何链接的节点报错
+        if not target_node_ids and not source_node_ids:
+            raise Exception(
+                f'node {node_instance.name} {node_instance.id} must have at least one edge')
+
+        # output 节点后跟一个fake 节点用来处理中断
+        if node_instance.type == NodeType.OUTPUT.value:
+            fake_node_id = f'{node_instance.id}_fake'
+            self.graph_builder.add_edge(node_instance.id, fake_node_id)
+            self.graph_builder.add_conditional_edges(
+                fake_node_id, self._node_router(node_instance.id),
+                {node_id: node_id
+                 for node_id in target_node_ids})
+            return
+
+        # condition 和 output 节点后面需要接 langgraph的 edge_condition
+        if node_instance.type == NodeType.CONDITION.value:
+            self.graph_builder.add_conditional_edges(
+                node_instance.id, self._node_router(node_instance.id),
+                {node_id: node_id
+                 for node_id in target_node_ids})
+            return
+
+        # 链接到target节点
+        for node_id in target_node_ids:
+            if node_id not in nodes_map:
+                raise Exception(f'target node {node_id} not found')
+            if self.nodes_fan_in.get(node_id) and len(self.nodes_fan_in.get(node_id)) > 1:
+                # need wait all fan in node exec over
+                continue
+            self.graph_builder.add_edge(node_instance.id, node_id)
+
+    def build_more_fan_in_node(self):
+        for node_id, source_ids in self.nodes_fan_in.items():
+            if not source_ids or len(source_ids) <= 1:
+                continue
+            # 有多个扇入节点，判断此节点是否需要等待
+            wait_nodes, no_wait_nodes = self.parse_fan_in_node(node_id)
+            logger.debug(f'node {node_id} wait nodes {wait_nodes}, no wait nodes {no_wait_nodes}')
+            if wait_nodes:
+                self.graph_builder.add_edge(wait_nodes, node_id)
+            if no_wait_nodes:
+                for one in no_wait_nodes:
+                    self.graph_builder.add_edge(one, node_id)
+
+    def parse_fan_in_node(self, node_id: str):
+        source_ids = self.nodes_fan_in.get(node_id)
+
+        # 前驱节点中 包含 此节点的下游节点(回边)，则不需要等待，需要排除output和condition节点，因为这两个节点通过条件边已连接到此节点了
+        if any(self.analysis.is_back_edge(one, node_id) for one in source_ids):
+            return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
+
+        # 存在从condition节点或者output节点（选择型交互）到此节点的 两条不重复的路径，说明是互斥收尾节点，不需要等待
+        if self.analysis.is_exclusive_merge(node_id):
+            return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
+
+        # 说明不是互斥收尾节点，需要等待所有前驱节点执行完毕再执行
+        wait_nodes = []
+        for one in source_ids:
+            if one.startswith('output_'):
+                one = f'{one}_fake'
+            wait_nodes.append(one)
+        return wait_nodes, []
+
+
+class GraphTopologyCache:
+    """ 按 (workflow_id, 版本hash, 运行模式) 缓存编译后的拓扑结构 """
+
+    def __init__(self, maxsize: int = 256):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def version_hash(workflow_data: Dict) -> str:
+        """ 工作流的节点和边决定了编译后的拓扑结构 """
+        content = json.dumps({'nodes': workflow_data.get('nodes', []), 'edges': workflow_data.get('edges', [])},
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+    def cache_key(self, workflow_id: str, workflow_data: Dict, async_mode: bool) -> tuple:
+        return workflow_id, self.version_hash(workflow_data), async_mode
+
+    def get(self, key: tuple) -> GraphTopology | None:
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: tuple, topology: GraphTopology):
+        with self._lock:
+            self._cache[key] = topology
+
+
+graph_topology_cache = GraphTopologyCache()
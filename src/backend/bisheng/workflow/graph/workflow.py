@@ -16,11 +16,13 @@ class Workflow:
                  async_mode: bool = False,
                  max_steps: int = 0,
                  timeout: int = 0,
-                 callback: BaseCallback = None):
+                 callback: BaseCallback = None,
+                 max_concurrency: int = None):
 
         # 运行的唯一标识，保存到数据库的唯一ID
         self.workflow_id = workflow_id
         self.user_id = user_id
+        self.workflow_data = workflow_data
 
         # 超时时间，多久没有接收到用户输入终止workflow运行（单位：分钟）
         self.timeout = timeout
@@ -31,7 +33,8 @@ class Workflow:
                                         workflow_id=workflow_id,
                                         workflow_data=workflow_data,
                                         max_steps=max_steps,
-                                        callback=callback)
+                                        callback=callback,
+                                        max_concurrency=max_concurrency)
 
     def save_user_input_history(self, input_data: dict | None):
         if not input_data:
@@ -82,6 +85,23 @@ class Workflow:
     def stop(self):
         self.graph_engine.stop()
 
+    def dump_checkpoint(self) -> Dict:
+        """ 可序列化的运行快照，等待用户输入时保存，任意进程都可以通过快照恢复运行 """
+        return {
+            'workflow_data': self.workflow_data,
+            'current_time': self.current_time,
+            'graph_engine': self.graph_engine.dump_checkpoint(),
+        }
+
+    @classmethod
+    def from_checkpoint(cls, workflow_id: str, user_id: str, checkpoint: Dict, max_steps: int = 0,
+                        timeout: int = 0, callback: BaseCallback = None, max_concurrency: int = None) -> 'Workflow':
+        workflow = cls(workflow_id, user_id, checkpoint['workflow_data'], False, max_steps, timeout, callback,
+                       max_concurrency=max_concurrency)
+        workflow.current_time = checkpoint['current_time']
+        workflow.graph_engine.load_checkpoint(checkpoint['graph_engine'])
+        return workflow
+
     def status(self):
         return self.graph_engine.status
 
@@ -27,6 +27,8 @@ agent_executor_dict = {
 
 
 class AgentNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_llm', '_agent', '_tools', '_sql_agent', '_sql_address'}
+    _limit_history_token = True
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -344,7 +346,7 @@ class AgentNode(BaseNode):
 
         chat_history = []
         if self._chat_history_flag:
-            chat_history = self.graph_state.get_history_list(self._chat_history_num)
+            chat_history = self.graph_state.get_history_list(self._chat_history_num, self.get_history_max_token())
 
         llm_callback = LLMNodeCallbackHandler(callback=self.callback_manager,
                                               unique_id=unique_id,
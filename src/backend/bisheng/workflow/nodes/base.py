@@ -1,11 +1,15 @@
+import asyncio
 import base64
 import copy
+import pickle
 import uuid
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from langchain_core.messages import HumanMessage
+from loguru import logger
 
+from bisheng.settings import settings
 from bisheng.utils.exceptions import IgnoreException
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.callback.event import NodeEndData, NodeStartData
@@ -16,6 +20,12 @@ from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
 
 class BaseNode(ABC):
+    # 不需要保存到checkpoint的属性，恢复时由节点初始化重新生成
+    _checkpoint_exclude = {'id', 'type', 'name', 'description', 'target_edges', 'user_id', 'workflow_id',
+                           'graph_state', 'node_data', 'max_steps', 'callback_manager', 'tmp_collection_name',
+                           'stop_flag'}
+    # 引用聊天历史时是否按token数截断，调用模型的节点需要避免超出模型的上下文长度
+    _limit_history_token = False
 
     def __init__(self, node_data: BaseNodeData, workflow_id: str, user_id: str,
                  graph_state: GraphState, target_edges: List[EdgeBase], max_steps: int,
@@ -95,9 +105,15 @@ class BaseNode(ABC):
         """
         return []
 
+    def get_history_max_token(self) -> Optional[int]:
+        """ 引用聊天历史时的最大token数，节点参数中没有配置时使用工作流的全局配置 """
+        if not self._limit_history_token:
+            return None
+        return self.node_params.get('history_max_token') or settings.get_workflow_conf().history_max_token
+
     def get_other_node_variable(self, variable_key: str) -> Any:
         """ 从全局变量中获取其他节点的变量值 """
-        value = self.graph_state.get_variable_by_str(variable_key)
+        value = self.graph_state.get_variable_by_str(variable_key, history_max_token=self.get_history_max_token())
         self.other_node_variable[variable_key] = value
         return value
 
@@ -209,7 +225,29 @@ class BaseNode(ABC):
         return state
 
     async def arun(self, state: dict) -> Any:
-        return self.run(state)
+        # 节点内部都是同步的IO调用，放到线程中执行，避免阻塞事件循环中其他并发的节点
+        return await asyncio.to_thread(self.run, state)
 
     def stop(self):
         self.stop_flag = True
+
+    def dump_checkpoint(self) -> Dict[str, Any]:
+        """
+        节点运行过程中产生的数据，用于暂停后在其他进程中恢复运行。
+        无法序列化的属性(各种客户端)需要加到 _checkpoint_exclude 中，由节点初始化重新生成
+        每个属性单独序列化，个别属性无法序列化时只跳过这个属性
+        """
+        ret = {}
+        for key, value in self.__dict__.items():
+            if key in self._checkpoint_exclude:
+                continue
+            try:
+                ret[key] = pickle.dumps(value)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.warning(f'node {self.type} {self.id} checkpoint skip attribute {key}, '
+                               f'add it to _checkpoint_exclude: {e}')
+        return ret
+
+    def load_checkpoint(self, data: Dict[str, Any]):
+        """ 从checkpoint中恢复节点的运行数据 """
+        self.__dict__.update({key: pickle.loads(value) for key, value in data.items()})
@@ -5,6 +5,7 @@ from bisheng.workflow.nodes.code.code_parse import CodeParser
 
 
 class CodeNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_code_parser'}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
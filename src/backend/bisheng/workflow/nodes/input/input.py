@@ -16,6 +16,7 @@ from bisheng.workflow.nodes.base import BaseNode
 
 
 class InputNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_embedding', '_vector_client', '_es_client'}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -10,6 +10,8 @@ from loguru import logger
 
 
 class LLMNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_llm'}
+    _limit_history_token = True
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
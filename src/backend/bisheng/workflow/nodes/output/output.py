@@ -8,6 +8,7 @@ from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
 
 class OutputNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_minio_client'}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
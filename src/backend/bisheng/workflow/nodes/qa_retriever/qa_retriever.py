@@ -9,6 +9,7 @@ from bisheng_langchain.chains.retrieval.retrieval_chain import RetrievalChain
 
 
 class QARetrieverNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_retriever'}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
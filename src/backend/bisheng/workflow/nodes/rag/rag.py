@@ -1,24 +1,35 @@
 import json
+import threading
 import time
 from typing import List, Any
 
 from bisheng_langchain.rag.bisheng_rag_chain import BishengRetrievalQA
+from cachetools import TTLCache
 from langchain_core.prompts import (ChatPromptTemplate, HumanMessagePromptTemplate,
                                     SystemMessagePromptTemplate)
+from loguru import logger
 
 from bisheng.api.services.llm import LLMService
+from bisheng.cache.redis import redis_client
 from bisheng.chat.types import IgnoreException
 from bisheng.database.models.user import UserDao
 from bisheng.interface.importing.utils import import_vectorstore
 from bisheng.interface.initialize.loading import instantiate_vectorstore
+from bisheng.utils.constants import KNOWLEDGE_AUTH_VERSION
 from bisheng.utils.minio_client import MinioClient
 from bisheng.workflow.callback.event import OutputMsgData, StreamMsgOverData
 from bisheng.workflow.callback.llm_callback import LLMNodeCallbackHandler
 from bisheng.workflow.nodes.base import BaseNode
 from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
+# 初始化好的向量库和关键词检索库，检索范围相同的运行直接复用，省去连接和权限过滤的开销
+# 问答链每次运行时用当前节点的模型和提示词重新组装。知识库权限变化时通过版本号失效，过期时间兜底
+_rag_store_cache = TTLCache(maxsize=64, ttl=300)
+_rag_store_lock = threading.Lock()
+
 
 class RagNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_llm', '_milvus', '_es', '_minio_client'}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -71,18 +82,7 @@ class RagNode(BaseNode):
         self._log_reasoning_content = {}
 
         self.init_qa_prompt()
-        self.init_milvus()
-        self.init_es()
-
-        retriever = BishengRetrievalQA.from_llm(
-            llm=self._llm,
-            vector_store=self._milvus,
-            keyword_store=self._es,
-            QA_PROMPT=self._qa_prompt,
-            max_content=self._max_chunk_size,
-            sort_by_source_and_index=self._sort_chunks,
-            return_source_documents=True,
-        )
+        retriever = self.init_retriever()
         user_questions = self.init_user_question()
         ret = {}
         for index, question in enumerate(user_questions):
@@ -156,6 +156,60 @@ class RagNode(BaseNode):
             ret.append(one_ret)
         return ret
 
+    @staticmethod
+    def get_knowledge_auth_version():
+        try:
+            return redis_client.get(KNOWLEDGE_AUTH_VERSION)
+        except Exception as e:
+            logger.warning(f'get knowledge auth version failed: {e}')
+            return None
+
+    def rag_store_key(self) -> tuple:
+        """ 检索库缓存的key，只和检索范围有关 """
+        if self._knowledge_type == 'knowledge':
+            # 有权限校验时检索范围和用户相关，权限变化后版本号改变，不再命中之前的缓存
+            return ('knowledge', self._user_info.user_name, self._knowledge_auth, tuple(self._knowledge_value),
+                    self.get_knowledge_auth_version())
+        return 'file', self.workflow_id, self.tmp_collection_name, tuple(self.get_file_ids())
+
+    def init_stores(self):
+        """ 初始化向量库和关键词检索库，优先复用缓存中已经初始化好的 """
+        key = self.rag_store_key()
+        with _rag_store_lock:
+            stores = _rag_store_cache.get(key)
+        if stores is not None:
+            self._milvus, self._es, self._sort_chunks = stores
+            return
+
+        self.init_milvus()
+        self.init_es()
+        with _rag_store_lock:
+            _rag_store_cache[key] = (self._milvus, self._es, self._sort_chunks)
+
+    def init_retriever(self) -> BishengRetrievalQA:
+        """ 用当前节点的模型和提示词组装检索问答链 """
+        self.init_stores()
+        return BishengRetrievalQA.from_llm(
+            llm=self._llm,
+            vector_store=self._milvus,
+            keyword_store=self._es,
+            QA_PROMPT=self._qa_prompt,
+            max_content=self._max_chunk_size,
+            sort_by_source_and_index=self._sort_chunks,
+            return_source_documents=True,
+        )
+
+    def get_file_ids(self) -> List[str]:
+        """ 临时文件列表对应的文件id """
+        file_ids = ["0"]
+        for one in self._knowledge_value:
+            file_metadata = self.get_other_node_variable(one)
+            if not file_metadata:
+                # 未找到对应的临时文件数据, 用户未上传文件
+                continue
+            file_ids.append(file_metadata[0]['file_id'])
+        return file_ids
+
     def init_user_question(self) -> List[str]:
         # 默认把用户问题都转为字符串
         ret = []
@@ -208,13 +262,7 @@ class RagNode(BaseNode):
             embeddings = LLMService.get_knowledge_default_embedding()
             if not embeddings:
                 raise Exception('没有配置默认的embedding模型')
-            file_ids = ["0"]
-            for one in self._knowledge_value:
-                file_metadata = self.get_other_node_variable(one)
-                if not file_metadata:
-                    # 未找到对应的临时文件数据, 用户未上传文件
-                    continue
-                file_ids.append(file_metadata[0]['file_id'])
+            file_ids = self.get_file_ids()
             self._sort_chunks = len(file_ids) == 1
             node_type = 'Milvus'
             params = {
@@ -238,12 +286,7 @@ class RagNode(BaseNode):
                 '_is_check_auth': self._knowledge_auth
             }
         else:
-            file_ids = ["0"]
-            for one in self._knowledge_value:
-                file_metadata = self.get_other_node_variable(one)
-                if not file_metadata:
-                    continue
-                file_ids.append(file_metadata[0]['file_id'])
+            file_ids = self.get_file_ids()
             node_type = 'ElasticKeywordsSearch'
             params = {
                 'index_name': self.tmp_collection_name,
@@ -8,6 +8,7 @@ from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
 
 class ToolNode(BaseNode):
+    _checkpoint_exclude = BaseNode._checkpoint_exclude | {'_tool'}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -0,0 +1,71 @@
+""" 工作流图结构分析的性能测试
+python benchmark_graph_analysis.py
+生成多层嵌套的条件分支和并行分支组成的工作流，统计图结构分析和多扇入节点判断的耗时
+"""
+import random
+import time
+from typing import Dict, List
+
+from bisheng.workflow.graph.graph_analysis import GraphAnalysis
+
+
+class WorkflowGenerator:
+
+    def __init__(self, seed: int = 0):
+        self.random = random.Random(seed)
+        self.successors: Dict[str, List[str]] = {}
+        self.condition_nodes: List[str] = []
+        self.count = 0
+
+    def new_node(self, prefix: str) -> str:
+        self.count += 1
+        return f'{prefix}_{self.count}'
+
+    def add_edge(self, source: str, target: str):
+        self.successors.setdefault(source, []).append(target)
+
+    def build_block(self, source: str, depth: int) -> str:
+        """ 从source开始生成一个分支块，返回分支汇合后的节点 """
+        if depth == 0:
+            node = self.new_node('llm')
+            self.add_edge(source, node)
+            return node
+        if self.random.random() < 0.6:
+            # 条件分支，各个分支互斥
+            branch = self.new_node('condition')
+            self.condition_nodes.append(branch)
+        else:
+            # 并行分支，汇合节点需要等待所有分支
+            branch = self.new_node('tool')
+        self.add_edge(source, branch)
+        merge = self.new_node('llm')
+        for _ in range(self.random.randint(2, 3)):
+            tail = self.build_block(branch, depth - 1)
+            self.add_edge(tail, merge)
+        return merge
+
+    def build(self, depth: int, blocks: int) -> str:
+        start = self.new_node('start')
+        tail = start
+        for _ in range(blocks):
+            tail = self.build_block(tail, depth)
+        self.add_edge(tail, self.new_node('end'))
+        return start
+
+
+def run_once(depth: int, blocks: int):
+    generator = WorkflowGenerator()
+    start = generator.build(depth, blocks)
+
+    begin = time.perf_counter()
+    analysis = GraphAnalysis(start, generator.successors, generator.condition_nodes)
+    fan_in_nodes = [node for node, sources in analysis.predecessors.items() if len(sources) > 1]
+    exclusive = sum(1 for node in fan_in_nodes if analysis.is_exclusive_merge(node))
+    cost = time.perf_counter() - begin
+    print(f'nodes={generator.count:<6} conditions={len(generator.condition_nodes):<5} '
+          f'fan_in={len(fan_in_nodes):<5} exclusive={exclusive:<5} cost={cost * 1000:.2f}ms')
+
+
+if __name__ == '__main__':
+    for one_depth, one_blocks in [(3, 5), (4, 4), (5, 3), (6, 2), (7, 2)]:
+        run_once(one_depth, one_blocks)
@@ -0,0 +1,104 @@
+"""
+批量上传 doc/ppt 文件时 LibreOffice 转换的吞吐测试
+对比每个文件启动一次soffice和使用常驻实例池转换的耗时
+
+python benchmark_libreoffice_converter.py --input_dir /data/docs --workers 2
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bisheng.api.services.libreoffice_converter import (EXPORT_FILTERS, LibreOfficePool,
+                                                        get_libreoffice_path)
+
+
+def list_files(input_dir: str):
+    files = []
+    for name in sorted(os.listdir(input_dir)):
+        if name.lower().endswith(('.doc', '.ppt', '.pptx')):
+            files.append(os.path.abspath(os.path.join(input_dir, name)))
+    return files
+
+
+def target_format(file_path: str):
+    if file_path.lower().endswith('.doc'):
+        return 'docx', None
+    return 'pdf', EXPORT_FILTERS['impress_pdf']
+
+
+def run_spawn_per_file(soffice_path: str, files, output_dir: str):
+    """ 旧的方式：每个文件启动一次soffice，共用默认配置目录只能串行 """
+    ok = 0
+    for one in files:
+        convert_to, _ = target_format(one)
+        ret = subprocess.run([soffice_path, '--headless', '--convert-to', convert_to, '--outdir', output_dir, one],
+                             capture_output=True, timeout=300)
+        ok += ret.returncode == 0
+    return ok
+
+
+def run_pool(pool: LibreOfficePool, files, output_dir: str, batch_size: int):
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+
+    def convert_batch(batch):
+        ok = 0
+        for convert_to in ('docx', 'pdf'):
+            sub_batch = [one for one in batch if target_format(one)[0] == convert_to]
+            if not sub_batch:
+                continue
+            result = pool.convert_files(sub_batch, convert_to, output_dir, timeout=300,
+                                        filter_name=target_format(sub_batch[0])[1])
+            ok += len([one for one in result.values() if one])
+        return ok
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        return sum(executor.map(convert_batch, batches))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dir', required=True, help='包含doc/ppt文件的目录')
+    parser.add_argument('--workers', type=int, default=2, help='LibreOffice实例数')
+    parser.add_argument('--batch_size', type=int, default=8, help='每个实例一次转换的文件数')
+    parser.add_argument('--skip_spawn', action='store_true', help='不测试每个文件启动soffice的方式')
+    parser.add_argument('--mode', choices=['unoserver', 'uno', 'cli'], default=None,
+                        help='实例池的运行模式，默认自动检测')
+    args = parser.parse_args()
+
+    soffice_path = get_libreoffice_path()
+    if not soffice_path:
+        raise Exception('LibreOffice not found')
+    files = list_files(args.input_dir)
+    print(f'files={len(files)} workers={args.workers} batch_size={args.batch_size}')
+
+    if not args.skip_spawn:
+        output_dir = tempfile.mkdtemp()
+        start = time.perf_counter()
+        ok = run_spawn_per_file(soffice_path, files, output_dir)
+        cost = time.perf_counter() - start
+        print(f'spawn per file: ok={ok} cost={cost:.2f}s throughput={len(files) / cost:.2f} files/s')
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    pool = LibreOfficePool(size=args.workers, soffice_path=soffice_path, mode=args.mode)
+    # cli模式每批文件仍然启动一次soffice，对比结果时需要确认实际使用的模式
+    print(f'pool mode={pool.mode} resident={pool.resident}')
+    try:
+        # 第一轮包含实例的启动时间
+        for index in range(2):
+            output_dir = tempfile.mkdtemp()
+            start = time.perf_counter()
+            ok = run_pool(pool, files, output_dir, args.batch_size)
+            cost = time.perf_counter() - start
+            print(f'pool({pool.mode}) round {index + 1}: ok={ok} cost={cost:.2f}s '
+                  f'throughput={len(files) / cost:.2f} files/s')
+            shutil.rmtree(output_dir, ignore_errors=True)
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+""" RedisClient 的吞吐量对比测试
+python benchmark_redis_client.py
+对比旧的调用方式(每次调用后关闭连接、写入和过期分两次网络往返)与当前实现的 ops/sec
+"""
+import asyncio
+import pickle
+import time
+
+from bisheng.cache.redis import redis_client, async_redis_client
+
+BENCH_KEY = 'bisheng:benchmark'
+
+
+def legacy_set(key, value, expiration=3600):
+    pickled = pickle.dumps(value)
+    redis_client.connection.setex(key, expiration, pickled)
+    redis_client.connection.close()
+
+
+def legacy_rpush(key, value, expiration=3600):
+    redis_client.connection.rpush(key, value)
+    redis_client.connection.expire(key, expiration)
+    redis_client.connection.close()
+
+
+def legacy_incr(key, expiration=3600):
+    redis_client.connection.incr(key)
+    redis_client.connection.expire(key, expiration)
+    redis_client.connection.close()
+
+
+def bench(name: str, func, total: int):
+    start = time.perf_counter()
+    for i in range(total):
+        func(i)
+    cost = time.perf_counter() - start
+    print(f'{name:<24} {total / cost:>10.0f} ops/sec')
+
+
+async def async_bench(name: str, func, total: int, concurrency: int = 10):
+    async def worker(index: int):
+        for i in range(index, total, concurrency):
+            await func(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    cost = time.perf_counter() - start
+    print(f'{name:<24} {total / cost:>10.0f} ops/sec')
+
+
+def run(total: int = 10000):
+    set_key = f'{BENCH_KEY}:set'
+    list_key = f'{BENCH_KEY}:list'
+    incr_key = f'{BENCH_KEY}:incr'
+
+    bench('legacy set', lambda i: legacy_set(set_key, i), total)
+    bench('set', lambda i: redis_client.set(set_key, i), total)
+    bench('legacy rpush', lambda i: legacy_rpush(list_key, i), total)
+    bench('rpush', lambda i: redis_client.rpush(list_key, i), total)
+    bench('legacy incr', lambda i: legacy_incr(incr_key), total)
+    bench('incr', lambda i: redis_client.incr(incr_key), total)
+
+    async def pipeline_rpush(i):
+        pipe = async_redis_client.pipeline()
+        for j in range(10):
+            pipe.rpush(list_key, j)
+        pipe.expire(list_key, 3600)
+        await pipe.execute()
+
+    async def async_run():
+        # 异步连接池和事件循环绑定，所有异步测试在同一个事件循环中执行
+        await async_bench('async set', lambda i: async_redis_client.set(set_key, i), total)
+        await async_bench('async rpush', lambda i: async_redis_client.rpush(list_key, i), total)
+        await async_bench('async pipeline rpush*10', pipeline_rpush, total // 10)
+
+    asyncio.run(async_run())
+
+    for key in [set_key, list_key, incr_key]:
+        redis_client.delete(key)
+
+
+if __name__ == '__main__':
+    run()
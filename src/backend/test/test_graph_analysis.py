@@ -0,0 +1,138 @@
+""" 多扇入节点的等待判断和原来枚举所有路径的实现保持一致 """
+import random
+from typing import Dict, List
+
+import pytest
+
+from bisheng.workflow.graph.graph_analysis import GraphAnalysis
+
+
+def enumerate_branches(successors: Dict[str, List[str]], start_node_id: str, end_node_id: str) -> List[List[str]]:
+    """ 原来的实现：枚举从start到end的所有路径 """
+    branches = []
+
+    def get_node_branch(node_id, branch: List, node_map: dict):
+        if node_id in node_map or node_id == end_node_id:
+            branch.append(node_id)
+            branches.append(branch)
+            return
+        branch.append(node_id)
+        node_map[node_id] = True
+        next_nodes = successors.get(node_id, [])
+        if not next_nodes:
+            branches.append(branch)
+            return
+        for one_node in next_nodes:
+            get_node_branch(one_node, branch.copy(), node_map.copy())
+
+    get_node_branch(start_node_id, [], {})
+    return branches
+
+
+def enumerate_exclusive_merge(successors: Dict[str, List[str]], condition_nodes: List[str], node_id: str) -> bool:
+    """ 原来的实现：存在从互斥节点出发到此节点的两条不重复的路径 """
+    all_branches = []
+    for one in condition_nodes:
+        if node_id == one:
+            continue
+        for branch in enumerate_branches(successors, one, node_id):
+            if node_id not in branch:
+                continue
+            branch.remove(node_id)
+            branch.remove(one)
+            all_branches.append(branch)
+    for i in range(len(all_branches)):
+        for j in range(i + 1, len(all_branches)):
+            if not (set(all_branches[i]) & set(all_branches[j])):
+                return True
+    return False
+
+
+def fan_in_wait(successors: Dict[str, List[str]], exclusive) -> Dict[str, bool]:
+    """ 多扇入节点 node_id: 是否需要等待所有前驱节点 """
+    predecessors = {}
+    for source, targets in successors.items():
+        for target in targets:
+            predecessors.setdefault(target, []).append(source)
+    return {node: not exclusive(node) for node, sources in predecessors.items() if len(sources) > 1}
+
+
+class DiamondGenerator:
+    """ 生成由条件分支和并行分支嵌套组成的无环工作流，再随机加入向下游的跨分支边 """
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        self.successors: Dict[str, List[str]] = {}
+        self.condition_nodes: List[str] = []
+        self.order: List[str] = []
+
+    def new_node(self, prefix: str) -> str:
+        node = f'{prefix}_{len(self.order)}'
+        self.order.append(node)
+        return node
+
+    def add_edge(self, source: str, target: str):
+        self.successors.setdefault(source, []).append(target)
+
+    def build_block(self, source: str, depth: int) -> str:
+        if depth == 0:
+            node = self.new_node('llm')
+            self.add_edge(source, node)
+            return node
+        if self.random.random() < 0.6:
+            branch = self.new_node('condition')
+            self.condition_nodes.append(branch)
+        else:
+            branch = self.new_node('tool')
+        self.add_edge(source, branch)
+        tails = [self.build_block(branch, depth - 1) for _ in range(self.random.randint(2, 3))]
+        # 汇合节点在所有分支之后生成，生成顺序即为拓扑序
+        merge = self.new_node('llm')
+        for tail in tails:
+            self.add_edge(tail, merge)
+        return merge
+
+    def build(self, depth: int, blocks: int, extra_edges: int) -> str:
+        start = self.new_node('start')
+        tail = start
+        for _ in range(blocks):
+            tail = self.build_block(tail, depth)
+        self.add_edge(tail, self.new_node('end'))
+        # 按生成顺序只加向后的边，保持无环
+        for _ in range(extra_edges):
+            i, j = sorted(self.random.sample(range(1, len(self.order)), 2))
+            if self.order[j] not in self.successors.get(self.order[i], []):
+                self.add_edge(self.order[i], self.order[j])
+        return start
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_fan_in_wait_matches_enumeration(seed):
+    generator = DiamondGenerator(seed)
+    start = generator.build(depth=2, blocks=2, extra_edges=seed % 4)
+    analysis = GraphAnalysis(start, generator.successors, generator.condition_nodes)
+
+    assert not analysis.back_edges
+    expected = fan_in_wait(generator.successors,
+                           lambda node: enumerate_exclusive_merge(generator.successors, generator.condition_nodes,
+                                                                  node))
+    assert fan_in_wait(generator.successors, analysis.is_exclusive_merge) == expected
+
+
+def test_condition_diamond_not_wait():
+    successors = {'start': ['condition_1'], 'condition_1': ['llm_1', 'llm_2'], 'llm_1': ['end'], 'llm_2': ['end']}
+    analysis = GraphAnalysis('start', successors, ['condition_1'])
+    assert analysis.is_exclusive_merge('end')
+
+
+def test_parallel_diamond_wait():
+    successors = {'start': ['tool_1'], 'tool_1': ['llm_1', 'llm_2'], 'llm_1': ['end'], 'llm_2': ['end']}
+    analysis = GraphAnalysis('start', successors, [])
+    assert not analysis.is_exclusive_merge('end')
+
+
+def test_back_edge():
+    successors = {'start': ['llm_1'], 'llm_1': ['condition_1'], 'condition_1': ['llm_1', 'end']}
+    analysis = GraphAnalysis('start', successors, ['condition_1'])
+    assert analysis.is_back_edge('condition_1', 'llm_1')
+    assert not analysis.is_back_edge('start', 'llm_1')
@@ -0,0 +1,113 @@
+""" 表格文件转markdown分片的测试 """
+import os
+
+import openpyxl
+import pytest
+
+from bisheng.api.services import md_from_excel
+from bisheng.api.services.md_from_excel import convert_file_to_markdown, iter_markdown_chunks
+
+
+def read_chunks(output_dir: str) -> list:
+    result = []
+    for name in sorted(os.listdir(output_dir)):
+        with open(os.path.join(output_dir, name), encoding='utf-8') as f:
+            result.append(f.read())
+    return result
+
+
+def table_rows(markdown: str) -> list:
+    """ markdown表格的每一行，去掉分隔符行 """
+    return [[cell.strip() for cell in line.strip('|').split('|')] for line in markdown.split('\n')
+            if not line.startswith('|---')]
+
+
+@pytest.fixture
+def merged_xlsx(tmp_path):
+    """ 表头一行，数据6行，B2:B5 纵向合并跨越了每3行一个分片的边界，A6:C6 横向合并 """
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['name', 'group', 'score'])
+    for i in range(1, 7):
+        sheet.append([f'n{i}', f'g{i}', i])
+    sheet.merge_cells('B2:B5')
+    sheet.merge_cells('A6:C6')
+    path = str(tmp_path / 'merged.xlsx')
+    workbook.save(path)
+    return path
+
+
+def test_merged_range_cross_chunk(merged_xlsx, tmp_path):
+    output_dir = str(tmp_path / 'out')
+    convert_file_to_markdown(merged_xlsx, [0, 0], 3, output_dir)
+    chunks = read_chunks(output_dir)
+    assert len(chunks) == 2
+    first, second = table_rows(chunks[0]), table_rows(chunks[1])
+    # 每个分片都带表头
+    assert first[0] == second[0] == ['name', 'group', 'score']
+    # 合并区域的值延续到下一个分片
+    assert [row[1] for row in first[1:]] == ['g1', 'g1', 'g1']
+    assert second[1] == ['n4', 'g1', '4']
+    assert second[2] == ['n5', 'n5', 'n5']
+    assert second[3] == ['n6', 'g6', '6']
+
+
+def test_header_beyond_row_count(merged_xlsx, tmp_path):
+    # 表头起始行超出总行数，全部内容视为数据
+    output_dir = str(tmp_path / 'start')
+    convert_file_to_markdown(merged_xlsx, [10, 12], 4, output_dir)
+    chunks = read_chunks(output_dir)
+    assert len(chunks) == 2
+    assert table_rows(chunks[0])[0] == ['name', 'group', 'score']
+    assert table_rows(chunks[1])[0] == ['n4', 'g1', '4']
+
+    # 表头结束行超出总行数，截断到最后一行，表头之前的行作为数据
+    output_dir = str(tmp_path / 'end')
+    convert_file_to_markdown(merged_xlsx, [5, 20], 4, output_dir)
+    chunks = read_chunks(output_dir)
+    assert len(chunks) == 2
+    for chunk in chunks:
+        assert table_rows(chunk)[:2] == [['n5', 'n5', 'n5'], ['n6', 'g6', '6']]
+    assert [row[0] for row in table_rows(chunks[0])[2:]] == ['name', 'n1', 'n2', 'n3']
+    assert [row[0] for row in table_rows(chunks[1])[2:]] == ['n4']
+
+
+@pytest.mark.parametrize('rows_per_markdown', [0, -1])
+def test_slice_length_not_positive(merged_xlsx, tmp_path, rows_per_markdown):
+    output_dir = str(tmp_path / 'out')
+    convert_file_to_markdown(merged_xlsx, [0, 0], rows_per_markdown, output_dir)
+    chunks = read_chunks(output_dir)
+    # 不分片，全部数据在一个文件中
+    assert len(chunks) == 1
+    assert len(table_rows(chunks[0])) == 7
+
+
+def test_only_header():
+    chunks = list(iter_markdown_chunks([['a', 'b']], 2, [0, 0], 3))
+    assert chunks == [(0, '| a | b |\n|---|---|', 0)]
+
+
+def test_csv_chunked_read(tmp_path, monkeypatch):
+    # 每次只读取4行，分片跨越了读取块的边界
+    monkeypatch.setattr(md_from_excel, 'CSV_READ_CHUNK_SIZE', 4)
+    path = tmp_path / 'data.csv'
+    lines = ['id,value'] + [f'{i},v{i}' for i in range(1, 11)]
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    output_dir = str(tmp_path / 'out')
+    convert_file_to_markdown(str(path), [0, 0], 3, output_dir)
+    chunks = read_chunks(output_dir)
+    assert len(chunks) == 4
+    data_rows = []
+    for chunk in chunks:
+        rows = table_rows(chunk)
+        assert rows[0] == ['id', 'value']
+        data_rows.extend(rows[1:])
+    assert data_rows == [[str(i), f'v{i}'] for i in range(1, 11)]
+
+
+def test_empty_csv(tmp_path):
+    path = tmp_path / 'empty.csv'
+    path.write_text('', encoding='utf-8')
+    output_dir = str(tmp_path / 'out')
+    convert_file_to_markdown(str(path), [0, 0], 3, output_dir)
+    assert read_chunks(output_dir) == []
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 from langchain.embeddings.base import Embeddings
 from langchain.utils import get_from_dict_or_env
 from pydantic import model_validator, BaseModel, Field
@@ -38,6 +40,15 @@ def embed_with_retry(embeddings: HostEmbeddings, **kwargs: Any) -> Any:
     return _embed_with_retry(**kwargs)
 
 
+def _create_session(pool_size: int) -> requests.Session:
+    """ 复用连接的http session，连接池大小和并发数一致 """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 class HostEmbeddings(BaseModel, Embeddings):
     """host embedding models.
     """
@@ -51,7 +62,10 @@ class HostEmbeddings(BaseModel, Embeddings):
 
     embedding_ctx_length: Optional[int] = 6144
     """The maximum number of tokens to embed at once."""
+    batch_size: Optional[int] = 200
     """Maximum number of texts to embed in each batch"""
+    max_concurrency: Optional[int] = 4
+    """Maximum number of batches to embed at the same time"""
     max_retries: Optional[int] = 6
     """Maximum number of retries to make when generating."""
     request_timeout: Optional[Union[float, Tuple[float, float]]] = 200
@@ -76,10 +90,7 @@ class HostEmbeddings(BaseModel, Embeddings):
         except Exception:
             raise Exception(f'Failed to set url ep failed for model {model}')
 
-        try:
-            values['client'] = requests.post
-        except AttributeError:
-            raise ValueError('Try upgrading it with `pip install --upgrade requests`.')
+        values['client'] = _create_session(values.get('max_concurrency') or 4).post
         return values
 
     @property
@@ -97,33 +108,30 @@ class HostEmbeddings(BaseModel, Embeddings):
         if self.verbose:
             print('payload', inp)
 
-        max_text_to_split = 200
-        outp = None
-
-        start_index = 0
-        len_text = len(texts)
-        while start_index < len_text:
-            inp_local = {
-                'texts': texts[start_index:min(start_index + max_text_to_split, len_text)],
-                'model': self.model,
-                'type': emb_type
-            }
-            try:
-                outp_single = self.client(url=self.url_ep,
-                                          json=inp_local,
-                                          timeout=self.request_timeout).json()
-                if outp is None:
-                    outp = outp_single
-                else:
-                    outp['embeddings'] += outp_single['embeddings']
-            except requests.exceptions.Timeout:
-                raise Exception(f'timeout in host embedding infer, url=[{self.url_ep}]')
-            except Exception as e:
-                raise Exception(f'exception in host embedding infer: [{e}]')
-
-            if outp_single['status_code'] != 200:
-                raise ValueError(f"API returned an error: {outp['status_message']}")
-            start_index += max_text_to_split
+        batch_size = self.batch_size or 200
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) <= 1 or (self.max_concurrency or 1) <= 1:
+            results = [self._embed_batch(one, emb_type) for one in batches]
+        else:
+            # 多个批次并发请求，结果按批次顺序拼接
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency or 1, len(batches))) as executor:
+                results = list(executor.map(lambda one: self._embed_batch(one, emb_type), batches))
+        embeddings = []
+        for one in results:
+            embeddings += one
+        return embeddings
+
+    def _embed_batch(self, texts: List[str], emb_type: str) -> List[List[float]]:
+        inp_local = {'texts': texts, 'model': self.model, 'type': emb_type}
+        try:
+            outp = self.client(url=self.url_ep, json=inp_local, timeout=self.request_timeout).json()
+        except requests.exceptions.Timeout:
+            raise Exception(f'timeout in host embedding infer, url=[{self.url_ep}]')
+        except Exception as e:
+            raise Exception(f'exception in host embedding infer: [{e}]')
+
+        if outp['status_code'] != 200:
+            raise ValueError(f"API returned an error: {outp['status_message']}")
         return outp['embeddings']
 
     def embed_documents(self,
@@ -175,8 +183,5 @@ class CustomHostEmbedding(HostEmbeddings):
         except Exception:
             raise Exception('Failed to set url ep for custom host embedding')
 
-        try:
-            values['client'] = requests.post
-        except AttributeError:
-            raise ValueError('Try upgrading it with `pip install --upgrade requests`.')
+        values['client'] = _create_session(values.get('max_concurrency') or 4).post
         return values
@@ -1,3 +1,5 @@
+import copy
+import functools
 import os
 from typing import Any, Dict, Optional, Tuple, Union
 
@@ -33,6 +35,12 @@ class MultArgsSchemaTool(Tool):
             return (), tool_input
 
 
+@functools.lru_cache(maxsize=8)
+def _load_config(yaml_path: str) -> Dict:
+    with open(yaml_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
 class BishengRAGTool:
 
     def __init__(self,
@@ -50,8 +58,8 @@ class BishengRAGTool:
 
         yaml_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                                  'config/baseline_v2.yaml')
-        with open(yaml_path, 'r', encoding='utf-8') as f:
-            self.params = yaml.safe_load(f)
+        # 配置只解析一次，初始化过程中会修改配置，所以每次使用副本
+        self.params = copy.deepcopy(_load_config(yaml_path))
 
         # update params
         max_content = kwargs.get('max_content', 15000)
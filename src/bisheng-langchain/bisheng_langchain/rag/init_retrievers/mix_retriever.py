@@ -1,11 +1,32 @@
-from typing import Any, List, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 from bisheng_langchain.vectorstores import ElasticKeywordsSearch
 from langchain.text_splitter import TextSplitter
 from langchain_core.documents import Document
-from pydantic import Field
+from pydantic import Field, PrivateAttr
 from langchain_core.retrievers import BaseRetriever
 
+# 向量检索中分数越大越相似的度量方式，其他度量方式(L2)分数越小越相似
+_SIMILARITY_METRICS = ('IP', 'COSINE')
+# 每个检索器最多缓存的collection数
+_STORE_CACHE_SIZE = 16
+
+
+def _normalize_scores(docs_and_scores: List[Tuple[Document, float]], higher_better: bool) -> List[float]:
+    """ min-max 归一化到[0, 1]，越相似分数越高 """
+    if not docs_and_scores:
+        return []
+    scores = [score for _, score in docs_and_scores]
+    min_score, max_score = min(scores), max(scores)
+    if max_score == min_score:
+        return [1.0] * len(scores)
+    if higher_better:
+        return [(score - min_score) / (max_score - min_score) for score in scores]
+    return [(max_score - score) / (max_score - min_score) for score in scores]
+
 
 class MixRetriever(BaseRetriever):
     vector_store: Any
@@ -16,7 +37,16 @@ class MixRetriever(BaseRetriever):
     search_type: str = 'similarity'
     vector_search_kwargs: dict = Field(default_factory=dict)
     keyword_search_kwargs: dict = Field(default_factory=dict)
-    combine_strategy: str = 'mix'  # "keyword_front, vector_front, mix"
+    combine_strategy: str = 'mix'  # "keyword_front, vector_front, mix, rrf, weighted"
+    # rrf融合时的平滑常数
+    rrf_k: int = 60
+    # rrf和weighted融合时两路检索结果的权重
+    keyword_weight: float = 0.5
+    vector_weight: float = 0.5
+
+    # collection_name: (keyword_store, vector_store)，避免每次检索都重新建立连接和加载collection，按LRU淘汰
+    _store_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _store_lock: Any = PrivateAttr(default_factory=threading.Lock)
 
     def add_documents(
         self,
@@ -59,31 +89,91 @@ class MixRetriever(BaseRetriever):
             drop_old=drop_old,
         )
 
-    def _get_relevant_documents(
-        self,
-        query: str,
-        collection_name: Optional[str] = None,
-    ) -> List[Document]:
-        if collection_name:
-            self.keyword_store = self.keyword_store.__class__(
+    def _get_stores(self, collection_name: str) -> tuple:
+        """ 获取collection对应的store，不修改检索器本身的store，多个线程同时检索不同collection时互不影响 """
+        with self._store_lock:
+            if collection_name in self._store_cache:
+                self._store_cache.move_to_end(collection_name)
+                return self._store_cache[collection_name]
+        if (getattr(self.keyword_store, 'index_name', None) == collection_name
+                and getattr(self.vector_store, 'collection_name', None) == collection_name):
+            # 当前的store已经是此collection的，直接复用
+            stores = (self.keyword_store, self.vector_store)
+        else:
+            keyword_store = self.keyword_store.__class__(
                 index_name=collection_name,
                 elasticsearch_url=self.keyword_store.elasticsearch_url,
                 ssl_verify=self.keyword_store.ssl_verify,
                 llm_chain=self.keyword_store.llm_chain)
-            self.vector_store = self.vector_store.__class__(
+            vector_store = self.vector_store.__class__(
                 collection_name=collection_name,
                 embedding_function=self.vector_store.embedding_func,
                 connection_args=self.vector_store.connection_args,
             )
+            stores = (keyword_store, vector_store)
+        with self._store_lock:
+            self._store_cache[collection_name] = stores
+            self._store_cache.move_to_end(collection_name)
+            while len(self._store_cache) > _STORE_CACHE_SIZE:
+                self._store_cache.popitem(last=False)
+        return stores
+
+    @staticmethod
+    def _vector_higher_better(vector_store) -> bool:
+        search_params = getattr(vector_store, 'search_params', None) or {}
+        return search_params.get('metric_type') in _SIMILARITY_METRICS
+
+    def _fuse(self, keyword_docs: List[Tuple[Document, float]],
+              vector_docs: List[Tuple[Document, float]], vector_store) -> List[Document]:
+        """ 按内容合并两路结果的分数，相同内容的文档分数累加 """
+        if self.combine_strategy == 'rrf':
+            keyword_scores = [1 / (self.rrf_k + rank + 1) for rank in range(len(keyword_docs))]
+            vector_scores = [1 / (self.rrf_k + rank + 1) for rank in range(len(vector_docs))]
+        else:
+            keyword_scores = _normalize_scores(keyword_docs, higher_better=True)
+            vector_scores = _normalize_scores(vector_docs, higher_better=self._vector_higher_better(vector_store))
+
+        fused: Dict[str, list] = {}
+        for docs_and_scores, scores, weight in [(keyword_docs, keyword_scores, self.keyword_weight),
+                                                (vector_docs, vector_scores, self.vector_weight)]:
+            for (doc, _), score in zip(docs_and_scores, scores):
+                if doc.page_content in fused:
+                    fused[doc.page_content][1] += weight * score
+                else:
+                    fused[doc.page_content] = [doc, weight * score]
+        return [doc for doc, _ in sorted(fused.values(), key=lambda x: x[1], reverse=True)]
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+    ) -> List[Document]:
+        keyword_store, vector_store = self.keyword_store, self.vector_store
+        if collection_name:
+            keyword_store, vector_store = self._get_stores(collection_name)
         if self.search_type == 'similarity':
-            keyword_docs = self.keyword_store.similarity_search(query,
-                                                                **self.keyword_search_kwargs)
-            vector_docs = self.vector_store.similarity_search(query, **self.vector_search_kwargs)
+            with_score = self.combine_strategy in ['rrf', 'weighted']
+            if not with_score and self.combine_strategy not in ['keyword_front', 'vector_front', 'mix']:
+                raise ValueError(f'Expected combine_strategy to be one of '
+                                 f'(keyword_front, vector_front, mix, rrf, weighted),'
+                                 f'instead found {self.combine_strategy}')
+            keyword_search = keyword_store.similarity_search_with_score if with_score \
+                else keyword_store.similarity_search
+            vector_search = vector_store.similarity_search_with_score if with_score \
+                else vector_store.similarity_search
+            # 关键词检索和向量检索并发执行
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                keyword_future = executor.submit(keyword_search, query, **self.keyword_search_kwargs)
+                vector_future = executor.submit(vector_search, query, **self.vector_search_kwargs)
+                keyword_docs = keyword_future.result()
+                vector_docs = vector_future.result()
+            if with_score:
+                return self._fuse(keyword_docs, vector_docs, vector_store)
             if self.combine_strategy == 'keyword_front':
                 return keyword_docs + vector_docs
             elif self.combine_strategy == 'vector_front':
                 return vector_docs + keyword_docs
-            elif self.combine_strategy == 'mix':
+            else:
                 combine_docs = []
                 min_len = min(len(keyword_docs), len(vector_docs))
                 for i in range(min_len):
@@ -92,10 +182,6 @@ class MixRetriever(BaseRetriever):
                 combine_docs.extend(keyword_docs[min_len:])
                 combine_docs.extend(vector_docs[min_len:])
                 return combine_docs
-            else:
-                raise ValueError(f'Expected combine_strategy to be one of '
-                                 f'(keyword_front, vector_front, mix),'
-                                 f'instead found {self.combine_strategy}')
         else:
             raise ValueError(
                 f'Expected search_type to be one of (similarity), instead found {self.search_type}'
@@ -1,38 +1,119 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
 
 class CustomReranker:
 
-    def __init__(self, model_path, device_id='cuda:0', threshold=0.0):
+    def __init__(self,
+                 model_path,
+                 device_id=None,
+                 threshold=0.0,
+                 batch_size=16,
+                 max_length=512,
+                 backend='torch',
+                 cache_size=10000):
+        """
+        device_id: 默认有gpu时使用cuda:0，否则使用cpu
+        backend: torch 或者 onnx，onnx使用onnxruntime在cpu上推理，需要安装optimum[onnxruntime]
+        batch_size: 每个批次计算的chunk数，chunk按长度排序后分批，减少padding的计算量
+        cache_size: 缓存 (query, chunk) 的分数个数，0表示不缓存
+        """
+        if device_id is None:
+            device_id = 'cuda:0' if torch.cuda.is_available() else 'cpu'
         self.device_id = device_id
         self.threshold = threshold
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.backend = backend
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.rank_model = AutoModelForSequenceClassification.from_pretrained(model_path).to(device_id)
-        self.rank_model.eval()
+        if backend == 'onnx':
+            try:
+                from optimum.onnxruntime import ORTModelForSequenceClassification
+            except ImportError:
+                raise ImportError('Could not import optimum onnxruntime python package. '
+                                  'Please install it with `pip install optimum[onnxruntime]`.')
+            self.device_id = 'cpu'
+            self.rank_model = ORTModelForSequenceClassification.from_pretrained(model_path, export=True)
+        else:
+            self.rank_model = AutoModelForSequenceClassification.from_pretrained(model_path).to(device_id)
+            self.rank_model.eval()
 
-    def match_score(self, chunk, query):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def _cache_key(query, chunk):
+        return query, hashlib.md5(chunk.encode('utf-8')).hexdigest()
+
+    def _get_cache(self, key):
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _set_cache(self, key, score):
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _batch_score(self, query, chunks):
         """
-        rerank模型计算query和chunk的相似度
+        一个批次内padding到批次内最长的文本
         """
-        pairs = [[query, chunk]]
-
+        pairs = [[query, chunk] for chunk in chunks]
         with torch.no_grad():
-            inputs = self.tokenizer(pairs, padding=True, truncation=True, return_tensors='pt', max_length=512).to(self.device_id)
+            inputs = self.tokenizer(pairs, padding=True, truncation=True, return_tensors='pt',
+                                    max_length=self.max_length).to(self.device_id)
             scores = self.rank_model(**inputs, return_dict=True).logits.view(-1, ).float()
-            scores = torch.sigmoid(scores) 
+            scores = torch.sigmoid(scores)
             scores = scores.cpu().numpy()
-            
-        return scores[0]
+        return scores.tolist()
+
+    def compute_scores(self, query, chunks):
+        """
+        rerank模型批量计算query和所有chunk的相似度，返回和chunks顺序一致的分数
+        """
+        scores = [None] * len(chunks)
+        keys = [self._cache_key(query, chunk) for chunk in chunks]
+        missing = []
+        for index, key in enumerate(keys):
+            scores[index] = self._get_cache(key) if self.cache_size else None
+            if scores[index] is None:
+                missing.append(index)
+
+        # 按长度排序后分批，同一批次内的文本长度接近，padding更少
+        missing.sort(key=lambda i: len(chunks[i]), reverse=True)
+        for start in range(0, len(missing), self.batch_size):
+            batch_index = missing[start:start + self.batch_size]
+            batch_scores = self._batch_score(query, [chunks[i] for i in batch_index])
+            for index, score in zip(batch_index, batch_scores):
+                scores[index] = score
+                self._set_cache(keys[index], score)
+        return scores
+
+    def match_score(self, chunk, query):
+        """
+        rerank模型计算query和chunk的相似度
+        """
+        return self.compute_scores(query, [chunk])[0]
 
     def sort_and_filter(self, query, all_chunks):
         """
         rerank模型对所有chunk进行排序
         """
-        chunk_match_score = []
-        for index, chunk in enumerate(all_chunks):
-            chunk_text = chunk.page_content
-            chunk_match_score.append(self.match_score(chunk_text, query))
+        if not all_chunks:
+            return []
+        chunk_match_score = self.compute_scores(query, [chunk.page_content for chunk in all_chunks])
 
         sorted_res = sorted(enumerate(chunk_match_score), key=lambda x: -x[1])
         remain_chunks = [all_chunks[elem[0]] for elem in sorted_res if elem[1] >= self.threshold]
@@ -45,4 +126,4 @@ class CustomReranker:
         #     print('socre:', sorted_res[index][1])
         #     print('***********')
 
-        return remain_chunks
\ No newline at end of file
+        return remain_chunks
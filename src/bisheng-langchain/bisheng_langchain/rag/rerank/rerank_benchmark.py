@@ -1,12 +1,29 @@
+"""
+rerank的效果和吞吐量测试
+召回率: python rerank_benchmark.py recall
+吞吐量: python rerank_benchmark.py throughput --model_path /home/public/llm/bge-reranker-large --device_id cpu
+"""
+import argparse
 import json
 import os
+import random
+import time
+
 import numpy as np
 import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
-tokenizer = AutoTokenizer.from_pretrained('/home/public/llm/bge-reranker-large')
-model = AutoModelForSequenceClassification.from_pretrained('/home/public/llm/bge-reranker-large').to('cuda:2')
-model.eval()
+MODEL_PATH = '/home/public/llm/bge-reranker-large'
+DEVICE_ID = 'cuda:2'
+tokenizer = None
+model = None
+
+
+def load_model(model_path=MODEL_PATH, device_id=DEVICE_ID):
+    global tokenizer, model
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForSequenceClassification.from_pretrained(model_path).to(device_id)
+    model.eval()
 
 
 def min_edit_distance(a, b):
@@ -40,7 +57,7 @@ def match_score(chunk, query):
     pairs = [[query, chunk]]
 
     with torch.no_grad():
-        inputs = tokenizer(pairs, padding=True, truncation=True, return_tensors='pt', max_length=512).to('cuda:2')
+        inputs = tokenizer(pairs, padding=True, truncation=True, return_tensors='pt', max_length=512).to(DEVICE_ID)
         scores = model(**inputs, return_dict=True).logits.view(-1, ).float()
         scores = torch.sigmoid(scores) 
         scores = scores.cpu().numpy()
@@ -115,25 +132,71 @@ def calc_precision_recall(d):
     return recall, N_gt, N_right, N_all
 
 
-with open('zhaogushu_retriever_gt_convert_key.json', 'r') as f:
-    retriever_gt_list = json.load(f)
-mFieldRecall = 0
-total_N_gt, total_N_right, total_N_all = 0, 0, 0
-D_SCORES = {}
-nquestion = 0
-for d in retriever_gt_list:
-    recall, N_gt, N_right, N_all = calc_precision_recall(d)
-    mFieldRecall += recall
-    D_SCORES[d["question"]] = {'recall': recall}
-    total_N_gt += N_gt
-    total_N_right += N_right
-    total_N_all += N_all
-    nquestion += 1
-
-mFieldRecall = 0 if nquestion == 0 else mFieldRecall / nquestion
-mMethodRecall = total_N_right / total_N_gt
-
-print(f'mFieldRecall: {mFieldRecall * 100:.2f} %')
-print(f'mMethodRecall: {mMethodRecall * 100:.2f} %')
-print(f'total_N_right: {total_N_right}, total_N_gt: {total_N_gt}, total_N_all: {total_N_all}' )
-print(f'nquestion: {nquestion}, mean_N_right: {total_N_right / nquestion}, mean_N_gt: {total_N_gt / nquestion}, mean_N_all: {total_N_all / nquestion}')
\ No newline at end of file
+def run_recall():
+    load_model()
+    with open('zhaogushu_retriever_gt_convert_key.json', 'r') as f:
+        retriever_gt_list = json.load(f)
+    mFieldRecall = 0
+    total_N_gt, total_N_right, total_N_all = 0, 0, 0
+    D_SCORES = {}
+    nquestion = 0
+    for d in retriever_gt_list:
+        recall, N_gt, N_right, N_all = calc_precision_recall(d)
+        mFieldRecall += recall
+        D_SCORES[d["question"]] = {'recall': recall}
+        total_N_gt += N_gt
+        total_N_right += N_right
+        total_N_all += N_all
+        nquestion += 1
+
+    mFieldRecall = 0 if nquestion == 0 else mFieldRecall / nquestion
+    mMethodRecall = total_N_right / total_N_gt
+
+    print(f'mFieldRecall: {mFieldRecall * 100:.2f} %')
+    print(f'mMethodRecall: {mMethodRecall * 100:.2f} %')
+    print(f'total_N_right: {total_N_right}, total_N_gt: {total_N_gt}, total_N_all: {total_N_all}' )
+    print(f'nquestion: {nquestion}, mean_N_right: {total_N_right / nquestion}, mean_N_gt: {total_N_gt / nquestion}, mean_N_all: {total_N_all / nquestion}')
+
+
+def random_chunk(length):
+    return ''.join(chr(random.randint(0x4e00, 0x9fa5)) for _ in range(length))
+
+
+def run_throughput(model_path, device_id, backend, batch_sizes, num_chunks, rounds):
+    """
+    统计不同批次大小下每秒可以rerank的chunk数，chunk长度在50到500之间随机，模拟检索结果
+    batch_size为1时等价于逐个chunk计算
+    """
+    from bisheng_langchain.rag.rerank.rerank import CustomReranker
+
+    random.seed(0)
+    query = random_chunk(20)
+    chunks = [random_chunk(random.randint(50, 500)) for _ in range(num_chunks)]
+    for batch_size in batch_sizes:
+        # 关闭分数缓存，只统计模型计算的耗时
+        reranker = CustomReranker(model_path, device_id=device_id, batch_size=batch_size, backend=backend,
+                                  cache_size=0)
+        reranker.compute_scores(query, chunks[:batch_size])  # warm up
+        start = time.perf_counter()
+        for _ in range(rounds):
+            reranker.compute_scores(query, chunks)
+        cost = time.perf_counter() - start
+        print(f'backend={backend} device={reranker.device_id} batch_size={batch_size:<4} '
+              f'{num_chunks * rounds / cost:>8.1f} chunks/sec')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['recall', 'throughput'], default='recall', nargs='?')
+    parser.add_argument('--model_path', default=MODEL_PATH)
+    parser.add_argument('--device_id', default=None)
+    parser.add_argument('--backend', default='torch', choices=['torch', 'onnx'])
+    parser.add_argument('--batch_sizes', default='1,8,16,32')
+    parser.add_argument('--num_chunks', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    if args.mode == 'recall':
+        run_recall()
+    else:
+        run_throughput(args.model_path, args.device_id, args.backend,
+                       [int(one) for one in args.batch_sizes.split(',')], args.num_chunks, args.rounds)
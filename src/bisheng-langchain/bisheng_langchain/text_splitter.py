@@ -3,9 +3,9 @@
 from __future__ import annotations
 
 import bisect
-import copy
 import logging
 import re
+from array import array
 from abc import ABC, abstractmethod
 from collections import Counter
 from dataclasses import dataclass
@@ -46,9 +46,12 @@ def _split_text_with_regex(
 
 class IntervalSearch(object):
     def __init__(self, inters):
-        arrs = []
-        for inter in inters:
-            arrs.extend(inter)
+        # 区间展开为紧凑的整数数组 [start0, end0, start1, end1, ...]
+        arrs = [one for inter in inters for one in inter]
+        try:
+            arrs = array('q', arrs)
+        except (TypeError, OverflowError):
+            pass
 
         self.arrs = arrs
         self.n = len(self.arrs)
@@ -75,13 +78,38 @@ class IntervalSearch(object):
 
         return new_ind
 
-    def find(self, inter) -> List[int, int]:
-        low_bound1 = bisect.bisect_left(self.arrs, inter[0])
-        low_bound2 = bisect.bisect_left(self.arrs, inter[1])
+    def find(self, inter, lo: int = 0) -> List[int, int]:
+        """
+        lo: 查找的下界，查询的区间按位置递增时传入上一次的结果，只在剩余的区间里查找
+        """
+        low_bound1 = bisect.bisect_left(self.arrs, inter[0], lo)
+        low_bound2 = bisect.bisect_left(self.arrs, inter[1], low_bound1)
         lb1 = self._norm_bound(low_bound1, inter[0])
         lb2 = self._norm_bound(low_bound2, inter[1])
         return [lb1 // 2, lb2 // 2]
 
+    def sweep(self, inters: Iterable[List[int, int]]) -> Iterable[List[int, int]]:
+        """
+        按顺序查找一组区间，区间的起始位置递增时从上一次的位置继续往后查找，整体只扫描一遍
+        """
+        lo = 0
+        last_start = None
+        for inter in inters:
+            if last_start is not None and inter[0] < last_start:
+                lo = 0
+            last_start = inter[0]
+            lo = bisect.bisect_left(self.arrs, inter[0], lo)
+            yield self.find(inter, lo)
+
+
+class _SpanText(str):
+    """ 带有在原文中起始位置的字符串，切分的同时记录chunk的位置，不需要再到原文中查找 """
+
+    def __new__(cls, value: str, start: int = 0):
+        obj = super().__new__(cls, value)
+        obj.start = start
+        return obj
+
 
 class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
     """
@@ -136,6 +164,17 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
 
         _separator = separator if self._is_separator_regex else re.escape(separator)
         splits = _split_text_with_regex(text, _separator, self._keep_separator, separator_rule)
+        # 记录每个片段在原文中的位置，片段按顺序出现，从上一个片段的结尾往后查找
+        base = getattr(text, 'start', 0)
+        pos = 0
+        span_splits = []
+        for s in splits:
+            index = text.find(s, pos)
+            if index == -1:
+                index = pos
+            span_splits.append(_SpanText(s, base + index))
+            pos = index + len(s)
+        splits = span_splits
 
         # Now go merging things, recursively splitting longer texts.
         _good_splits = []
@@ -158,8 +197,23 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
             final_chunks.extend(merged_text)
         return final_chunks
 
+    def _join_docs(self, docs: List[str], separator: str) -> Optional[str]:
+        """ 合并片段的同时计算合并后chunk在原文中的起始位置 """
+        text = super()._join_docs(docs, separator)
+        if text is None or not docs or not isinstance(docs[0], _SpanText):
+            return text
+        start = docs[0].start
+        if getattr(self, '_strip_whitespace', True):
+            joined = separator.join(docs)
+            start += len(joined) - len(joined.lstrip())
+        return _SpanText(text, start)
+
+    def split_text_with_offsets(self, text: str) -> List[Tuple[str, int]]:
+        """ 切分文本，返回 (chunk, chunk在原文中的起始位置) """
+        return [(str(chunk), chunk.start) for chunk in self._split_text(_SpanText(text), self._separators)]
+
     def split_text(self, text: str) -> List[str]:
-        return self._split_text(text, self._separators)
+        return [str(chunk) for chunk in self._split_text(text, self._separators)]
 
     def create_documents(
             self, texts: List[str], metadatas: Optional[List[dict]] = None
@@ -167,28 +221,31 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
         """Create documents from a list of texts."""
         documents = []
         for i, text in enumerate(texts):
-            index = -1
-            indexes = metadatas[i].get('indexes', [])
-            pages = metadatas[i].get('pages', [])
-            types = metadatas[i].get('types', [])
-            bboxes = metadatas[i].get('bboxes', [])
-            searcher = IntervalSearch(indexes)
-            split_texts = self.split_text(text)
-            for chunk in split_texts:
-                new_metadata = copy.deepcopy(metadatas[i])
-                if indexes and bboxes:
-                    index = text.find(chunk, index + 1)
-                    inter0 = [index, index + len(chunk) - 1]
-                    norm_inter = searcher.find(inter0)
-                    new_metadata['chunk_bboxes'] = []
-                    for j in range(norm_inter[0], norm_inter[1] + 1):
-                        new_metadata['chunk_bboxes'].append(
-                            {'page': pages[j], 'bbox': bboxes[j]})
+            metadata = metadatas[i] if metadatas else {}
+            indexes = metadata.get('indexes', [])
+            pages = metadata.get('pages', [])
+            types = metadata.get('types', [])
+            bboxes = metadata.get('bboxes', [])
+            split_texts = self.split_text_with_offsets(text)
+            if indexes and bboxes:
+                searcher = IntervalSearch(indexes)
+                chunk_inters = searcher.sweep([[index, index + len(chunk) - 1] for chunk, index in split_texts])
+            else:
+                chunk_inters = None
+            for chunk, index in split_texts:
+                # 元素级的bboxes/pages/indexes等数组在所有chunk之间共享，不再逐个深拷贝
+                new_metadata = dict(metadata)
+                if chunk_inters is not None:
+                    norm_inter = next(chunk_inters)
+                    new_metadata['chunk_bboxes'] = [{
+                        'page': pages[j],
+                        'bbox': bboxes[j]
+                    } for j in range(norm_inter[0], norm_inter[1] + 1)]
 
                     c = Counter([types[j] for j in norm_inter])
                     chunk_type = c.most_common(1)[0][0]
                     new_metadata['chunk_type'] = chunk_type
-                    new_metadata['source'] = metadatas[i].get('source', '')
+                    new_metadata['source'] = metadata.get('source', '')
 
                 # for chunk in split_texts:
                 #     new_metadata = {}
@@ -216,6 +273,5 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
                 #             new_metadata['chunk_bboxes'].append(
                 #                 {'page': elem[0], 'bbox': new_metadata['bboxes'][elem[1]]})
                 new_doc = Document(page_content=chunk, metadata=new_metadata)
-                prev_document = new_doc
                 documents.append(new_doc)
         return documents
@@ -2,6 +2,8 @@
 from __future__ import annotations
 
 import ast
+import json
+import threading
 import uuid
 from abc import ABC
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
@@ -20,6 +22,28 @@ if TYPE_CHECKING:
     from elasticsearch import Elasticsearch  # noqa: F401
 
 
+# 进程内共享的es客户端，es客户端内部有连接池并且线程安全，相同地址和认证配置复用同一个客户端
+_es_clients: Dict[str, Any] = {}
+_es_clients_lock = threading.Lock()
+
+
+def get_es_client(elasticsearch_url: str, ssl_verify: Optional[Dict[str, Any]] = None) -> 'Elasticsearch':
+    """ 获取共享的es客户端，不存在则创建 """
+    import elasticsearch
+
+    ssl_verify = ssl_verify or {}
+    key = f'{elasticsearch_url}:{json.dumps(ssl_verify, sort_keys=True, default=str)}'
+    with _es_clients_lock:
+        client = _es_clients.get(key)
+        if client is None:
+            try:
+                client = elasticsearch.Elasticsearch(elasticsearch_url, **ssl_verify)
+            except ValueError as e:
+                raise ValueError(f'Your elasticsearch client string is mis-formatted. Got error: {e} ')
+            _es_clients[key] = client
+        return client
+
+
 def _default_text_mapping() -> Dict:
     return {'properties': {'text': {'type': 'text'}}}
 
@@ -126,10 +150,7 @@ class ElasticKeywordsSearch(VectorStore, ABC):
         _ssl_verify = ssl_verify or {}
         self.elasticsearch_url = elasticsearch_url
         self.ssl_verify = _ssl_verify
-        try:
-            self.client = elasticsearch.Elasticsearch(elasticsearch_url, **_ssl_verify)
-        except ValueError as e:
-            raise ValueError(f'Your elasticsearch client string is mis-formatted. Got error: {e} ')
+        self.client = get_es_client(elasticsearch_url, _ssl_verify)
 
         if drop_old:
             try:
@@ -1,8 +1,11 @@
 """Wrapper around the Milvus vector database."""
 from __future__ import annotations
 
+import copy
 import logging
-from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from uuid import uuid4
 
 import numpy as np
@@ -22,6 +25,55 @@ DEFAULT_MILVUS_CONNECTION = {
     'secure': False,
 }
 
+# 进程内缓存已经加载过的collection句柄和schema、索引信息，
+# 相同collection再次初始化时跳过 has_collection/describe/create_index/load 等请求
+COLLECTION_CACHE_TTL = 300
+_collection_cache: Dict[Tuple[str, str], Tuple[float, dict]] = {}
+_collection_cache_lock = threading.Lock()
+
+
+def get_cached_collection(alias: str, collection_name: str) -> Optional[dict]:
+    """ 获取缓存的collection信息，过期返回None """
+    key = (alias, collection_name)
+    with _collection_cache_lock:
+        value = _collection_cache.get(key)
+        if value is None:
+            return None
+        if value[0] < time.monotonic():
+            _collection_cache.pop(key, None)
+            return None
+        return value[1]
+
+
+def set_cached_collection(alias: str, collection_name: str, col: Any, index: Optional[dict]) -> None:
+    """ 缓存已经加载好的collection，只缓存有索引的collection """
+    if index is None:
+        return
+    info = {
+        'col': col,
+        'fields': [x.name for x in col.schema.fields],
+        'index': index,
+    }
+    with _collection_cache_lock:
+        _collection_cache[(alias, collection_name)] = (time.monotonic() + COLLECTION_CACHE_TTL, info)
+
+
+def invalidate_collection_cache(collection_name: Optional[str] = None, alias: Optional[str] = None) -> None:
+    """ collection删除、重建或者连接关闭时清理对应的缓存 """
+    with _collection_cache_lock:
+        for key in list(_collection_cache.keys()):
+            if (collection_name is None or key[1] == collection_name) and (alias is None or key[0] == alias):
+                _collection_cache.pop(key, None)
+
+
+def is_collection_stale_error(e: Exception) -> bool:
+    """ collection被其他进程删除或者重建后，缓存的句柄会报collection不存在或者未加载 """
+    if getattr(e, 'code', None) in (100, 101):
+        return True
+    message = str(e).lower()
+    return 'collection not found' in message or "can't find collection" in message \
+        or 'collection not loaded' in message
+
 
 class Milvus(MilvusLangchain):
     """Initialize wrapper around the milvus vector database.
@@ -187,6 +239,8 @@ class Milvus(MilvusLangchain):
         self.collection_name = collection_name
         self.index_params = index_params
         self.search_params = search_params
+        # 重新获取collection时恢复成初始化时传入的检索参数
+        self._init_search_params = search_params
         self.consistency_level = consistency_level
         self.connection_args = connection_args
 
@@ -212,6 +266,10 @@ class Milvus(MilvusLangchain):
         self.alias = self._create_connection_alias(connection_args)
         self.col: Optional[Collection] = None
 
+        # 已经加载过的collection直接复用
+        if not drop_old and self._init_from_cache():
+            return
+
         # Grab the existing collection if it exists
         try:
             if utility.has_collection(self.collection_name, using=self.alias):
@@ -227,14 +285,55 @@ class Milvus(MilvusLangchain):
         if drop_old and isinstance(self.col, Collection):
             self.col.drop()
             self.col = None
+            invalidate_collection_cache(self.collection_name)
 
         # Initialize the vector store
         self._init()
 
     def close_connection(self, using):
         from pymilvus import connections
+        invalidate_collection_cache(alias=using)
         connections.remove_connection(using)
 
+    def _reload_collection(self) -> None:
+        """ 缓存的collection失效时清理缓存，重新获取一次collection """
+        from pymilvus import Collection, utility
+
+        invalidate_collection_cache(self.collection_name, self.alias)
+        self.col = None
+        self.fields = []
+        self.search_params = copy.deepcopy(self._init_search_params)
+        if utility.has_collection(self.collection_name, using=self.alias):
+            self.col = Collection(self.collection_name, using=self.alias)
+        self._init()
+
+    def _call_collection(self, func: Callable[[], Any]) -> Any:
+        """ 调用collection的接口，collection被其他进程删除或者重建时重新获取一次后重试 """
+        try:
+            return func()
+        except Exception as e:
+            if not is_collection_stale_error(e):
+                raise
+            logger.warning(f'milvus collection {self.collection_name} is stale, reload it: {e}')
+            self._reload_collection()
+            if self.col is None:
+                raise
+            return func()
+
+    def _init_from_cache(self) -> bool:
+        """ 使用缓存的collection信息初始化，不再请求milvus """
+        cached = get_cached_collection(self.alias, self.collection_name)
+        if cached is None:
+            return False
+        self.col = cached['col']
+        self.fields = [one for one in cached['fields'] if one != self._primary_field]
+        if self.search_params is None:
+            index_type: str = cached['index']['index_param']['index_type']
+            metric_type: str = cached['index']['index_param']['metric_type']
+            self.search_params = copy.deepcopy(self.default_search_params[index_type])
+            self.search_params['metric_type'] = metric_type
+        return True
+
     def _create_connection_alias(self, connection_args: dict, personal_alias: str = None) -> str:
         """Create the connection to the Milvus server."""
         from pymilvus import MilvusException, connections
@@ -288,12 +387,17 @@ class Milvus(MilvusLangchain):
     def _init(self,
               embeddings: Optional[list] = None,
               metadatas: Optional[list[dict]] = None) -> None:
+        from pymilvus import Collection
+
         if embeddings is not None:
             self._create_collection(embeddings, metadatas)
+            invalidate_collection_cache(self.collection_name)
         self._extract_fields()
         self._create_index()
         self._create_search_params()
         self._load()
+        if isinstance(self.col, Collection):
+            set_cached_collection(self.alias, self.collection_name, self.col, self._get_index())
 
     def _create_collection(self, embeddings: list, metadatas: Optional[list[dict]] = None) -> None:
         from pymilvus import (
@@ -453,6 +557,7 @@ class Milvus(MilvusLangchain):
         timeout: Optional[int] = None,
         batch_size: int = 1000,
         no_embedding: bool = False,
+        embeddings: Optional[List[List[float]]] = None,
         **kwargs: Any,
     ) -> List[str]:
         """Insert text data into Milvus.
@@ -473,6 +578,8 @@ class Milvus(MilvusLangchain):
                 to None.
             batch_size (int, optional): Batch size to use for insertion.
                 Defaults to 1000.
+            embeddings (Optional[List[List[float]]]): Precomputed embeddings of
+                the texts, skip the embedding call when provided.
 
         Raises:
             MilvusException: Failure to add texts
@@ -483,7 +590,11 @@ class Milvus(MilvusLangchain):
         from pymilvus import Collection, MilvusException
 
         texts = list(texts)
-        if not no_embedding:
+        if embeddings is not None:
+            if len(embeddings) == 0:
+                logger.debug('Nothing to insert, skipping.')
+                return []
+        elif not no_embedding:
             try:
                 embeddings = self.embedding_func.embed_documents(texts)
             except NotImplementedError:
@@ -529,7 +640,7 @@ class Milvus(MilvusLangchain):
             insert_list = [insert_dict[x][i:end] for x in self.fields if x in insert_dict]
             # Insert into the collection.
             try:
-                res = self.col.insert(insert_list, timeout=timeout, **kwargs)
+                res = self._call_collection(lambda: self.col.insert(insert_list, timeout=timeout, **kwargs))
                 pks.extend(res.primary_keys)
             except ConnectionNotExistException as e:
                 logger.warning(f'retrying connection to milvus {e}')
@@ -701,9 +812,6 @@ class Milvus(MilvusLangchain):
             logger.debug('No existing collection to search.')
             return []
 
-        if param is None:
-            param = self.search_params
-
         # Determine result metadata fields.
         output_fields = self.fields[:]
         output_fields.remove(self._vector_field)
@@ -720,16 +828,16 @@ class Milvus(MilvusLangchain):
             expr = self.metadata_expr
 
         # Perform the search.
-        res = self.col.search(
+        res = self._call_collection(lambda: self.col.search(
             data=[embedding],
             anns_field=self._vector_field,
-            param=param,
+            param=param if param is not None else self.search_params,
             limit=k,
             expr=expr,
             output_fields=output_fields,
             timeout=timeout,
             **kwargs,
-        )
+        ))
         # Organize results.
         ret = []
         for result in res[0]:
@@ -832,24 +940,21 @@ class Milvus(MilvusLangchain):
             logger.debug('No existing collection to search.')
             return []
 
-        if param is None:
-            param = self.search_params
-
         # Determine result metadata fields.
         output_fields = self.fields[:]
         output_fields.remove(self._vector_field)
 
         # Perform the search.
-        res = self.col.search(
+        res = self._call_collection(lambda: self.col.search(
             data=[embedding],
             anns_field=self._vector_field,
-            param=param,
+            param=param if param is not None else self.search_params,
             limit=fetch_k,
             expr=expr,
             output_fields=output_fields,
             timeout=timeout,
             **kwargs,
-        )
+        ))
         # Organize results.
         ids = []
         documents = []
@@ -861,11 +966,11 @@ class Milvus(MilvusLangchain):
             scores.append(result.score)
             ids.append(result.id)
 
-        vectors = self.col.query(
+        vectors = self._call_collection(lambda: self.col.query(
             expr=f'{self._primary_field} in {ids}',
             output_fields=[self._primary_field, self._vector_field],
             timeout=timeout,
-        )
+        ))
         # Reorganize the results from query to match search order.
         vectors = {x[self._primary_field]: x[self._vector_field] for x in vectors}
 
@@ -950,13 +1055,13 @@ class Milvus(MilvusLangchain):
     def query(self, expr: str, timeout: Optional[int] = None, **kwargs: Any) -> List[Document]:
         output_fields = self.fields[:]
         output_fields.remove(self._vector_field)
-        res = self.col.query(
+        res = self._call_collection(lambda: self.col.query(
             expr=expr,
             output_fields=output_fields,
             timeout=timeout,
             limit=1,
             **kwargs,
-        )
+        ))
         # Organize results.
         ret = []
         for result in res:
@@ -0,0 +1,95 @@
+"""
+ElemCharacterTextSplitter.create_documents 的性能测试
+构造一个多页的版面分析结果文档（每个元素带有bbox、page、index、type），对比逐个chunk深拷贝元数据的旧实现
+
+python benchmark_elem_character_text_splitter.py --pages 500 --elems 40 --no_legacy
+旧实现每个chunk都深拷贝整个文档的元数据，内存和耗时随页数平方增长，对比时使用较少的页数，如 --pages 30
+"""
+import argparse
+import copy
+import random
+import time
+from collections import Counter
+
+from langchain.docstore.document import Document
+
+from bisheng_langchain.text_splitter import ElemCharacterTextSplitter, IntervalSearch
+
+CHARS = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严'
+TYPES = ['Title', 'Paragraph', 'Table', 'Paragraph', 'Paragraph']
+
+
+def build_layout_document(pages: int, elems_per_page: int, seed: int = 0) -> Document:
+    random.seed(seed)
+    doc_content = []
+    metadata = dict(bboxes=[], pages=[], indexes=[], types=[], source='benchmark.pdf')
+    offset = 0
+    for page in range(1, pages + 1):
+        for _ in range(elems_per_page):
+            text = ''.join(random.choice(CHARS) for _ in range(random.randint(20, 300))) + '\n\n'
+            doc_content.append(text)
+            metadata['bboxes'].append([random.randint(0, 500) for _ in range(4)])
+            metadata['pages'].append(page)
+            metadata['types'].append(random.choice(TYPES))
+            metadata['indexes'].append([offset, offset + len(text) - 1])
+            offset += len(text)
+    return Document(page_content=''.join(doc_content), metadata=metadata)
+
+
+def legacy_create_documents(splitter: ElemCharacterTextSplitter, texts, metadatas):
+    """ 旧的实现：逐个chunk深拷贝元数据，并在原文中查找chunk的位置 """
+    documents = []
+    for i, text in enumerate(texts):
+        index = -1
+        indexes = metadatas[i].get('indexes', [])
+        pages = metadatas[i].get('pages', [])
+        types = metadatas[i].get('types', [])
+        bboxes = metadatas[i].get('bboxes', [])
+        searcher = IntervalSearch(indexes)
+        for chunk in splitter.split_text(text):
+            new_metadata = copy.deepcopy(metadatas[i])
+            index = text.find(chunk, index + 1)
+            norm_inter = searcher.find([index, index + len(chunk) - 1])
+            new_metadata['chunk_bboxes'] = [{'page': pages[j], 'bbox': bboxes[j]}
+                                            for j in range(norm_inter[0], norm_inter[1] + 1)]
+            new_metadata['chunk_type'] = Counter([types[j] for j in norm_inter]).most_common(1)[0][0]
+            new_metadata['source'] = metadatas[i].get('source', '')
+            documents.append(Document(page_content=chunk, metadata=new_metadata))
+    return documents
+
+
+def run_benchmark(pages: int, elems_per_page: int, chunk_size: int, chunk_overlap: int, legacy: bool):
+    doc = build_layout_document(pages, elems_per_page)
+    splitter = ElemCharacterTextSplitter(separators=['\n\n', '\n', '。', ''],
+                                         separator_rule=['after', 'after', 'after', 'after'],
+                                         chunk_size=chunk_size,
+                                         chunk_overlap=chunk_overlap,
+                                         is_separator_regex=True)
+    print(f'pages={pages} elems={len(doc.metadata["indexes"])} text_len={len(doc.page_content)}')
+
+    start = time.perf_counter()
+    split_docs = splitter.split_documents([doc])
+    cost = time.perf_counter() - start
+    print(f'create_documents: chunks={len(split_docs)} cost={cost:.3f}s')
+
+    if legacy:
+        start = time.perf_counter()
+        legacy_docs = legacy_create_documents(splitter, [doc.page_content], [doc.metadata])
+        legacy_cost = time.perf_counter() - start
+        print(f'legacy create_documents: chunks={len(legacy_docs)} cost={legacy_cost:.3f}s '
+              f'speedup={legacy_cost / cost:.1f}x')
+        same = all(one.page_content == two.page_content
+                   and one.metadata['chunk_bboxes'] == two.metadata['chunk_bboxes']
+                   for one, two in zip(split_docs, legacy_docs))
+        print(f'same chunk_bboxes as legacy: {same and len(split_docs) == len(legacy_docs)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--elems', type=int, default=40, help='每页的元素数')
+    parser.add_argument('--chunk_size', type=int, default=500)
+    parser.add_argument('--chunk_overlap', type=int, default=0)
+    parser.add_argument('--no_legacy', action='store_true', help='不运行旧实现的对比')
+    args = parser.parse_args()
+    run_benchmark(args.pages, args.elems, args.chunk_size, args.chunk_overlap, not args.no_legacy)